@@ -12,9 +12,21 @@ from flask import Flask, render_template, request, redirect, url_for, flash, jso
 import models
 import cv_utils
 import email_utils
+import mail_stats_utils
+import mail_pool_utils
+import mail_listener_utils
 import rag_utils
 import audio_utils
 import translation_utils
+import http_utils
+import ingest_utils
+import doc_pipeline
+import metrics_utils
+import db_utils
+import page_utils
+import rollup_utils
+import rerank_utils
+import context_utils
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 
@@ -30,7 +42,12 @@ DB_PATH = "ai_secretary_app.db"
 
 # Init components
 SessionLocal = models.init_db(DB_PATH)
+db_utils.init_app(app, SessionLocal)
 rag_utils.init_chroma()
+ingest_utils.start_workers(SessionLocal)
+doc_pipeline.init(SessionLocal)
+rollup_utils.init(SessionLocal)
+mail_listener_utils.init(SessionLocal)
 # rag_utils.init_llm() # Uncomment to load heavy LLM, or let it fallback
 
 # Global email creds (per session/lifetime of app for now, as per original script design)
@@ -46,67 +63,38 @@ EMAIL_CONFIG = {
 
 @app.route('/')
 def index():
-    db = SessionLocal()
+    db = db_utils.get_db()
     
-    # Live Analytics Data - All metrics are real and measurable
-    total_contacts = db.query(models.Contact).count()
-    total_tasks = db.query(models.Task).count()
-    upcoming_meetings = db.query(models.Meeting).filter(models.Meeting.date_time > datetime.now()).count()
-    
-    # Today's completed tasks
-    today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
-    completed_today = db.query(models.Task).filter(
-        models.Task.status == "Completed",
-        models.Task.due_date >= today_start.date()
-    ).count()
-    
-    # Pending tasks
-    pending_tasks = db.query(models.Task).filter(models.Task.status == "Pending").count()
-    
-    # Total voicemails received
-    total_voicemails = db.query(models.Voicemail).count()
-    
-    # Total call logs
-    total_calls = db.query(models.CallLog).count()
-    
-    # Unread messages
-    unread_messages = db.query(models.Message).filter(models.Message.read == False).count()
-    
-    # Total expenses tracked
-    total_expenses = db.query(models.Expense).count()
+    # Live Analytics Data - one aggregate query, cached and updated on writes
+    metrics = metrics_utils.get_metrics(db)
     
     # Recent logs
     recent_logs = db.query(models.LogEntry).order_by(models.LogEntry.timestamp.desc()).limit(5).all()
     
     # Chart Data (Real task distribution)
     task_dist = {
-        "Pending": pending_tasks,
-        "In Progress": db.query(models.Task).filter(models.Task.status == "In Progress").count(),
-        "Completed": db.query(models.Task).filter(models.Task.status == "Completed").count()
+        "Pending": metrics["pending_tasks"],
+        "In Progress": metrics["in_progress_tasks"],
+        "Completed": metrics["completed_tasks"]
     }
     
-    db.close()
-    
     return render_template('index.html', 
-                          total_contacts=total_contacts,
-                          total_tasks=total_tasks,
-                          upcoming_meetings=upcoming_meetings,
-                          completed_today=completed_today,
-                          pending_tasks=pending_tasks,
-                          total_voicemails=total_voicemails,
-                          total_calls=total_calls,
-                          unread_messages=unread_messages,
-                          total_expenses=total_expenses,
+                          total_contacts=metrics["total_contacts"],
+                          total_tasks=metrics["total_tasks"],
+                          upcoming_meetings=metrics["upcoming_meetings"],
+                          completed_today=metrics["completed_today"],
+                          pending_tasks=metrics["pending_tasks"],
+                          total_voicemails=metrics["total_voicemails"],
+                          total_calls=metrics["total_calls"],
+                          unread_messages=metrics["unread_messages"],
+                          total_expenses=metrics["total_expenses"],
                           recent_logs=recent_logs,
                           task_dist=task_dist)
 
 
-FETCHED_EMAILS = {}
-
 @app.route('/email', methods=['GET', 'POST'])
 def email_page():
-    db = SessionLocal()
+    db = db_utils.get_db()
     accounts = db.query(models.EmailAccount).all()
     
     account_id = request.args.get('account_id') or request.form.get('account_id')
@@ -140,20 +128,19 @@ def email_page():
                 flash("Account added successfully.", "success")
                 return redirect(url_for('email_page', account_id=acc.id))
             except Exception as e:
+                db_utils.rollback()
                 flash(f"Error adding account: {e}", "danger")
                 
         elif 'fetch' in request.form and active_account:
-            limit = int(request.form.get('limit', 20))
-            emails, err = email_utils.fetch_emails(
-                active_account.imap_host, active_account.imap_port,
-                active_account.email, active_account.password, limit
-            )
-            if err:
-                flash(f"Error fetching emails: {err}", "danger")
+            # Pull only messages newer than the last sync into the local mail store
+            result = email_utils.sync_mailbox(db, active_account)
+            if result["error"]:
+                flash(f"Error fetching emails: {result['error']}", "danger")
             else:
-                FETCHED_EMAILS[active_account.id] = emails
-                # Update stats for this account immediately
-                stats = email_utils.get_mail_stats(active_account.imap_host, active_account.imap_port, active_account.email, active_account.password)
+                flash(f"{result['new']} new message(s).", "success")
+                # Counts changed: refresh this account's sidebar stats in the background
+                mail_stats_utils.refresh([active_account])
+                mail_listener_utils.notify()
                 
         elif 'send' in request.form:
             account_id_send = request.form.get('account_id')
@@ -179,29 +166,36 @@ def email_page():
             if request.headers.get('Referer'):
                 return redirect(request.headers.get('Referer'))
 
-    # Get stats for all accounts (for sidebar)
-    account_stats = {}
-    for acc in accounts:
-        # Optimized: Only fetch if we don't have recent stats or for active account? 
-        # For now, fetch live. If slow, user can comment out.
-        stats = email_utils.get_mail_stats(acc.imap_host, acc.imap_port, acc.email, acc.password)
-        account_stats[acc.id] = stats
+    # Sidebar stats come from the cache; stale accounts refresh in the background
+    account_stats = mail_stats_utils.get_all(accounts)
 
-    # Get emails for view
+    # Emails for view come from the local mail store
     emails = []
+    page = None
     if active_account:
-        emails = FETCHED_EMAILS.get(active_account.id, [])
+        query = email_utils.mailbox_query(db, active_account.id)
+        limit = page_utils.page_limit(request.args.get('limit'), 50)
+        try:
+            page = page_utils.keyset_page(query, models.MailMessage.sent_date, models.MailMessage.id, cursor=request.args.get('cursor'), limit=limit)
+        except page_utils.InvalidCursor:
+            flash("That page link has expired; showing the first page.", "info")
+            page = page_utils.keyset_page(query, models.MailMessage.sent_date, models.MailMessage.id, limit=limit)
+        emails = page["items"]
         
     active_email = None
-    email_idx = request.args.get('email_idx')
-    if email_idx is not None and emails:
-        try:
-            active_email = emails[int(email_idx)]
-        except:
-            pass
+    active_body = ""
+    email_id = request.args.get('email_id', type=int)
+    if email_id is not None and active_account:
+        active_email = email_utils.mailbox_query(db, active_account.id).filter(models.MailMessage.id == email_id).first()
+        if active_email:
+            # The list only has headers; the text part is fetched on first open
+            active_body, err = email_utils.get_body(db, active_account, active_email)
+            if err:
+                flash(f"Could not load message: {err}", "danger")
 
-    db.close()
-    return render_template('email.html', accounts=accounts, active_account=active_account, emails=emails, active_email=active_email, active_email_idx=int(email_idx) if email_idx is not None else None, account_stats=account_stats)
+    return render_template('email.html', accounts=accounts, active_account=active_account, emails=emails, page=page,
+                           pager_args={'account_id': active_account.id} if active_account else {},
+                           active_email=active_email, active_body=active_body, active_email_id=email_id, account_stats=account_stats)
 
 @app.route('/api/draft_email', methods=['POST'])
 def draft_email_api():
@@ -217,9 +211,43 @@ def draft_email_api():
         {"role": "user", "content": user_content}
     ]
     
-    draft = rag_utils.safe_call_llm(msgs, max_new_tokens=300)
+    draft = rag_utils.safe_call_llm(msgs, max_new_tokens=300, route="email_draft")
     return jsonify({'draft': draft})
 
+@app.route('/api/stats')
+def stats_api():
+    """Runtime counters for the outbound API client and caches"""
+    return jsonify({
+        'http': http_utils.get_stats(),
+        'embedding_provider': rag_utils.embedding_provider.describe() if rag_utils.embedding_provider else None,
+        'embedding_cache': rag_utils.embedding_cache.stats() if rag_utils.embedding_cache else None,
+        'answer_cache': rag_utils.answer_cache.stats() if rag_utils.answer_cache else None,
+        'lexical_index': rag_utils.lexical_index.stats() if rag_utils.lexical_index else None,
+        'rerank': rerank_utils.get_stats(),
+        'llm': context_utils.get_stats(),
+        'extraction_cache': cv_utils.get_extraction_cache().stats(),
+        'mail_body_cache': email_utils.body_cache.stats(),
+        'mail_stats': mail_stats_utils.get_stats(),
+        'mail_pool': mail_pool_utils.get_stats(),
+        'mail_listener': mail_listener_utils.get_stats(),
+        'metrics': metrics_utils.get_stats(),
+        'queries': db_utils.profiler_stats()
+    })
+
+@app.route('/api/ingest')
+def ingest_status_api():
+    """Indexing queue depth and the most recent jobs"""
+    db = db_utils.get_db()
+    return jsonify(ingest_utils.queue_stats(db))
+
+@app.route('/api/ingest/<int:job_id>')
+def ingest_job_api(job_id):
+    db = db_utils.get_db()
+    job = db.query(models.IndexJob).get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(ingest_utils.job_to_dict(job))
+
 @app.route('/ai-assistant')
 def ai_assistant():
     return render_template('ai_assistant.html')
@@ -234,7 +262,7 @@ def ai_assistant_api():
     user_message = data.get('message', '')
     history = data.get('history', [])
     
-    db = SessionLocal()
+    db = db_utils.get_db()
     
     try:
         # Detect intent and extract entities
@@ -251,7 +279,7 @@ ENTITIES: [relevant data like dates, names, amounts, etc.]
             {"role": "user", "content": intent_prompt}
         ]
         
-        intent_response = rag_utils.safe_call_llm(intent_msgs, max_new_tokens=150)
+        intent_response = rag_utils.safe_call_llm(intent_msgs, max_new_tokens=150, route="intent")
         
         # Parse intent
         intent = "general_question"
@@ -386,23 +414,23 @@ ENTITIES: [relevant data like dates, names, amounts, etc.]
             
             context = "\n".join(context_parts)
             
-            # Try RAG first
-            rag_answer = rag_utils.ask_seva_sakha(user_message, scope="all")
+            # Memory passages go into this one prompt (no nested RAG answer call)
+            system_prompt = "You are a helpful AI secretary assistant. Provide concise, friendly responses."
+            instruction = f"User question: {user_message}\n\nContext:\n{context}\n\nMemory:\n\n\nProvide a helpful response:"
+            passages = rag_utils.memory_passages(rag_utils.retrieve(user_message, scope="all"))
+            memory = context_utils.build_context("chat", passages, reserved=[system_prompt, instruction], ranked=True) or "Nothing relevant found."
             
-            # Enhance with LLM
             enhance_msgs = [
-                {"role": "system", "content": "You are a helpful AI secretary assistant. Provide concise, friendly responses."},
-                {"role": "user", "content": f"User question: {user_message}\n\nContext:\n{context}\n\nRAG Answer: {rag_answer}\n\nProvide a helpful response:"}
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"User question: {user_message}\n\nContext:\n{context}\n\nMemory:\n{memory}\n\nProvide a helpful response:"}
             ]
             
-            response_text = rag_utils.safe_call_llm(enhance_msgs, max_new_tokens=300)
+            response_text = rag_utils.safe_call_llm(enhance_msgs, max_new_tokens=300, route="chat")
             
             # Add helpful actions
             actions.append({"label": "Dashboard", "url": "/"})
             actions.append({"label": "Search Documents", "url": "/chat"})
         
-        db.close()
-        
         return jsonify({
             'response': response_text,
             'actions': actions,
@@ -410,7 +438,7 @@ ENTITIES: [relevant data like dates, names, amounts, etc.]
         })
         
     except Exception as e:
-        db.close()
+        db_utils.rollback()
         print(f"AI Assistant Error: {e}")
         return jsonify({
             'response': f"I encountered an error: {str(e)}. Please try rephrasing your question.",
@@ -419,9 +447,42 @@ ENTITIES: [relevant data like dates, names, amounts, etc.]
         })
 
 
+# Keyset-paginated lists: name -> (model, ordered column, descending)
+LIST_PAGES = {
+    "contacts": (models.Contact, models.Contact.name, False),
+    "voicemails": (models.Voicemail, models.Voicemail.received_date, True),
+    "expenses": (models.Expense, models.Expense.date, True),
+    "messages": (models.Message, models.Message.message_date, True),
+    "calls": (models.CallLog, models.CallLog.call_date, True)
+}
+
+def list_page(db, name: str, default_limit: int = page_utils.PAGE_SIZE, strict: bool = False) -> dict:
+    """Page of a list from ?cursor=&limit=. A bad cursor falls back to the first
+    page for HTML views; with strict=True it raises InvalidCursor instead."""
+    model, column, desc = LIST_PAGES[name]
+    limit = page_utils.page_limit(request.args.get('limit'), default_limit)
+    cursor = request.args.get('cursor')
+    try:
+        return page_utils.keyset_page(db.query(model), column, model.id, cursor=cursor, limit=limit, desc=desc)
+    except page_utils.InvalidCursor:
+        if strict:
+            raise
+        flash("That page link has expired; showing the first page.", "info")
+        return page_utils.keyset_page(db.query(model), column, model.id, limit=limit, desc=desc)
+
+@app.route('/api/<any(contacts, voicemails, expenses, messages, calls):name>')
+def list_api(name):
+    """Cursor-paginated list. Query args: cursor (next_cursor of the previous page), limit."""
+    db = db_utils.get_db()
+    try:
+        page = list_page(db, name, strict=True)
+    except page_utils.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page_utils.page_to_json(page))
+
 @app.route('/voicemail', methods=['GET', 'POST'])
 def voicemail():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         caller_name = request.form.get('caller_name', 'Unknown')
         caller_number = request.form.get('caller_number', '')
@@ -435,36 +496,36 @@ def voicemail():
             duration=int(duration)
         )
         db.add(vm)
-        db.commit()
-        db.refresh(vm)
+        db.flush()
         
-        # Index to RAG
+        # Queue for RAG indexing (committed together with the voicemail)
         vm_text = f"Voicemail from {caller_name}:\nPhone: {caller_number}\nDuration: {duration} seconds\n\nTranscription:\n{transcription}"
-        rag_utils.index_into_memory("voicemail", f"VM from {caller_name}", vm_text, extra_meta={"caller": caller_name, "caller_number": caller_number, "duration": duration})
+        ingest_utils.enqueue(db, "voicemail", f"VM from {caller_name}", vm_text, extra_meta={"caller": caller_name, "caller_number": caller_number, "duration": duration}, source_id=vm.id)
+        db.commit()
         
-        flash("Voicemail logged and indexed.", "success")
+        flash("Voicemail logged and queued for indexing.", "success")
         return redirect(url_for('voicemail'))
     
-    voicemails = db.query(models.Voicemail).order_by(models.Voicemail.received_date.desc()).all()
+    page = list_page(db, "voicemails")
     accounts = db.query(models.EmailAccount).all()
-    db.close()
-    return render_template('voicemail.html', voicemails=voicemails, accounts=accounts)
+    return render_template('voicemail.html', voicemails=page["items"], page=page, accounts=accounts,
+                           total_voicemails=metrics_utils.get_metrics(db)["total_voicemails"])
 
 @app.route('/voicemail/delete/<int:vm_id>', methods=['POST'])
 def delete_voicemail(vm_id):
-    db = SessionLocal()
+    db = db_utils.get_db()
     try:
         vm = db.query(models.Voicemail).get(vm_id)
         if vm:
             db.delete(vm)
             db.commit()
+            rag_utils.remove_from_memory("voicemail", vm_id)
             flash("Voicemail archived.", "success")
         else:
             flash("Voicemail not found.", "danger")
     except Exception as e:
+        db_utils.rollback()
         flash(f"Error deleting voicemail: {e}", "danger")
-    finally:
-        db.close()
     return redirect(url_for('voicemail'))
 
 @app.route('/chat', methods=['GET', 'POST'])
@@ -490,8 +551,6 @@ def chat():
 
 @app.route('/documents', methods=['GET', 'POST'])
 def documents():
-    summary = ""
-    index_msg = ""
     if request.method == 'POST':
         file = request.files.get('file')
         if file and file.filename:
@@ -499,27 +558,31 @@ def documents():
             path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(path)
             
-            # Extract
-            text = cv_utils.extract_pdf_with_ocr(path)
-            if not text.strip():
-                flash("No readable text extracted.", "danger")
-            else:
-                # Index
-                index_msg = rag_utils.index_into_memory("document", filename, text)
-                flash(index_msg, "success")
-                
-                # Summarize
-                msgs = [
-                    {"role": "system", "content": rag_utils.SYSTEM_PROMPT},
-                    {"role": "user", "content": f"Provide executive summary (3 bullets + 3 risks + 3 actions):\n\n{text[:8000]}"}
-                ]
-                summary = rag_utils.safe_call_llm(msgs, max_new_tokens=500)
-                
-    return render_template('documents.html', summary=summary, index_msg=index_msg)
+            # Extract -> chunk -> embed -> summarize runs in the background
+            job_id = doc_pipeline.submit(filename, path, "document", summarize=True)
+            flash(f"Processing '{filename}' in the background (job #{job_id}).", "info")
+            return redirect(url_for('documents', job_id=job_id))
+    
+    job = None
+    job_id = request.args.get('job_id', type=int)
+    if job_id:
+        db = db_utils.get_db()
+        found = db.query(models.DocumentJob).get(job_id)
+        job = doc_pipeline.job_to_dict(found) if found else None
+    return render_template('documents.html', job=job)
+
+@app.route('/api/documents/<int:job_id>')
+def document_job_api(job_id):
+    """Status, progress and partial results of a document job"""
+    db = db_utils.get_db()
+    job = db.query(models.DocumentJob).get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(doc_pipeline.job_to_dict(job))
 
 @app.route('/contacts', methods=['GET', 'POST'])
 def contacts():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         name = request.form.get('name')
         email = request.form.get('email')
@@ -529,18 +592,17 @@ def contacts():
         
         c = models.Contact(name=name, email=email, organization=org, role=role, notes=notes)
         db.add(c)
-        db.commit()
-        db.refresh(c)
+        db.flush()
         
-        # Index
+        # Queue for indexing
         full = f"Name: {name}\nEmail: {email}\nOrg: {org}\nRole: {role}\nNotes:\n{notes}"
-        rag_utils.index_into_memory("contact", name, full, extra_meta={"contact_id": c.id})
+        ingest_utils.enqueue(db, "contact", name, full, extra_meta={"contact_id": c.id}, source_id=c.id)
+        db.commit()
         
-        flash("Contact added and indexed.", "success")
+        flash("Contact added and queued for indexing.", "success")
         
-    contacts_list = db.query(models.Contact).order_by(models.Contact.name).all()
-    db.close()
-    return render_template('contacts.html', contacts=contacts_list)
+    page = list_page(db, "contacts")
+    return render_template('contacts.html', contacts=page["items"], page=page)
 
 @app.route('/knowledge', methods=['GET', 'POST'])
 def knowledge_hub():
@@ -563,19 +625,15 @@ def knowledge_hub():
                 path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(path)
                 
-                # Use existing extraction logic
-                text = cv_utils.extract_pdf_with_ocr(path)
-                if text.strip():
-                    msg = rag_utils.index_into_memory("document", filename, text)
-                    flash(msg, "success")
-                else:
-                    flash("Could not extract text from document.", "danger")
+                # Same background pipeline as /documents, without the summary
+                job_id = doc_pipeline.submit(filename, path, "document", summarize=False)
+                flash(f"Indexing '{filename}' in the background (job #{job_id}).", "success")
         
     return render_template('knowledge.html')
 
 @app.route('/items', methods=['GET', 'POST'])
 def items():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         type_ = request.form.get('type') # meeting, decision, travel
         
@@ -590,17 +648,18 @@ def items():
                 dt = datetime.fromisoformat(date_str) if date_str else datetime.now()
                 m = models.Meeting(title=title, date_time=dt, participants=participants, notes=notes)
                 db.add(m)
+                db.flush()
                 
                 # Log it
                 log = models.LogEntry(event_type="meeting_added", description=f"Scheduled: {title}")
                 db.add(log)
-                db.commit()
-                db.refresh(m)
                 
                 meeting_text = f"Meeting: {title}\nDate: {dt.strftime('%Y-%m-%d %H:%M')}\nParticipants: {participants}\n\nNotes:\n{notes}"
-                res = rag_utils.index_into_memory("meeting", title, meeting_text, extra_meta={"participants": participants, "meeting_date": dt.strftime('%Y-%m-%d %H:%M')})
-                flash(res, "info")
+                ingest_utils.enqueue(db, "meeting", title, meeting_text, extra_meta={"participants": participants, "meeting_date": dt.strftime('%Y-%m-%d %H:%M')}, source_id=m.id)
+                db.commit()
+                flash(f"Meeting '{title}' saved and queued for indexing.", "info")
             except Exception as e:
+                db_utils.rollback()
                 flash(f"Error: {e}", "danger")
                 
         elif type_ == 'decision':
@@ -611,15 +670,16 @@ def items():
                 d_date = datetime.strptime(date, '%Y-%m-%d').date() if date else datetime.now().date()
                 d = models.Decision(title=title, date=d_date, description=text)
                 db.add(d)
+                db.flush()
                 log = models.LogEntry(event_type="decision_made", description=f"Decision: {title}")
                 db.add(log)
-                db.commit()
-                db.refresh(d)
                 
                 decision_text = f"Decision: {title}\nDate: {d_date.strftime('%Y-%m-%d')}\n\nDetails:\n{text}"
-                res = rag_utils.index_into_memory("decision", title, decision_text, extra_meta={"decision_date": d_date.strftime('%Y-%m-%d')})
-                flash(res, "info")
+                ingest_utils.enqueue(db, "decision", title, decision_text, extra_meta={"decision_date": d_date.strftime('%Y-%m-%d')}, source_id=d.id)
+                db.commit()
+                flash(f"Decision '{title}' saved and queued for indexing.", "info")
             except Exception as e:
+                db_utils.rollback()
                 flash(f"Error: {e}", "danger")
                 
         elif type_ == 'travel':
@@ -632,13 +692,14 @@ def items():
                 end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else None
                 t = models.Travel(title=title, start_date=start_date, end_date=end_date, details=details)
                 db.add(t)
-                db.commit()
-                db.refresh(t)
+                db.flush()
                 
                 travel_text = f"Trip: {title}\nStart Date: {start}\nEnd Date: {end}\n\nDetails:\n{details}"
-                res = rag_utils.index_into_memory("travel", title, travel_text, extra_meta={"travel_start": start, "travel_end": end})
-                flash(res, "info")
+                ingest_utils.enqueue(db, "travel", title, travel_text, extra_meta={"travel_start": start, "travel_end": end}, source_id=t.id)
+                db.commit()
+                flash(f"Trip '{title}' saved and queued for indexing.", "info")
             except Exception as e:
+                db_utils.rollback()
                 flash(f"Error: {e}", "danger")
                 
         elif type_ == 'task':
@@ -649,22 +710,22 @@ def items():
                 due = datetime.strptime(due_date_str, '%Y-%m-%d').date() if due_date_str else None
                 task = models.Task(title=title, status="Pending", priority=priority, due_date=due)
                 db.add(task)
-                db.commit()
-                db.refresh(task)
+                db.flush()
                 
                 task_text = f"Task: {title}\nPriority: {priority}\nDue Date: {due_date_str}\nStatus: Pending"
-                rag_utils.index_into_memory("task", title, task_text, extra_meta={"priority": priority, "due_date": due_date_str})
+                ingest_utils.enqueue(db, "task", title, task_text, extra_meta={"priority": priority, "due_date": due_date_str}, source_id=task.id)
+                db.commit()
                 
                 flash("Task added successfully.", "success")
             except Exception as e:
+                db_utils.rollback()
                 flash(f"Error adding task: {e}", "danger")
     
-    db.close()
     return render_template('items.html')
 
 @app.route('/calls', methods=['GET', 'POST'])
 def call_handler():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         caller_name = request.form.get('caller_name')
         caller_number = request.form.get('caller_number')
@@ -672,46 +733,44 @@ def call_handler():
         notes = request.form.get('notes')
         call = models.CallLog(caller_name=caller_name, caller_number=caller_number, duration=int(duration), call_date=datetime.now(), notes=notes)
         db.add(call)
-        db.commit()
-        db.refresh(call)
+        db.flush()
         
-        # Index to RAG
+        # Queue for RAG indexing
         call_text = f"Phone Call Log:\nCaller: {caller_name}\nNumber: {caller_number}\nDuration: {duration} seconds\nDate: {datetime.now().strftime('%Y-%m-%d %H:%M')}\nNotes: {notes}"
-        rag_utils.index_into_memory("call_log", f"Call from {caller_name}", call_text, extra_meta={"caller": caller_name, "caller_number": caller_number, "duration": duration})
+        ingest_utils.enqueue(db, "call_log", f"Call from {caller_name}", call_text, extra_meta={"caller": caller_name, "caller_number": caller_number, "duration": duration}, source_id=call.id)
+        db.commit()
         
         flash("Call logged.", "success")
     
-    call_logs = db.query(models.CallLog).order_by(models.CallLog.call_date.desc()).limit(20).all()
-    db.close()
-    return render_template('calls.html', call_logs=call_logs)
+    page = list_page(db, "calls", default_limit=20)
+    return render_template('calls.html', call_logs=page["items"], page=page)
 
 @app.route('/messages', methods=['GET', 'POST'])
 def messages():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         sender = request.form.get('sender')
         content = request.form.get('content')
         msg_type = request.form.get('type', 'sms')
         msg = models.Message(sender=sender, content=content, message_type=msg_type, message_date=datetime.now())
         db.add(msg)
-        db.commit()
-        db.refresh(msg)
+        db.flush()
         
-        # Index to RAG
+        # Queue for RAG indexing
         msg_text = f"Message from {sender} ({msg_type}):\n{content}"
-        rag_utils.index_into_memory("message", f"Message from {sender}", msg_text, extra_meta={"sender": sender, "message_type": msg_type, "message_date": datetime.now().strftime('%Y-%m-%d %H:%M')})
+        ingest_utils.enqueue(db, "message", f"Message from {sender}", msg_text, extra_meta={"sender": sender, "message_type": msg_type, "message_date": datetime.now().strftime('%Y-%m-%d %H:%M')}, source_id=msg.id)
+        db.commit()
         
         flash("Message logged.", "success")
     
-    message_list = db.query(models.Message).order_by(models.Message.message_date.desc()).limit(20).all()
-    db.close()
-    return render_template('messages.html', messages=message_list)
+    page = list_page(db, "messages", default_limit=20)
+    return render_template('messages.html', messages=page["items"], page=page)
 
 
 
 @app.route('/calendar', methods=['GET', 'POST'])
 def calendar():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         title = request.form.get('title')
         date_str = request.form.get('date')
@@ -723,24 +782,24 @@ def calendar():
             dt = datetime.fromisoformat(date_str) if date_str else datetime.now()
             event = models.CalendarEvent(title=title, event_date=dt, duration=int(duration), description=description, attendees=attendees, location=location)
             db.add(event)
-            db.commit()
-            db.refresh(event)
+            db.flush()
             
-            # Index to RAG
+            # Queue for RAG indexing
             event_text = f"Calendar Event: {title}\nDate: {dt.strftime('%Y-%m-%d %H:%M')}\nDuration: {duration} minutes\nLocation: {location}\nAttendees: {attendees}\nDescription: {description}"
-            rag_utils.index_into_memory("calendar_event", title, event_text, extra_meta={"event_date": dt.strftime('%Y-%m-%d'), "duration": duration, "location": location, "attendees": attendees})
+            ingest_utils.enqueue(db, "calendar_event", title, event_text, extra_meta={"event_date": dt.strftime('%Y-%m-%d'), "duration": duration, "location": location, "attendees": attendees}, source_id=event.id)
+            db.commit()
             
             flash("Event added to calendar.", "success")
         except Exception as e:
+            db_utils.rollback()
             flash(f"Error: {e}", "danger")
     
     events = db.query(models.CalendarEvent).filter(models.CalendarEvent.event_date >= datetime.now()).order_by(models.CalendarEvent.event_date).limit(20).all()
-    db.close()
     return render_template('calendar.html', events=events)
 
 @app.route('/expenses', methods=['GET', 'POST'])
 def expenses():
-    db = SessionLocal()
+    db = db_utils.get_db()
     if request.method == 'POST':
         title = request.form.get('title')
         amount = request.form.get('amount', 0)
@@ -751,21 +810,21 @@ def expenses():
             d = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else datetime.now().date()
             exp = models.Expense(title=title, amount=float(amount), category=category, date=d, notes=notes)
             db.add(exp)
-            db.commit()
-            db.refresh(exp)
+            db.flush()
             
-            # Index to RAG
+            # Queue for RAG indexing
             exp_text = f"Expense: {title}\nAmount: ${amount}\nCategory: {category}\nDate: {d.strftime('%Y-%m-%d')}\nNotes: {notes}"
-            rag_utils.index_into_memory("expense", title, exp_text, extra_meta={"amount": amount, "category": category, "expense_date": d.strftime('%Y-%m-%d')})
+            ingest_utils.enqueue(db, "expense", title, exp_text, extra_meta={"amount": amount, "category": category, "expense_date": d.strftime('%Y-%m-%d')}, source_id=exp.id)
+            db.commit()
             
             flash("Expense logged.", "success")
         except Exception as e:
+            db_utils.rollback()
             flash(f"Error: {e}", "danger")
     
-    expense_list = db.query(models.Expense).order_by(models.Expense.date.desc()).limit(50).all()
-    total = sum(e.amount for e in expense_list) if expense_list else 0
-    db.close()
-    return render_template('expenses.html', expenses=expense_list, total=total)
+    page = list_page(db, "expenses", default_limit=50)
+    total = rollup_utils.expense_totals(db)["amount"]
+    return render_template('expenses.html', expenses=page["items"], page=page, total=total)
 
 @app.route('/research', methods=['GET', 'POST'])
 def research():
@@ -778,22 +837,25 @@ def research():
         query = request.form.get('query', '')
         
         if query and topic:
-            # First search internal memory
-            internal_answer = rag_utils.ask_seva_sakha(query, scope="all")
+            # Put the relevant memory passages straight into the research prompt,
+            # within its token budget, instead of a separately generated answer
+            system_prompt = "You are a research assistant. Provide comprehensive, well-structured research findings."
+            instruction = f"Topic: {topic}\n\nQuery: {query}\n\nInternal Research:\n\n\nProvide a detailed research report with key findings, recommendations, and action items."
+            passages = rag_utils.memory_passages(rag_utils.retrieve(f"{topic} {query}", scope="all"))
+            internal = context_utils.build_context("research", passages, reserved=[system_prompt, instruction], ranked=True) or "No relevant internal records."
             
-            # Then ask Mistral for synthesis
             messages = [
                 {
                     "role": "system",
-                    "content": "You are a research assistant. Provide comprehensive, well-structured research findings."
+                    "content": system_prompt
                 },
                 {
                     "role": "user",
-                    "content": f"Topic: {topic}\n\nQuery: {query}\n\nInternal Research:\n{internal_answer}\n\nProvide a detailed research report with key findings, recommendations, and action items."
+                    "content": f"Topic: {topic}\n\nQuery: {query}\n\nInternal Research:\n{internal}\n\nProvide a detailed research report with key findings, recommendations, and action items."
                 }
             ]
             
-            answer = rag_utils.safe_call_llm(messages, max_new_tokens=800)
+            answer = rag_utils.safe_call_llm(messages, max_new_tokens=800, route="research")
             
             # Index the research for future reference
             rag_utils.index_into_memory("research", f"Research: {topic}", answer, extra_meta={"research_topic": topic, "query": query})
@@ -821,22 +883,27 @@ def data_entry():
                 }
             ]
             
-            result = rag_utils.safe_call_llm(messages, max_new_tokens=500)
+            result = rag_utils.safe_call_llm(messages, max_new_tokens=500, route="data_entry")
             flash("Data entry validation completed.", "success")
             
     return render_template('data_entry.html', result=result)
 
 @app.route('/reports', methods=['GET', 'POST'])
 def reports():
-    db = SessionLocal()
-    report_data = {
-        'total_meetings': db.query(models.Meeting).count(),
-        'total_tasks': db.query(models.Task).count(),
-        'completed_tasks': db.query(models.Task).filter(models.Task.status == 'Completed').count(),
-        'total_expenses': db.query(models.Expense).count(),
-        'total_amount': sum(e.amount for e in db.query(models.Expense).all()) or 0,
-        'total_contacts': db.query(models.Contact).count(),
-        'pending_tasks': db.query(models.Task).filter(models.Task.status == 'Pending').count(),
+    db = db_utils.get_db()
+    metrics = metrics_utils.get_metrics(db)
+    report_data = {k: metrics[k] for k in ('total_meetings', 'total_tasks', 'completed_tasks', 'total_expenses',
+                                           'total_amount', 'total_contacts', 'pending_tasks')}
+    
+    # Trends come from the rollup tables, not the base tables
+    # Twelve periods: this month and the eleven before it
+    today = datetime.now()
+    this_month = rollup_utils.month_period(today)
+    year_ago = rollup_utils.month_period(today, months_back=11)
+    trends = {
+        'expenses_by_month': rollup_utils.expense_series(db, grain='month', start=year_ago, end=this_month),
+        'expenses_by_category': rollup_utils.expense_by_category(db, start=year_ago, end=this_month),
+        'tasks': rollup_utils.task_breakdown(db)
     }
     
     report_content = ""
@@ -852,6 +919,9 @@ def reports():
         - Pending Tasks: {report_data['pending_tasks']}
         - Total Expenses: ${report_data['total_amount']:.2f}
         - Total Contacts: {report_data['total_contacts']}
+        - Monthly Expenses (last 12 months): {", ".join(f"{m['period']}: ${m['amount']:.2f}" for m in trends['expenses_by_month']) or "none"}
+        - Expenses by Category: {", ".join(f"{c['category']}: ${c['amount']:.2f}" for c in trends['expenses_by_category']) or "none"}
+        - Tasks by Priority: {", ".join(f"{p}: {n}" for p, n in trends['tasks']['by_priority'].items()) or "none"}
         
         Provide insights, trends, and recommendations.
         """
@@ -867,10 +937,28 @@ def reports():
             }
         ]
         
-        report_content = rag_utils.safe_call_llm(messages, max_new_tokens=1000)
+        report_content = rag_utils.safe_call_llm(messages, max_new_tokens=1000, route="report")
         
-    db.close()
-    return render_template('reports.html', report_data=report_data, report_content=report_content)
+    return render_template('reports.html', report_data=report_data, trends=trends, report_content=report_content)
+
+@app.route('/api/reports')
+def reports_api():
+    """Report totals and time series from the rollup tables.
+    Query args: grain (day|month), from / to (inclusive periods), category."""
+    grain = request.args.get('grain', 'month')
+    if grain not in ('day', 'month'):
+        return jsonify({"error": "grain must be 'day' or 'month'"}), 400
+    start, end, category = request.args.get('from'), request.args.get('to'), request.args.get('category')
+    db = db_utils.get_db()
+    return jsonify({
+        'totals': metrics_utils.get_metrics(db),
+        'expenses': {
+            'grain': grain,
+            'series': rollup_utils.expense_series(db, grain=grain, start=start, end=end, category=category),
+            'by_category': rollup_utils.expense_by_category(db, start=start and start[:7], end=end and end[:7])
+        },
+        'tasks': rollup_utils.task_breakdown(db)
+    })
 
 @app.route('/translation', methods=['GET', 'POST'])
 def translation():
@@ -884,12 +972,15 @@ def translation():
         if text:
             translated_text = translation_utils.translate_text(text, target_lang)
             
-            # Index translation for reference
-            rag_utils.index_into_memory(
+            # Queue translation for indexing
+            db = db_utils.get_db()
+            ingest_utils.enqueue(
+                db,
                 "translation",
                 f"Translation to {translation_utils.LANGUAGE_MAP.get(target_lang, target_lang)}",
                 f"Source ({source_lang}):\n{text}\n\nTarget ({target_lang}):\n{translated_text}"
             )
+            db.commit()
             
             flash("Translation completed.", "success")
     
@@ -934,7 +1025,7 @@ def voice():
             """
             
             msgs = [{"role": "user", "content": intent_prompt}]
-            llm_response = rag_utils.safe_call_llm(msgs, max_new_tokens=400)
+            llm_response = rag_utils.safe_call_llm(msgs, max_new_tokens=400, route="voice")
             
             try:
                 # Clean response to ensure valid JSON (remove potential markdown wrappers)
@@ -963,7 +1054,7 @@ def voice():
                         if date_str:
                              desc += f" [Note: Original date string '{date_str}' could not be parsed]"
                     
-                    db = SessionLocal()
+                    db = db_utils.get_db()
                     event = models.CalendarEvent(
                         title=title,
                         event_date=dt,
@@ -973,26 +1064,28 @@ def voice():
                         location="Voice Scheduled"
                     )
                     db.add(event)
-                    db.commit()
+                    db.flush()
                     
                     date_formatted = dt.strftime('%b %d at %I:%M %p')
                     response_text = f"✅ **Scheduled:** {title}\n📅 {date_formatted}\n👥 {attendees or 'No attendees'}"
                     
                     # Index to generic memory too
                     event_text = f"Calendar Event: {title}\nDate: {dt.strftime('%Y-%m-%d %H:%M')}\nAttendees: {attendees}\nDescription: {desc}"
-                    rag_utils.index_into_memory("calendar_event", title, event_text)
-                    
-                    db.close()
+                    ingest_utils.enqueue(db, "calendar_event", title, event_text, source_id=event.id)
+                    db.commit()
                 else:
                     response_text = data.get('response', llm_response)
                     
             except Exception as e:
+                db_utils.rollback()
                 print(f"Error parsing voice intent: {e}")
                 # Fallback to general chat if parsing fails
                 response_text = rag_utils.ask_seva_sakha(command, scope="all")
 
             # Log interaction
-            rag_utils.index_into_memory("voice_command", "Voice Command", f"Command: {command}\n\nResponse: {response_text}")
+            db = db_utils.get_db()
+            ingest_utils.enqueue(db, "voice_command", "Voice Command", f"Command: {command}\n\nResponse: {response_text}")
+            db.commit()
     
     return render_template('voice.html', response_text=response_text)
 
@@ -0,0 +1,147 @@
+"""Mixed read/write load against the app schema under each SQLite storage profile.
+
+Worker processes stand in for gunicorn workers; each runs reader and writer
+threads against its own engine for a fixed time. Readers run the dashboard
+metrics query plus a list page query, writers insert tasks and expenses
+through the ORM (so rollup maintenance is included). Reports throughput,
+latency percentiles and "database is locked" errors per profile.
+
+Usage: python bench_sqlite.py [--profiles legacy,tuned] [--workers 4] [--readers 4]
+                              [--writers 1] [--seconds 10] [--rows 20000] [--out bench_output.txt]
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from sqlalchemy.exc import OperationalError
+import models
+import rollup_utils
+import metrics_utils
+
+def seed(db_path: str, profile: dict, rows: int):
+    SessionLocal = models.init_db(db_path, profile)
+    db = SessionLocal()
+    today = date.today()
+    statuses = ["Pending", "In Progress", "Completed"]
+    db.execute(models.Task.__table__.insert(), [
+        {"title": f"task {i}", "status": random.choice(statuses), "priority": random.choice(["Low", "Medium", "High"]),
+         "due_date": today + timedelta(days=random.randint(-365, 60))} for i in range(rows)])
+    db.execute(models.Expense.__table__.insert(), [
+        {"title": f"expense {i}", "amount": round(random.uniform(5, 500), 2), "category": random.choice(["Travel", "Food", "Software"]),
+         "date": today - timedelta(days=random.randint(0, 730))} for i in range(rows)])
+    db.commit()
+    rollup_utils.rebuild(db)
+    db.close()
+
+def _reader(SessionLocal, stop, out):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        db = SessionLocal()
+        try:
+            metrics_utils.compute_metrics(db)
+            db.query(models.Task).order_by(models.Task.due_date).limit(10).all()
+            out["read"].append(time.perf_counter() - t0)
+        except OperationalError as e:
+            out["errors"].append(str(e.orig))
+        finally:
+            db.close()
+
+def _writer(SessionLocal, stop, out):
+    n = 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        db = SessionLocal()
+        try:
+            if n % 2:
+                db.add(models.Task(title=f"bench {n}", priority="Medium", due_date=date.today()))
+            else:
+                db.add(models.Expense(title=f"bench {n}", amount=12.5, category="Food", date=date.today()))
+            db.commit()
+            out["write"].append(time.perf_counter() - t0)
+        except OperationalError as e:
+            db.rollback()
+            out["errors"].append(str(e.orig))
+        finally:
+            db.close()
+        n += 1
+
+def _worker(db_path, profile, readers, writers, seconds, results):
+    SessionLocal = models.init_db(db_path, profile)
+    stop = threading.Event()
+    out = {"read": [], "write": [], "errors": []}
+    threads = [threading.Thread(target=_reader, args=(SessionLocal, stop, out)) for _ in range(readers)]
+    threads += [threading.Thread(target=_writer, args=(SessionLocal, stop, out)) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    results.put(out)
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+def run_profile(name: str, args) -> dict:
+    profile = models.storage_profile(name)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        seed(db_path, profile, args.rows)
+        results = mp.Queue()
+        procs = [mp.Process(target=_worker, args=(db_path, profile, args.readers, args.writers, args.seconds, results))
+                 for _ in range(args.workers)]
+        for p in procs:
+            p.start()
+        merged = {"read": [], "write": [], "errors": []}
+        for _ in procs:
+            out = results.get()
+            for k in merged:
+                merged[k] += out[k]
+        for p in procs:
+            p.join()
+    return {
+        "profile": name,
+        "reads_per_s": len(merged["read"]) / args.seconds,
+        "writes_per_s": len(merged["write"]) / args.seconds,
+        "read_p50_ms": _pct(merged["read"], 0.5),
+        "read_p99_ms": _pct(merged["read"], 0.99),
+        "write_p50_ms": _pct(merged["write"], 0.5),
+        "write_p99_ms": _pct(merged["write"], 0.99),
+        "locked_errors": sum("locked" in e for e in merged["errors"]),
+        "other_errors": sum("locked" not in e for e in merged["errors"])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", default="legacy,tuned")
+    parser.add_argument("--workers", type=int, default=4, help="processes (gunicorn workers)")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads per worker")
+    parser.add_argument("--writers", type=int, default=1, help="writer threads per worker")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rows", type=int, default=20000, help="seed tasks and expenses")
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    header = f"{'profile':<8} {'reads/s':>9} {'writes/s':>9} {'read p50':>9} {'read p99':>9} {'write p50':>10} {'write p99':>10} {'locked':>7} {'other':>6}"
+    lines = [f"workers={args.workers} readers={args.readers} writers={args.writers} seconds={args.seconds} rows={args.rows}", header]
+    print("\n".join(lines))
+    for name in args.profiles.split(","):
+        r = run_profile(name.strip(), args)
+        lines.append(f"{r['profile']:<8} {r['reads_per_s']:>9.1f} {r['writes_per_s']:>9.1f} {r['read_p50_ms']:>7.1f}ms "
+                     f"{r['read_p99_ms']:>7.1f}ms {r['write_p50_ms']:>8.1f}ms {r['write_p99_ms']:>8.1f}ms "
+                     f"{r['locked_errors']:>7} {r['other_errors']:>6}")
+        print(lines[-1])
+    report = "\n".join(lines)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache_store.db")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+# The cache file is shared by every worker process; each one re-reads the real
+# row count this often (in puts) to account for rows the others added
+EMBED_CACHE_RECOUNT_EVERY = 100
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+EXTRACT_CACHE_MAX_FILES = int(os.getenv("EXTRACT_CACHE_MAX_FILES", "500"))
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """Connection for the side SQLite stores (caches, lexical index): WAL, shared across threads."""
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by model name + sha256 of the text.
+
+    Vectors are stored as float32 blobs. Entries carry a last-used timestamp
+    and the least recently used ones are evicted once max_entries is exceeded.
+    The row count is tracked in memory so a put does not count the table.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, max_entries: int = EMBED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_used ON embedding_cache (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return f"{model}:{text_hash(text)}"
+
+    def get_many(self, model: str, texts: list[str]) -> dict[int, list[float]]:
+        """Return {position: vector} for every text that is already cached."""
+        if not texts:
+            return {}
+        keys = [self.make_key(model, t) for t in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                part = unique[start:start+500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT key, vector FROM embedding_cache WHERE key IN ({marks})", part).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embedding_cache SET last_used=? WHERE key=?", [(now, k) for k in found])
+                self._conn.commit()
+            out = {i: found[k] for i, k in enumerate(keys) if k in found}
+            self.hits += len(out)
+            self.misses += len(texts) - len(out)
+        return out
+
+    def put_many(self, model: str, texts: list[str], vectors: list[list[float]]):
+        if not texts:
+            return
+        now = time.time()
+        rows = list({self.make_key(model, t): (self.make_key(model, t), model, len(v), array("f", v).tobytes(), now)
+                     for t, v in zip(texts, vectors)}.values())
+        with self._lock:
+            # Plain INSERT for new keys so rowcount tells how many rows were added
+            added = self._conn.executemany("INSERT OR IGNORE INTO embedding_cache (key, model, dim, vector, last_used) VALUES (?,?,?,?,?)", rows).rowcount
+            if added < len(rows):
+                self._conn.executemany("UPDATE embedding_cache SET model=?, dim=?, vector=?, last_used=? WHERE key=?",
+                                       [(m, d, v, t, k) for k, m, d, v, t in rows])
+            self._conn.commit()
+            self._count += added
+            self._puts += 1
+            self._evict()
+
+    def _evict(self):
+        if self._puts % EMBED_CACHE_RECOUNT_EVERY == 0 or self._count > self.max_entries:
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess > 0:
+            deleted = self._conn.execute("DELETE FROM embedding_cache WHERE key IN (SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?)", (excess,)).rowcount
+            self._conn.commit()
+            self._count -= deleted
+            self.evictions += deleted
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        total = hits + misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": round(hits / total, 3) if total else 0.0
+        }
+
+class AnswerCache:
+    """Semantic cache of ask_seva_sakha answers.
+
+    Entries are keyed by scope and the collection version of that scope at
+    the time the answer was produced; a lookup returns the answer of the most
+    similar cached query when cosine similarity is at least `threshold`.
+    Every write into a source_type bumps the version of that source_type and
+    of "all", which retires the affected entries. `space` names the embedding
+    space (provider and model) so query vectors are only compared with vectors
+    from the same model.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl: int = ANSWER_CACHE_TTL, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, space: str = ""):
+        self.path = path
+        self.space = space
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                space TEXT NOT NULL DEFAULT ''
+            )""")
+        if "space" not in {row[1] for row in self._conn.execute("PRAGMA table_info(answer_cache)")}:
+            self._conn.execute("ALTER TABLE answer_cache ADD COLUMN space TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_answer_cache_scope ON answer_cache (scope, version)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS collection_versions (
+                source_type TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )""")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _version(self, scope: str) -> int:
+        row = self._conn.execute("SELECT version FROM collection_versions WHERE source_type=?", (scope,)).fetchone()
+        return row[0] if row else 0
+
+    def version(self, scope: str) -> int:
+        with self._lock:
+            return self._version(scope or "all")
+
+    def bump_version(self, source_type: str):
+        """Invalidate cached answers that could have used `source_type` data."""
+        with self._lock:
+            for key in {source_type or "all", "all"}:
+                self._conn.execute("""
+                    INSERT INTO collection_versions (source_type, version) VALUES (?, 1)
+                    ON CONFLICT(source_type) DO UPDATE SET version = version + 1""", (key,))
+                self._conn.execute("DELETE FROM answer_cache WHERE scope=?", (key,))
+            self._conn.commit()
+            self.invalidations += 1
+
+    def lookup(self, scope: str, embedding: list[float]) -> str | None:
+        scope = scope or "all"
+        with self._lock:
+            version = self._version(scope)
+            rows = self._conn.execute(
+                "SELECT embedding, answer FROM answer_cache WHERE scope=? AND version=? AND space=? AND created_at>=?",
+                (scope, version, self.space, time.time() - self.ttl)
+            ).fetchall()
+        if rows:
+            q = np.asarray(embedding, dtype=np.float32)
+            mat = np.stack([np.frombuffer(r[0], dtype=np.float32) for r in rows])
+            if mat.shape[1] == q.shape[0]:
+                sims = mat @ q / (np.linalg.norm(mat, axis=1) * np.linalg.norm(q) + 1e-12)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self.hits += 1
+                    return rows[best][1]
+        self.misses += 1
+        return None
+
+    def put(self, scope: str, query: str, embedding: list[float], answer: str, version: int):
+        scope = scope or "all"
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            # The collection may have changed while the answer was generated
+            if self._version(scope) != version:
+                return
+            self._conn.execute(
+                "INSERT INTO answer_cache (scope, version, query, embedding, answer, created_at, space) VALUES (?,?,?,?,?,?,?)",
+                (scope, version, query, blob, answer, time.time(), self.space)
+            )
+            self._conn.execute("DELETE FROM answer_cache WHERE created_at<?", (time.time() - self.ttl,))
+            self._conn.execute("""
+                DELETE FROM answer_cache WHERE id NOT IN (
+                    SELECT id FROM answer_cache ORDER BY created_at DESC LIMIT ?)""", (self.max_entries,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+class ExtractionCache:
+    """Extracted page text keyed by file content hash and page index.
+
+    A file is marked complete once every page has been stored; complete files
+    are served entirely from the cache. Files are evicted least recently used
+    first beyond max_files.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, max_files: int = EXTRACT_CACHE_MAX_FILES):
+        self.path = path
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extracted_files (
+                file_hash TEXT PRIMARY KEY,
+                page_count INTEGER,
+                complete INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extracted_pages (
+                file_hash TEXT NOT NULL,
+                page_index INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (file_hash, page_index)
+            )""")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def is_complete(self, fhash: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT complete FROM extracted_files WHERE file_hash=?", (fhash,)).fetchone()
+        return bool(row and row[0])
+
+    def page_count(self, fhash: str) -> int | None:
+        with self._lock:
+            row = self._conn.execute("SELECT page_count FROM extracted_files WHERE file_hash=? AND complete=1", (fhash,)).fetchone()
+        return row[0] if row else None
+
+    def get_page(self, fhash: str, page_index: int) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM extracted_pages WHERE file_hash=? AND page_index=?", (fhash, page_index)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def iter_pages(self, fhash: str):
+        """Yield (page_index, text) for a complete file, reading a page at a time."""
+        with self._lock:
+            self._conn.execute("UPDATE extracted_files SET last_used=? WHERE file_hash=?", (time.time(), fhash))
+            self._conn.commit()
+            count = self._conn.execute("SELECT page_count FROM extracted_files WHERE file_hash=?", (fhash,)).fetchone()[0]
+        for i in range(count):
+            yield i, self.get_page(fhash, i) or ""
+
+    def put_page(self, fhash: str, page_index: int, text: str):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO extracted_files (file_hash, page_count, complete, last_used) VALUES (?, NULL, 0, ?)
+                ON CONFLICT(file_hash) DO UPDATE SET last_used=excluded.last_used""", (fhash, time.time()))
+            self._conn.execute("INSERT OR REPLACE INTO extracted_pages (file_hash, page_index, text) VALUES (?,?,?)", (fhash, page_index, text))
+            self._conn.commit()
+
+    def mark_complete(self, fhash: str, page_count: int):
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO extracted_files (file_hash, page_count, complete, last_used) VALUES (?, ?, 1, ?)
+                ON CONFLICT(file_hash) DO UPDATE SET complete=1, page_count=excluded.page_count""", (fhash, page_count, time.time()))
+            stale = self._conn.execute("""
+                SELECT file_hash FROM extracted_files ORDER BY last_used DESC LIMIT -1 OFFSET ?""", (self.max_files,)).fetchall()
+            for (h,) in stale:
+                self._conn.execute("DELETE FROM extracted_pages WHERE file_hash=?", (h,))
+                self._conn.execute("DELETE FROM extracted_files WHERE file_hash=?", (h,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            files = self._conn.execute("SELECT COUNT(*) FROM extracted_files WHERE complete=1").fetchone()[0]
+        return {"files": files, "page_hits": self.hits, "page_misses": self.misses}
+
+class LRUCache:
+    """Small in-process LRU map (e.g. parsed mail bodies); max_entries bounds memory."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        total = self.hits + self.misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
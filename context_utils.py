@@ -0,0 +1,212 @@
+import os
+import re
+import math
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Prompt accounting for every LLM call. Tokens are counted locally with an
+# approximation of Mistral's tokenizer (see count_tokens); each route has an
+# input budget that context is packed into and an output cap for max_tokens.
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "32000"))
+LLM_INPUT_TOKEN_BUDGET = int(os.getenv("LLM_INPUT_TOKEN_BUDGET", "4000"))
+LLM_OUTPUT_TOKEN_BUDGET = int(os.getenv("LLM_OUTPUT_TOKEN_BUDGET", "1000"))
+MESSAGE_OVERHEAD_TOKENS = 4  # role markers and separators per chat message
+MIN_TRIMMED_PASSAGE_TOKENS = 64  # a passage cut shorter than this is dropped instead
+
+# (input tokens, output tokens) per route; LLM_BUDGET_<ROUTE>="input,output" overrides
+ROUTE_BUDGETS = {
+    "ask": (3000, 500),
+    "research": (4000, 800),
+    "chat": (3000, 300),
+    "document_summary": (2500, 500),
+    "report": (2000, 1000),
+}
+
+PASSAGE_FORMAT = "--- Result {n} ({label}) ---\n{text}"
+
+# Global state
+_route_stats = {}
+_stats_lock = threading.Lock()
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+def _word_tokens(w: str) -> int:
+    # Digits and non-ASCII characters are one token each (Mistral's tokenizer
+    # splits numbers into digits); common words are one token, long ones one per ~7 chars
+    if w.isdigit() or not w.isascii():
+        return len(w)
+    return 1 + len(w) // 7
+
+def count_tokens(text: str) -> int:
+    """Local token estimate of `text` for the chat model (no tokenizer download or API call)."""
+    return sum(_word_tokens(m.group()) for m in _TOKEN_RE.finditer(text or ""))
+
+def count_message_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(m.get("content", "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+def budget_for(route: str) -> tuple[int, int]:
+    """(input, output) token budget of a route."""
+    override = os.getenv(f"LLM_BUDGET_{(route or '').upper()}")
+    if override:
+        try:
+            inp, out = (int(x) for x in override.split(","))
+            return inp, out
+        except ValueError:
+            print(f"Ignoring malformed LLM_BUDGET_{route.upper()}={override!r}")
+    return ROUTE_BUDGETS.get(route, (LLM_INPUT_TOKEN_BUDGET, LLM_OUTPUT_TOKEN_BUDGET))
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of `text` within max_tokens, cut back to a sentence or word boundary."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    # Walk the token matches rather than slicing characters; one token is left for the ellipsis
+    n = 0
+    end = 0
+    for m in _TOKEN_RE.finditer(text):
+        n += _word_tokens(m.group())
+        if n > max_tokens - 1:
+            break
+        end = m.end()
+    cut = text[:end]
+    sentence = max(cut.rfind(". "), cut.rfind("\n"))
+    if sentence > len(cut) // 2:
+        cut = cut[:sentence + 1]
+    return cut.rstrip() + " …"
+
+def _trim_prompt(text: str, max_tokens: int) -> str:
+    """trim_to_tokens for a prompt: its last paragraph usually is the instruction
+    ("Answer:"), so that is kept and the text before it is cut instead."""
+    head, sep, tail = text.rpartition("\n\n")
+    tail_cost = count_tokens(tail)
+    if head and tail_cost <= max_tokens // 2:
+        return trim_to_tokens(head, max_tokens - tail_cost) + sep + tail
+    return trim_to_tokens(text, max_tokens)
+
+def _stats_for(route: str) -> dict:
+    return _route_stats.setdefault(route, {
+        "calls": 0, "prompt_tokens": 0, "max_prompt_tokens": 0, "api_prompt_tokens": 0,
+        "completion_tokens": 0, "trimmed_calls": 0, "passages_offered": 0, "passages_used": 0
+    })
+
+def build_context(route: str, passages: list[dict], reserved: list[str] = (), fmt: str = PASSAGE_FORMAT,
+                  joiner: str = "\n\n", keep_order: bool = False, ranked: bool = False, budget: int = None) -> str:
+    """Assemble the context block of a prompt within the route's input budget.
+
+    `passages` are dicts with "text", "score" (higher is more relevant) and an
+    optional "label". `reserved` are the other parts of the prompt (system
+    prompt, instructions, question); their tokens come off the budget first.
+    Passages are taken by score, or in the given order when `ranked` (they come
+    already ordered, e.g. by rerank_utils' MMR). A passage that no longer fits is
+    trimmed at a sentence boundary if enough room is left, otherwise skipped.
+    keep_order renders the chosen passages in their original order (e.g.
+    document excerpts).
+    """
+    budget = budget or budget_for(route)[0]
+    available = budget - sum(count_tokens(r) + MESSAGE_OVERHEAD_TOKENS for r in reserved)
+    joiner_cost = count_tokens(joiner)
+    order = list(enumerate(passages))
+    if not ranked:
+        order.sort(key=lambda p: p[1].get("score", 0.0), reverse=True)
+    chosen = []
+    for pos, p in order:
+        text = (p.get("text") or "").strip()
+        if not text:
+            continue
+        header_cost = count_tokens(fmt.format(n=len(chosen) + 1, label=p.get("label", ""), text="")) + joiner_cost
+        room = available - header_cost
+        cost = count_tokens(text)
+        if cost > room:
+            if room < MIN_TRIMMED_PASSAGE_TOKENS:
+                continue
+            text = trim_to_tokens(text, room)
+            cost = count_tokens(text)
+        chosen.append((pos, p, text))
+        available -= cost + header_cost
+    if keep_order:
+        chosen.sort(key=lambda c: c[0])
+    with _stats_lock:
+        s = _stats_for(route)
+        s["passages_offered"] += len(passages)
+        s["passages_used"] += len(chosen)
+    return joiner.join(fmt.format(n=i, label=p.get("label", ""), text=text) for i, (_, p, text) in enumerate(chosen, 1))
+
+def salient_passages(text: str, size: int = 900) -> list[dict]:
+    """Split a long text into passages scored by how central their vocabulary is
+    to the whole text (cosine with the document's term frequencies). The opening
+    passage is kept at the top since it usually carries the title and purpose."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+    passages = []
+    for para in paragraphs:
+        while len(para) > size:
+            cut = para.rfind(" ", 0, size)
+            cut = cut if cut > size // 2 else size
+            passages.append(para[:cut])
+            para = para[cut:].strip()
+        if para:
+            if passages and len(passages[-1]) + len(para) < size:
+                passages[-1] += "\n" + para
+            else:
+                passages.append(para)
+    words = lambda s: [w for w in re.findall(r"\w+", s.lower()) if len(w) > 2]
+    doc = Counter(words(text))
+    doc_norm = math.sqrt(sum(v * v for v in doc.values())) or 1.0
+    out = []
+    for i, p in enumerate(passages):
+        tf = Counter(words(p))
+        norm = math.sqrt(sum(v * v for v in tf.values())) or 1.0
+        score = sum(v * doc[t] for t, v in tf.items()) / (norm * doc_norm)
+        out.append({"text": p, "score": 2.0 if i == 0 else score})
+    return out
+
+def enforce(route: str, messages: list[dict], max_new_tokens: int) -> tuple[list[dict], int]:
+    """Hold one call to its route's budgets before it is sent.
+
+    Output: max_new_tokens is capped by the route's output budget and by what
+    the context window leaves after the prompt. Input: a prompt over the input
+    budget has its longest user message trimmed, keeping its closing instruction.
+    Logs the prompt size.
+    """
+    in_budget, out_budget = budget_for(route)
+    prompt_tokens = count_message_tokens(messages)
+    trimmed = False
+    if prompt_tokens > in_budget:
+        users = [i for i, m in enumerate(messages) if m.get("role") == "user"]
+        if users:
+            i = max(users, key=lambda i: count_tokens(messages[i]["content"]))
+            over = prompt_tokens - in_budget
+            keep = max(MIN_TRIMMED_PASSAGE_TOKENS, count_tokens(messages[i]["content"]) - over)
+            messages = list(messages)
+            messages[i] = dict(messages[i], content=_trim_prompt(messages[i]["content"], keep))
+            prompt_tokens = count_message_tokens(messages)
+            trimmed = True
+    max_tokens = max(1, min(max_new_tokens, out_budget, LLM_CONTEXT_TOKENS - prompt_tokens))
+    with _stats_lock:
+        s = _stats_for(route)
+        s["calls"] += 1
+        s["prompt_tokens"] += prompt_tokens
+        s["max_prompt_tokens"] = max(s["max_prompt_tokens"], prompt_tokens)
+        s["trimmed_calls"] += trimmed
+    note = " (trimmed to fit)" if trimmed else ""
+    print(f"[llm-budget] {route}: prompt ~{prompt_tokens}/{in_budget} tokens, max output {max_tokens}{note}")
+    return messages, max_tokens
+
+def record_usage(route: str, usage: dict):
+    """Token counts reported by the API for a call, next to the local estimate."""
+    if not usage:
+        return
+    with _stats_lock:
+        s = _stats_for(route)
+        s["api_prompt_tokens"] += usage.get("prompt_tokens", 0)
+        s["completion_tokens"] += usage.get("completion_tokens", 0)
+
+def get_stats() -> dict:
+    with _stats_lock:
+        routes = {}
+        for route, s in _route_stats.items():
+            calls = s["calls"]
+            routes[route] = dict(s, budget=list(budget_for(route)),
+                                 avg_prompt_tokens=round(s["prompt_tokens"] / calls, 1) if calls else 0.0)
+        return {"context_tokens": LLM_CONTEXT_TOKENS, "routes": routes}
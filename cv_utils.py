@@ -1,27 +1,177 @@
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pdfplumber
 import pytesseract
-from PIL import Image
+from cache_utils import ExtractionCache, file_hash
 
-def extract_pdf_with_ocr(path: str) -> str:
-    text = ""
+# OCR tuning. OCR_WORKERS > 1 renders and OCRs pages in a process pool.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Fixed DPI (e.g. "300") or "auto" to pick a DPI per page from its ink density
+OCR_RESOLUTION = os.getenv("OCR_RESOLUTION", "auto")
+OCR_PROBE_DPI = 50
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "200"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+EXTRACT_CACHE_ENABLED = os.getenv("EXTRACT_CACHE_ENABLED", "1") == "1"
+
+# Global state
+_extraction_cache = None
+
+def get_extraction_cache() -> ExtractionCache:
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = ExtractionCache()
+    return _extraction_cache
+
+def count_pdf_pages(path: str) -> int:
     try:
+        if EXTRACT_CACHE_ENABLED:
+            cached = get_extraction_cache().page_count(file_hash(path))
+            if cached is not None:
+                return cached
         with pdfplumber.open(path) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        return 0
+
+def choose_ocr_resolution(page) -> int:
+    """Pick an OCR DPI from a cheap low-resolution render of the page.
+
+    Returns 0 for pages that are effectively blank (nothing to OCR). Sparse
+    pages (large type, mostly whitespace) are read fine at OCR_MIN_DPI; dense
+    pages, which usually mean small type, get OCR_MAX_DPI.
+    """
+    try:
+        img = page.to_image(resolution=OCR_PROBE_DPI).original.convert("L")
+        hist = img.histogram()
+        ink = sum(hist[:128]) / max(1, sum(hist))
+    except Exception:
+        return OCR_MAX_DPI
+    if ink < 0.002:
+        return 0
+    if ink < 0.05:
+        return OCR_MIN_DPI
+    if ink < 0.12:
+        return (OCR_MIN_DPI + OCR_MAX_DPI) // 2
+    return OCR_MAX_DPI
+
+def _resolve_resolution(page, resolution) -> int:
+    if resolution in (None, "auto"):
+        return choose_ocr_resolution(page)
+    return int(resolution)
+
+def _ocr(i, page, resolution) -> str:
+    try:
+        dpi = _resolve_resolution(page, resolution)
+        if not dpi:
+            return ""
+        # .original is already a PIL image
+        pil_img = page.to_image(resolution=dpi).original
+        return pytesseract.image_to_string(pil_img)
+    except Exception as e:
+        return f"[OCR error page {i}: {e}]"
+
+def _text_layer(page) -> str | None:
+    try:
+        ptext = page.extract_text()
+    except Exception:
+        ptext = None
+    return ptext if ptext and ptext.strip() else None
+
+# Per-process cache of open PDFs so pool workers parse each file once
+_worker_pdfs = {}
+
+def _ocr_page_worker(path: str, i: int, resolution) -> str:
+    pdf = _worker_pdfs.get(path)
+    if pdf is None:
+        for old in _worker_pdfs.values():
+            old.close()
+        _worker_pdfs.clear()
+        pdf = _worker_pdfs[path] = pdfplumber.open(path)
+    return _ocr(i, pdf.pages[i], resolution)
+
+def _release(page):
+    # Drop pdfplumber's cached layout objects so memory does not grow with page count
+    try:
+        page.close()
+    except Exception:
+        pass
+
+def iter_pdf_pages(path: str, workers: int = None, resolution=None, use_cache: bool = EXTRACT_CACHE_ENABLED):
+    """Yield (page_number, text) in page order, OCR'ing pages without a text layer.
+
+    Pages are extracted lazily, so callers can start on early pages while later
+    ones are still being read and memory stays flat for large PDFs.
+    With workers > 1, OCR runs in a process pool; up to 2*workers pages are in
+    flight at once and results are still yielded strictly in page order.
+    With use_cache, page text is stored under the file's content hash and a
+    file that was fully extracted before is served without opening it.
+    """
+    cache = get_extraction_cache() if use_cache else None
+    fhash = file_hash(path) if cache else None
+    if cache and cache.is_complete(fhash):
+        for i, text in cache.iter_pages(fhash):
+            yield i + 1, text
+        return
+
+    complete = True
+    count = 0
+    for page_no, text in _extract_pages(path, workers, resolution, cache, fhash):
+        count += 1
+        if cache:
+            if text.startswith("[OCR error"):
+                complete = False
+            else:
+                cache.put_page(fhash, page_no - 1, text)
+        yield page_no, text
+    if cache and complete:
+        cache.mark_complete(fhash, count)
+
+def _extract_pages(path, workers, resolution, cache, fhash):
+    workers = OCR_WORKERS if workers is None else workers
+    resolution = OCR_RESOLUTION if resolution is None else resolution
+
+    with pdfplumber.open(path) as pdf:
+        if workers <= 1:
             for i, page in enumerate(pdf.pages):
-                try:
-                    ptext = page.extract_text()
-                except Exception:
-                    ptext = None
-                
-                if ptext and ptext.strip():
-                    text += ptext + "\n"
+                ptext = cache.get_page(fhash, i) if cache else None
+                if ptext is None:
+                    ptext = _text_layer(page) or _ocr(i, page, resolution)
+                _release(page)
+                yield i + 1, ptext
+            return
+
+        window = deque()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, page in enumerate(pdf.pages):
+                ptext = cache.get_page(fhash, i) if cache else None
+                if ptext is None:
+                    ptext = _text_layer(page)
+                if ptext is None:
+                    window.append((i, pool.submit(_ocr_page_worker, path, i, resolution)))
                 else:
-                    try:
-                        pil_img = page.to_image(resolution=300).original
-                        ocr_text = pytesseract.image_to_string(Image.fromarray(pil_img))
-                        text += ocr_text + "\n"
-                    except Exception as e:
-                        text += f"[OCR error page {i}: {e}]\n"
+                    window.append((i, ptext))
+                _release(page)
+                while len(window) > workers * 2:
+                    yield _resolve(window.popleft())
+            while window:
+                yield _resolve(window.popleft())
+
+def _resolve(item):
+    i, result = item
+    if isinstance(result, str):
+        return i + 1, result
+    try:
+        return i + 1, result.result()
+    except Exception as e:
+        return i + 1, f"[OCR error page {i}: {e}]"
+
+def extract_pdf_with_ocr(path: str, workers: int = None, resolution=None) -> str:
+    """Whole-document text. Prefer iter_pdf_pages for large files."""
+    parts = []
+    try:
+        for _, ptext in iter_pdf_pages(path, workers=workers, resolution=resolution):
+            parts.append(ptext + "\n")
     except Exception as e:
         return f"[PDF open error: {e}]"
-    return text
+    return "".join(parts)
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Opt-in query profiler: logs query count and DB time per request and flags
+# requests issuing more than QUERY_PROFILER_MAX_QUERIES statements.
+QUERY_PROFILER = os.getenv("QUERY_PROFILER", "0") == "1"
+QUERY_PROFILER_MAX_QUERIES = int(os.getenv("QUERY_PROFILER_MAX_QUERIES", "10"))
+
+# Global state
+_SessionLocal = None
+_route_stats = {}
+_stats_lock = threading.Lock()
+
+def init_app(app, SessionLocal):
+    """Give every request one session, closed (and rolled back on error) at teardown."""
+    global _SessionLocal
+    _SessionLocal = SessionLocal
+    app.teardown_appcontext(_teardown)
+    if QUERY_PROFILER:
+        _install_profiler(app, SessionLocal.kw["bind"])
+
+def get_db():
+    """The current request's session, created on first use.
+
+    Objects are not expired on commit, so templates can read rows loaded
+    before a commit without reloading each one.
+    """
+    if "db" not in g:
+        g.db = _SessionLocal(expire_on_commit=False)
+    return g.db
+
+def rollback():
+    """Discard pending changes after a failed write so the request can keep using its session."""
+    db = g.get("db")
+    if db is not None:
+        db.rollback()
+
+def _teardown(exc):
+    db = g.pop("db", None)
+    if db is None:
+        return
+    try:
+        if exc is not None:
+            db.rollback()
+    finally:
+        db.close()
+
+# --- Query profiler --------------------------------------------------------
+
+def _install_profiler(app, engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not has_request_context() or not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        g.query_count = g.get("query_count", 0) + 1
+        g.query_time = g.get("query_time", 0.0) + elapsed
+
+    @app.after_request
+    def _report(response):
+        count = g.get("query_count", 0)
+        if not count:
+            return response
+        ms = g.get("query_time", 0.0) * 1000
+        route = request.url_rule.rule if request.url_rule else request.path
+        key = f"{request.method} {route}"
+        with _stats_lock:
+            s = _route_stats.setdefault(key, {"requests": 0, "queries": 0, "max_queries": 0, "db_ms": 0.0, "flagged": 0})
+            s["requests"] += 1
+            s["queries"] += count
+            s["max_queries"] = max(s["max_queries"], count)
+            s["db_ms"] += ms
+            if count > QUERY_PROFILER_MAX_QUERIES:
+                s["flagged"] += 1
+        flag = f"  <-- over {QUERY_PROFILER_MAX_QUERIES} queries" if count > QUERY_PROFILER_MAX_QUERIES else ""
+        print(f"[query-profiler] {key}: {count} queries, {ms:.1f} ms{flag}")
+        response.headers["X-Query-Count"] = str(count)
+        return response
+
+def profiler_stats() -> dict | None:
+    if not QUERY_PROFILER:
+        return None
+    with _stats_lock:
+        return {
+            "max_queries": QUERY_PROFILER_MAX_QUERIES,
+            "routes": {k: dict(v, avg_queries=round(v["queries"] / v["requests"], 1), db_ms=round(v["db_ms"], 1))
+                       for k, v in _route_stats.items()}
+        }
@@ -0,0 +1,299 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import models
+import cv_utils
+import rag_utils
+import context_utils
+from cache_utils import file_hash
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DOC_PIPELINE_WORKERS = int(os.getenv("DOC_PIPELINE_WORKERS", "2"))
+# Pages / chunks buffered between stages; bounds memory and lets stages overlap
+DOC_STAGE_BUFFER = int(os.getenv("DOC_STAGE_BUFFER", "8"))
+DOC_EMBED_BATCH_CHUNKS = int(os.getenv("DOC_EMBED_BATCH_CHUNKS", "32"))
+# Text scanned for the summary; the most central passages of it are packed into
+# the "document_summary" token budget (context_utils)
+DOC_SUMMARY_CHARS = int(os.getenv("DOC_SUMMARY_CHARS", "24000"))
+DOC_PREVIEW_CHARS = 2000
+# A running job not updated for this long is assumed orphaned and restarted
+DOC_JOB_LEASE_SECONDS = int(os.getenv("DOC_JOB_LEASE_SECONDS", "900"))
+
+STAGES = ("extract", "chunk", "embed", "summarize")
+
+# Global state
+_SessionLocal = None
+_executor = None
+
+def init(SessionLocal):
+    """Start the job executor and pick up jobs a previous process left unfinished."""
+    global _SessionLocal, _executor
+    if _executor is not None:
+        return
+    _SessionLocal = SessionLocal
+    _executor = ThreadPoolExecutor(max_workers=DOC_PIPELINE_WORKERS, thread_name_prefix="doc-pipeline")
+    db = SessionLocal()
+    try:
+        stale = datetime.utcnow() - timedelta(seconds=DOC_JOB_LEASE_SECONDS)
+        leftovers = db.query(models.DocumentJob.id).filter(
+            (models.DocumentJob.status == "queued") |
+            ((models.DocumentJob.status == "running") & (models.DocumentJob.updated_at < stale))
+        ).all()
+    finally:
+        db.close()
+    for (job_id,) in leftovers:
+        _executor.submit(run_job, job_id)
+    if leftovers:
+        print(f"Resuming {len(leftovers)} document job(s).")
+
+def submit(filename: str, path: str, source_type: str = "document", summarize: bool = True) -> int:
+    """Record a document job and schedule it. Returns the job id."""
+    db = _SessionLocal()
+    try:
+        job = models.DocumentJob(filename=filename, path=path, source_type=source_type, summarize=summarize,
+                                 pages_total=_count_pages(path))
+        db.add(job)
+        db.commit()
+        job_id = job.id
+    finally:
+        db.close()
+    _executor.submit(run_job, job_id)
+    return job_id
+
+def _count_pages(path: str) -> int:
+    if path.lower().endswith(".pdf"):
+        return cv_utils.count_pdf_pages(path)
+    return 1
+
+def _iter_document(path: str):
+    if path.lower().endswith(".pdf"):
+        yield from cv_utils.iter_pdf_pages(path)
+    else:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            yield 1, f.read()
+
+def _claim(job_id: int) -> bool:
+    db = _SessionLocal()
+    try:
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=DOC_JOB_LEASE_SECONDS)
+        n = db.query(models.DocumentJob).filter(
+            models.DocumentJob.id == job_id,
+            (models.DocumentJob.status == "queued") |
+            ((models.DocumentJob.status == "running") & (models.DocumentJob.updated_at < stale))
+        ).update({"status": "running", "stage": "extract", "pages_done": 0, "chunks_indexed": 0, "updated_at": now},
+                 synchronize_session=False)
+        db.commit()
+        return bool(n)
+    finally:
+        db.close()
+
+class _Progress:
+    """Thread-safe job progress, written to the DB at most once per second."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.active = set()
+        self.fields = {}
+        self.last_flush = 0.0
+
+    def update(self, force: bool = False, **fields):
+        with self.lock:
+            self.fields.update(fields)
+            if not force and time.time() - self.last_flush < 1.0:
+                return
+            values = dict(self.fields)
+            values["stage"] = ",".join(s for s in STAGES if s in self.active) or values.get("stage", "")
+            values["updated_at"] = datetime.utcnow()
+            self.last_flush = time.time()
+            db = _SessionLocal()
+            try:
+                db.query(models.DocumentJob).filter(models.DocumentJob.id == self.job_id).update(values, synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+
+    def enter(self, stage: str):
+        with self.lock:
+            self.active.add(stage)
+        self.update(force=True)
+
+    def leave(self, stage: str):
+        with self.lock:
+            self.active.discard(stage)
+        self.update(force=True)
+
+def run_job(job_id: int):
+    if not _claim(job_id):
+        return
+    db = _SessionLocal()
+    try:
+        job = db.query(models.DocumentJob).get(job_id)
+        filename, path, source_type, summarize = job.filename, job.path, job.source_type, job.summarize
+    finally:
+        db.close()
+
+    print(f"Document job {job_id}: processing {filename}")
+    try:
+        fhash = file_hash(path)
+    except OSError as e:
+        _fail(job_id, f"extract: {e}")
+        return
+    # Chunks are keyed by the upload name (uploads of the same name overwrite the
+    # file), so a retry or resumed job only embeds what is missing, and a re-upload
+    # of an edited file replaces the chunks of the old version
+    progress = _Progress(job_id)
+    pages_q = queue.Queue(maxsize=DOC_STAGE_BUFFER)
+    chunks_q = queue.Queue(maxsize=DOC_STAGE_BUFFER * 4)
+    summary_ready = threading.Event()
+    errors = []
+    extracted = {"text": "", "pages": 0}
+
+    def extract():
+        progress.enter("extract")
+        try:
+            for page_no, text in _iter_document(path):
+                pages_q.put((page_no, text))
+                if len(extracted["text"]) < DOC_SUMMARY_CHARS:
+                    extracted["text"] += text + "\n"
+                    if len(extracted["text"]) >= DOC_SUMMARY_CHARS:
+                        summary_ready.set()
+                extracted["pages"] += 1
+                progress.update(pages_done=extracted["pages"], preview=extracted["text"][:DOC_PREVIEW_CHARS])
+        except Exception as e:
+            errors.append(f"extract: {e}")
+        finally:
+            pages_q.put(None)
+            summary_ready.set()
+            progress.leave("extract")
+
+    pages_finished = threading.Event()
+
+    def page_stream():
+        while True:
+            item = pages_q.get()
+            if item is None:
+                pages_finished.set()
+                return
+            yield item
+
+    def chunk():
+        progress.enter("chunk")
+        try:
+            # Chunks may span page breaks; each carries the page it starts on
+            for item in rag_utils.iter_page_chunks(page_stream()):
+                chunks_q.put(item)
+        except Exception as e:
+            errors.append(f"chunk: {e}")
+            # Keep draining so the extract stage never blocks on a full buffer
+            while not pages_finished.is_set() and pages_q.get() is not None:
+                pass
+        finally:
+            chunks_q.put(None)
+            progress.leave("chunk")
+
+    def embed():
+        progress.enter("embed")
+        indexed = 0
+        batch = []
+        produced = set()
+
+        def flush():
+            nonlocal indexed, batch
+            if not batch:
+                return
+            if not errors:
+                res = rag_utils.index_chunks_into_memory(source_type, filename, [c for _, c in batch], extra_meta={"file_hash": fhash},
+                                                         start_index=indexed, pages=[p for p, _ in batch], source_id=filename,
+                                                         produced=produced)
+                if res.startswith("✅"):
+                    indexed += len(batch)
+                    progress.update(chunks_indexed=indexed)
+                else:
+                    errors.append(f"embed: {res}")
+            batch = []
+
+        try:
+            while True:
+                c = chunks_q.get()
+                if c is None:
+                    break
+                batch.append(c)
+                if len(batch) >= DOC_EMBED_BATCH_CHUNKS:
+                    flush()
+            flush()
+            # Only a complete run knows every chunk of the file
+            if produced and not errors:
+                removed = rag_utils.remove_from_memory(source_type, filename, keep=produced)
+                if removed:
+                    print(f"Document job {job_id}: removed {removed} chunks of an earlier version")
+        finally:
+            progress.leave("embed")
+            progress.update(force=True, chunks_indexed=indexed)
+
+    def summarize_stage():
+        # Only the first DOC_SUMMARY_CHARS are considered, so this starts as soon
+        # as those pages are extracted instead of waiting for the whole document.
+        summary_ready.wait()
+        text = extracted["text"][:DOC_SUMMARY_CHARS]
+        if not text.strip():
+            return
+        progress.enter("summarize")
+        try:
+            instruction = "Provide executive summary (3 bullets + 3 risks + 3 actions):\n\n"
+            excerpts = context_utils.build_context("document_summary", context_utils.salient_passages(text),
+                                                   reserved=[rag_utils.SYSTEM_PROMPT, instruction],
+                                                   fmt="{text}", joiner="\n[...]\n", keep_order=True)
+            msgs = [
+                {"role": "system", "content": rag_utils.SYSTEM_PROMPT},
+                {"role": "user", "content": f"{instruction}{excerpts}"}
+            ]
+            progress.update(force=True, summary=rag_utils.safe_call_llm(msgs, max_new_tokens=500, route="document_summary"))
+        finally:
+            progress.leave("summarize")
+
+    stages = [extract, chunk, embed]
+    if summarize:
+        stages.append(summarize_stage)
+    threads = [threading.Thread(target=fn, name=f"doc-{job_id}-{fn.__name__}", daemon=True) for fn in stages]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if not extracted["text"].strip() and not errors:
+        errors.append("No readable text extracted.")
+    status = "failed" if errors else "done"
+    progress.update(force=True, status=status, stage=status, error="; ".join(errors) or None)
+    print(f"Document job {job_id}: {status}")
+
+def _fail(job_id: int, error: str):
+    db = _SessionLocal()
+    try:
+        db.query(models.DocumentJob).filter(models.DocumentJob.id == job_id).update(
+            {"status": "failed", "stage": "failed", "error": error, "updated_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def job_to_dict(job: models.DocumentJob) -> dict:
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "pages_total": job.pages_total,
+        "pages_done": job.pages_done,
+        "chunks_indexed": job.chunks_indexed,
+        "preview": job.preview,
+        "summary": job.summary,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
+    }
@@ -1,10 +1,32 @@
 import imaplib
 import email
-import smtplib
+import email.utils
+import base64
+import os
+import quopri
+import re
+from datetime import datetime, timezone
 from email.header import decode_header
 from email.mime.text import MIMEText
 from bs4 import BeautifulSoup
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import time
+import models
+import mail_pool_utils
+from cache_utils import LRUCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# INBOX sync: UIDs per UID FETCH, and how many of the newest messages the first sync takes
+MAIL_SYNC_BATCH = int(os.getenv("MAIL_SYNC_BATCH", "50"))
+MAIL_SYNC_INITIAL = int(os.getenv("MAIL_SYNC_INITIAL", "200"))
+MAIL_HEADER_FIELDS = "SUBJECT FROM DATE MESSAGE-ID"
+# Parsed bodies of recently opened messages
+MAIL_BODY_CACHE_SIZE = int(os.getenv("MAIL_BODY_CACHE_SIZE", "200"))
+
+# Global state
+body_cache = LRUCache(MAIL_BODY_CACHE_SIZE)
 
 def _decode_header_val(h):
     try:
@@ -56,45 +78,301 @@ def _get_text_from_msg(msg):
                     return str(payload)
     return ""
 
-def fetch_emails(host, port, user, password, limit=50):
-    if not user or not password:
-        return [], "User/Pass missing"
-    
+def imap_creds(account) -> tuple:
+    """Pool key and login of an account's IMAP session, see mail_pool_utils."""
+    return (account.imap_host, account.imap_port, account.email, account.password)
+
+# --- Incremental INBOX sync ------------------------------------------------
+
+def _response_int(M, code):
+    """Integer of an untagged response code left by SELECT (UIDVALIDITY, UIDNEXT)."""
+    typ, data = M.response(code)
+    try:
+        return int(data[-1])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def uid_ranges(uids, batch_size=MAIL_SYNC_BATCH):
+    """Sorted UIDs as IMAP sequence sets ("101:150,153"), at most batch_size UIDs each."""
+    uids = sorted(uids)
+    for i in range(0, len(uids), batch_size):
+        batch = uids[i:i + batch_size]
+        parts = []
+        start = prev = batch[0]
+        for u in batch[1:]:
+            if u != prev + 1:
+                parts.append(f"{start}:{prev}" if start != prev else str(start))
+                start = u
+            prev = u
+        parts.append(f"{start}:{prev}" if start != prev else str(start))
+        yield ",".join(parts)
+
+def _parse_date(value, internaldate=None):
     try:
-        M = imaplib.IMAP4_SSL(host, port)
-        M.login(user, password)
-        M.select("INBOX")
-        typ, data = M.search(None, 'ALL')
+        dt = email.utils.parsedate_to_datetime(value)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+        return dt
+    except (TypeError, ValueError, IndexError):
+        pass
+    if internaldate:
+        t = imaplib.Internaldate2tuple(internaldate)
+        if t:
+            return datetime.utcfromtimestamp(time.mktime(t))
+    return datetime.utcnow()
+
+def _parse_fetch(data):
+    """imaplib FETCH response -> {uid: {"meta": bytes, "literals": [bytes]}}.
+
+    A message arrives as (prefix, literal) tuples plus plain bytes for the
+    text between and after literals; "meta" joins all the non-literal text, so
+    items such as BODYSTRUCTURE are found wherever the server put them.
+    """
+    messages = []
+    cur = None
+    for item in data:
+        head = item[0] if isinstance(item, tuple) else item
+        if not isinstance(head, bytes):
+            continue
+        if re.match(rb"\d+ \(", head) or cur is None:
+            cur = {"meta": head, "literals": []}
+            messages.append(cur)
+        else:
+            cur["meta"] += head
+        if isinstance(item, tuple):
+            cur["literals"].append(item[1])
+    out = {}
+    for m in messages:
+        uid = re.search(rb"UID (\d+)", m["meta"])
+        if uid:
+            out[int(uid.group(1))] = m
+    return out
+
+def _parse_list(data: bytes, pos: int = 0):
+    """Parse one IMAP parenthesized list starting at data[pos] == "(".
+    Returns (nested list of str/None, position after the closing paren)."""
+    out = []
+    pos += 1
+    while pos < len(data):
+        c = data[pos:pos + 1]
+        if c == b")":
+            return out, pos + 1
+        if c == b" ":
+            pos += 1
+        elif c == b"(":
+            item, pos = _parse_list(data, pos)
+            out.append(item)
+        elif c == b'"':
+            end = pos + 1
+            while data[end:end + 1] != b'"':
+                if end >= len(data):
+                    raise ValueError("unterminated string")
+                end += 2 if data[end:end + 1] == b"\\" else 1
+            out.append(re.sub(rb'\\(.)', rb'\1', data[pos + 1:end]).decode("utf-8", "replace"))
+            pos = end + 1
+        else:
+            m = re.match(rb"[^ ()]+", data[pos:])
+            atom = m.group(0).decode("utf-8", "replace")
+            out.append(None if atom.upper() == "NIL" else atom)
+            pos += len(m.group(0))
+    raise ValueError("unterminated list")
+
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {str(value[i]).lower(): value[i + 1] for i in range(0, len(value) - 1, 2)}
+
+def _walk_structure(bs, section=""):
+    """Yield (section, part) for every leaf part of a parsed BODYSTRUCTURE."""
+    if bs and isinstance(bs[0], list):
+        n = 0
+        for part in bs:
+            if not isinstance(part, list):
+                break
+            n += 1
+            yield from _walk_structure(part, f"{section}.{n}" if section else str(n))
+    else:
+        yield section or "1", bs
+
+def body_parts(bodystructure) -> dict:
+    """Where the readable text of a message is: section, subtype, encoding and
+    charset of the first text/plain part (text/html if none), plus the number
+    of attachments."""
+    text = html = None
+    attachments = 0
+    for section, part in _walk_structure(bodystructure):
+        if len(part) < 7:
+            continue
+        ctype, subtype = str(part[0]).lower(), str(part[1]).lower()
+        disposition = next((p for p in part[7:] if isinstance(p, list) and p and isinstance(p[0], str)
+                            and p[0].lower() in ("attachment", "inline")), None)
+        if (disposition and disposition[0].lower() == "attachment") or ctype != "text":
+            attachments += 1
+            continue
+        info = {"body_section": section, "body_subtype": subtype,
+                "body_encoding": str(part[5] or "7bit").lower(), "body_charset": _params(part[2]).get("charset") or "utf-8"}
+        if subtype == "plain" and text is None:
+            text = info
+        elif subtype == "html" and html is None:
+            html = info
+    found = text or html or {"body_section": None, "body_subtype": None, "body_encoding": None, "body_charset": None}
+    return dict(found, attachments=attachments)
+
+def _message_row(account, uid_validity, uid, meta, header_bytes):
+    msg = email.message_from_bytes(header_bytes)
+    flags = re.search(rb"FLAGS \(([^)]*)\)", meta)
+    internal = re.search(rb'INTERNALDATE "[^"]+"', meta)
+    size = re.search(rb"RFC822\.SIZE (\d+)", meta)
+    row = {
+        "account_id": account.id,
+        "uid_validity": uid_validity,
+        "uid": uid,
+        "message_id": (msg.get("Message-ID") or "").strip(),
+        "subject": _decode_header_val(msg.get("Subject", "")),
+        "sender": _decode_header_val(msg.get("From", "")),
+        "date_header": msg.get("Date", ""),
+        "sent_date": _parse_date(msg.get("Date"), internal.group(0) if internal else None),
+        "seen": bool(flags and b"\\Seen" in flags.group(1)),
+        "size": int(size.group(1)) if size else 0,
+        "body": None,  # fetched on first open, see get_body
+        "fetched_at": datetime.utcnow()
+    }
+    bs = meta.find(b"BODYSTRUCTURE (")
+    structure = None
+    if bs >= 0:
+        try:
+            structure, _ = _parse_list(meta, bs + len(b"BODYSTRUCTURE "))
+        except (ValueError, AttributeError, IndexError):
+            pass
+    row.update(body_parts(structure) if structure else
+               {"body_section": None, "body_subtype": None, "body_encoding": None, "body_charset": None, "attachments": 0})
+    return row
+
+def sync_mailbox(db, account, initial_limit=MAIL_SYNC_INITIAL):
+    """Bring the local copy of an account's INBOX up to date.
+
+    Only UIDs at or above the stored UIDNEXT are fetched, MAIL_SYNC_BATCH per
+    UID FETCH, and only their list headers and BODYSTRUCTURE. A changed UIDVALIDITY invalidates every stored UID, so the local
+    copy is dropped and rebuilt. The first sync takes the newest initial_limit
+    messages. Returns {"new": n, "error": None | str}.
+    """
+    if not account.email or not account.password:
+        return {"new": 0, "error": "User/Pass missing"}
+
+    def run(M):
+        typ, _ = M.select("INBOX", readonly=True)
         if typ != 'OK':
-            M.logout()
-            return [], f"IMAP search failed: {typ}"
-        
-        all_ids = data[0].split()
-        to_fetch = all_ids[-limit:]
-        
-        results = []
-        for num in to_fetch:
-            typ, msg_data = M.fetch(num, '(RFC822)')
+            return {"new": 0, "error": f"IMAP select failed: {typ}"}
+        uid_validity = _response_int(M, 'UIDVALIDITY')
+        uid_next = _response_int(M, 'UIDNEXT')
+
+        if account.uid_validity != uid_validity:
+            if account.uid_validity is not None:
+                print(f"UIDVALIDITY changed for {account.email}; resyncing INBOX")
+            db.query(models.MailMessage).filter(models.MailMessage.account_id == account.id).delete()
+            account.uid_validity = uid_validity
+            account.uid_next = None
+        if account.uid_next is not None and uid_next is not None and uid_next <= account.uid_next:
+            account.last_synced = datetime.utcnow()
+            db.commit()
+            return {"new": 0, "error": None}
+
+        start = account.uid_next or 1
+        typ, data = M.uid('SEARCH', None, f'UID {start}:*')
+        if typ != 'OK':
+            return {"new": 0, "error": f"IMAP search failed: {typ}"}
+        # "n:*" also matches the highest UID when it is below n
+        uids = [int(u) for u in (data[0] or b"").split() if int(u) >= start]
+        if account.uid_next is None:
+            uids = uids[-initial_limit:]
+
+        new = 0
+        for uid_set in uid_ranges(uids):
+            # Headers and structure only; bodies are fetched when a message is opened
+            typ, data = M.uid('FETCH', uid_set, f'(UID FLAGS INTERNALDATE RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({MAIL_HEADER_FIELDS})])')
             if typ != 'OK':
-                continue
-            raw = msg_data[0][1]
-            msg = email.message_from_bytes(raw)
-            subject = _decode_header_val(msg.get('Subject', ''))
-            from_ = _decode_header_val(msg.get('From', ''))
-            date_ = msg.get('Date', '')
-            body = _get_text_from_msg(msg)
-            
-            results.append({
-                "subject": subject,
-                "from": from_,
-                "date": date_,
-                "body": body
-            })
-            
-        M.logout()
-        return results, None # Success
+                return {"new": new, "error": f"IMAP fetch failed: {typ}"}
+            rows = [_message_row(account, uid_validity, uid, r["meta"], r["literals"][0] if r["literals"] else b"")
+                    for uid, r in _parse_fetch(data).items()]
+            if rows:
+                # Another worker may be syncing the same account
+                stmt = sqlite_insert(models.MailMessage).values(rows).on_conflict_do_nothing()
+                new += db.execute(stmt).rowcount
+            account.uid_next = max(account.uid_next or 0, max(int(u) for u in re.findall(r"\d+", uid_set)) + 1)
+            db.commit()
+
+        if uid_next:
+            account.uid_next = max(account.uid_next or 0, uid_next)
+        account.last_synced = datetime.utcnow()
+        db.commit()
+        return {"new": new, "error": None}
+
+    try:
+        return mail_pool_utils.imap_call(imap_creds(account), run)
+    except Exception as e:
+        db.rollback()
+        return {"new": 0, "error": str(e)}
+
+def _decode_part(raw: bytes, encoding: str, charset: str, subtype: str) -> str:
+    if encoding == "base64":
+        raw = base64.b64decode(raw)
+    elif encoding == "quoted-printable":
+        raw = quopri.decodestring(raw)
+    try:
+        text = raw.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        text = raw.decode("utf-8", errors="ignore")
+    if subtype == "html":
+        text = BeautifulSoup(text, "html.parser").get_text(separator="\n")
+    return text
+
+def get_body(db, account, message) -> tuple[str, str | None]:
+    """Readable text of a stored message, fetched from IMAP on first open.
+
+    Only the text part located by BODYSTRUCTURE is downloaded (the whole
+    message if the structure was not understood), never attachments. Parsed
+    bodies are kept in the LRU body_cache and stored on the row.
+    Returns (body, error).
+    """
+    key = (message.account_id, message.uid_validity, message.uid)
+    cached = body_cache.get(key)
+    if cached is not None:
+        return cached, None
+    if message.body is not None:
+        body_cache.put(key, message.body)
+        return message.body, None
+    section = message.body_section
+    item = f"BODY.PEEK[{section}]" if section else "BODY.PEEK[]"
+
+    def run(M):
+        M.select("INBOX", readonly=True)
+        if _response_int(M, 'UIDVALIDITY') != message.uid_validity:
+            return None
+        return M.uid('FETCH', str(message.uid), f'(UID {item})')
+
+    try:
+        fetched = mail_pool_utils.imap_call(imap_creds(account), run)
+        if fetched is None:
+            return "", "Mailbox changed since the last sync; refresh the inbox."
+        typ, data = fetched
+        parsed = _parse_fetch(data).get(message.uid) if typ == 'OK' else None
+        if not parsed or not parsed["literals"]:
+            return "", "Message is no longer on the server."
+        raw = parsed["literals"][0]
+        if section:
+            body = _decode_part(raw, message.body_encoding, message.body_charset, message.body_subtype)
+        else:
+            body = _get_text_from_msg(email.message_from_bytes(raw))
     except Exception as e:
-        return [], str(e)
+        return "", str(e)
+    message.body = body
+    db.commit()
+    body_cache.put(key, body)
+    return body, None
+
+def mailbox_query(db, account_id):
+    """Stored INBOX messages of an account (order with keyset_page on sent_date)."""
+    return db.query(models.MailMessage).filter(models.MailMessage.account_id == account_id)
 
 def send_email_smtp(host, port, user, password, to_addr, subject, body):
     if not user or not password:
@@ -106,11 +384,9 @@ def send_email_smtp(host, port, user, password, to_addr, subject, body):
         msg["To"] = to_addr
         msg["Subject"] = subject or "(no subject)"
         
-        server = smtplib.SMTP(host, port, timeout=10)
-        server.starttls()
-        server.login(user, password)
-        server.sendmail(user, [to_addr], msg.as_string())
-        server.quit()
+        # Pooled session: a burst of sends shares one TLS handshake and login
+        mail_pool_utils.smtp_call((host, port, user, password),
+                                  lambda server: server.sendmail(user, [to_addr], msg.as_string()))
         return "✅ Email sent."
     except Exception as e:
         return f"❌ Email send failed: {e}"
@@ -120,20 +396,12 @@ def get_mail_stats(host, port, user, password):
         return {"unread": 0, "total": 0, "error": "Creds missing"}
     
     try:
-        M = imaplib.IMAP4_SSL(host, port)
-        M.login(user, password)
-        M.select("INBOX")
-        
-        # Unread
-        typ, data = M.search(None, '(UNSEEN)')
-        unread = len(data[0].split()) if data[0] else 0
-        
-        # Total
-        typ, data = M.search(None, 'ALL')
-        total = len(data[0].split()) if data[0] else 0
-        
-        M.logout()
-        return {"unread": unread, "total": total, "error": None}
+        # One STATUS instead of SELECT + two SEARCHes, on the account's pooled session
+        typ, data = mail_pool_utils.imap_call((host, port, user, password),
+                                              lambda M: M.status("INBOX", "(MESSAGES UNSEEN)"))
+        if typ != 'OK':
+            return {"unread": 0, "total": 0, "error": f"IMAP status failed: {typ}"}
+        counts = dict(re.findall(rb"(MESSAGES|UNSEEN) (\d+)", data[0] or b""))
+        return {"unread": int(counts.get(b"UNSEEN", 0)), "total": int(counts.get(b"MESSAGES", 0)), "error": None}
     except Exception as e:
         return {"unread": 0, "total": 0, "error": str(e)}
-
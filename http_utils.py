@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+
+# Connection pool / retry tuning
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Per-endpoint (connect, read) timeouts in seconds
+TIMEOUTS = {
+    "chat": (5, float(os.getenv("HTTP_CHAT_TIMEOUT", "30"))),
+    "embed": (5, float(os.getenv("HTTP_EMBED_TIMEOUT", "30"))),
+    "translate": (5, float(os.getenv("HTTP_TRANSLATE_TIMEOUT", "30"))),
+}
+DEFAULT_TIMEOUT = (5, 30)
+
+# Global state
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {}
+_connections_opened = 0
+_current = threading.local()  # endpoint of the call running on this thread
+
+def _endpoint_stats(endpoint: str) -> dict:
+    # Caller holds _stats_lock
+    return _stats.setdefault(endpoint, {"calls": 0, "errors": 0, "connections": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+def _count_connection():
+    global _connections_opened
+    endpoint = getattr(_current, "endpoint", None)
+    with _stats_lock:
+        _connections_opened += 1
+        if endpoint:
+            _endpoint_stats(endpoint)["connections"] += 1
+
+# urllib3 calls _new_conn only when no idle keep-alive connection is available,
+# on the thread making the request, so counting there stays correct with
+# concurrent requests and can be attributed to the calling endpoint
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count_connection()
+        return super()._new_conn()
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count_connection()
+        return super()._new_conn()
+
+class _CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPConnectionPool,
+                                                   "https": _CountingHTTPSConnectionPool}
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = _CountingAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+    return session
+
+def get_session() -> requests.Session:
+    """Shared keep-alive session, created on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def _record(endpoint: str, elapsed: float, status: int | None):
+    with _stats_lock:
+        s = _endpoint_stats(endpoint)
+        s["calls"] += 1
+        if status is None or status >= 400:
+            s["errors"] += 1
+        ms = elapsed * 1000
+        s["total_ms"] += ms
+        s["max_ms"] = max(s["max_ms"], ms)
+
+def post_json(endpoint: str, url: str, payload: dict, timeout=None) -> requests.Response:
+    """POST a JSON payload to a Mistral endpoint through the pooled session.
+
+    Retries on 429/5xx are handled by the adapter. Exceptions propagate to the
+    caller, which keeps its own error message format.
+    """
+    session = get_session()
+    headers = {"Authorization": f"Bearer {MISTRAL_API_KEY}"}
+    start = time.perf_counter()
+    status = None
+    _current.endpoint = endpoint
+    try:
+        resp = session.post(url, headers=headers, json=payload, timeout=timeout or TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT))
+        status = resp.status_code
+        return resp
+    finally:
+        _current.endpoint = None
+        _record(endpoint, time.perf_counter() - start, status)
+
+def get_stats() -> dict:
+    """Per-endpoint call counts and latency, the connections each endpoint's calls
+    opened and its pool hits: calls served over an already open keep-alive
+    connection (adapter retries can open extra connections, so this is a floor)."""
+    with _stats_lock:
+        endpoints = {}
+        for endpoint, s in _stats.items():
+            row = dict(s)
+            row["avg_ms"] = round(s["total_ms"] / s["calls"], 2) if s["calls"] else 0.0
+            row["total_ms"] = round(s["total_ms"], 2)
+            row["max_ms"] = round(s["max_ms"], 2)
+            row["pool_hits"] = max(0, s["calls"] - s["connections"])
+            endpoints[endpoint] = row
+        calls = sum(s["calls"] for s in _stats.values())
+        return {"endpoints": endpoints, "calls": calls, "connections_opened": _connections_opened,
+                "pool_hits": sum(row["pool_hits"] for row in endpoints.values())}
@@ -0,0 +1,175 @@
+import os
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+import models
+import rag_utils
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "16"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+# A job claimed longer ago than this is assumed orphaned (worker died) and is claimed again
+INGEST_LEASE_SECONDS = int(os.getenv("INGEST_LEASE_SECONDS", "300"))
+INGEST_RETENTION_HOURS = int(os.getenv("INGEST_RETENTION_HOURS", "168"))
+
+# Global state
+_wake = threading.Event()
+_workers = []
+
+def notify():
+    """Wake idle workers; called once a session holding new jobs commits."""
+    _wake.set()
+
+def enqueue(db, source_type: str, title: str, full_text: str, extra_meta: dict = None, source_id=None) -> models.IndexJob:
+    """Add an indexing job to `db`. It becomes visible to workers when the caller commits,
+    together with the row it describes. `source_id` is the row's primary key; it makes
+    the chunk IDs deterministic so re-indexing the row replaces its old chunks."""
+    meta = {k: (str(v) if v is not None else "") for k, v in (extra_meta or {}).items()}
+    if source_id is not None:
+        meta["source_id"] = str(source_id)
+    job = models.IndexJob(
+        source_type=source_type,
+        title=title or "",
+        full_text=full_text or "",
+        extra_meta=json.dumps(meta),
+        status="pending"
+    )
+    db.add(job)
+    db.info["ingest_pending"] = True
+    return job
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("ingest_pending", False):
+        notify()
+
+def _claim_batch(db) -> list[models.IndexJob]:
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=INGEST_LEASE_SECONDS)
+    candidates = db.query(models.IndexJob.id).filter(
+        (models.IndexJob.status == "pending") |
+        ((models.IndexJob.status == "processing") & (models.IndexJob.claimed_at < stale))
+    ).order_by(models.IndexJob.id).limit(INGEST_BATCH_SIZE).all()
+
+    claimed = []
+    for (job_id,) in candidates:
+        # Conditional update so two workers (or processes) never claim the same job
+        n = db.query(models.IndexJob).filter(
+            models.IndexJob.id == job_id,
+            (models.IndexJob.status == "pending") |
+            ((models.IndexJob.status == "processing") & (models.IndexJob.claimed_at < stale))
+        ).update({"status": "processing", "claimed_at": now, "updated_at": now}, synchronize_session=False)
+        if n:
+            claimed.append(job_id)
+    db.commit()
+    if not claimed:
+        return []
+    return db.query(models.IndexJob).filter(models.IndexJob.id.in_(claimed)).order_by(models.IndexJob.id).all()
+
+def process_batch(SessionLocal) -> int:
+    """Claim and index one batch of jobs. Returns the number of jobs handled."""
+    db = SessionLocal()
+    try:
+        jobs = _claim_batch(db)
+        if not jobs:
+            return 0
+
+        entries = []
+        for j in jobs:
+            meta = json.loads(j.extra_meta or "{}")
+            entries.append({
+                "source_type": j.source_type,
+                "title": j.title,
+                "full_text": j.full_text,
+                "source_id": meta.pop("source_id", None),
+                "extra_meta": meta
+            })
+        try:
+            results = rag_utils.index_batch_into_memory(entries)
+        except Exception as e:
+            # Counts as a failed attempt for every job of the batch, so a batch
+            # that always raises ends up "failed" instead of cycling through leases
+            print(f"Ingest batch error: {e}")
+            results = [f"❌ Indexing failed: {e}"] * len(jobs)
+
+        now = datetime.utcnow()
+        for job, res in zip(jobs, results):
+            job.result = res
+            job.updated_at = now
+            if res.startswith("✅") or res in ("Nothing to index.", "No non-empty chunks."):
+                job.status = "done"
+            else:
+                job.attempts = (job.attempts or 0) + 1
+                job.status = "failed" if job.attempts >= INGEST_MAX_ATTEMPTS else "pending"
+        db.commit()
+        return len(jobs)
+    except Exception as e:
+        db.rollback()
+        print(f"Ingest worker error: {e}")
+        return 0
+    finally:
+        db.close()
+
+def _prune(SessionLocal):
+    db = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(hours=INGEST_RETENTION_HOURS)
+        db.query(models.IndexJob).filter(models.IndexJob.status == "done", models.IndexJob.updated_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Ingest prune error: {e}")
+    finally:
+        db.close()
+
+def _worker_loop(SessionLocal):
+    last_prune = 0
+    while True:
+        handled = process_batch(SessionLocal)
+        if handled:
+            continue
+        if time.time() - last_prune > 3600:
+            _prune(SessionLocal)
+            last_prune = time.time()
+        _wake.wait(INGEST_POLL_SECONDS)
+        _wake.clear()
+
+def start_workers(SessionLocal, num_workers: int = INGEST_WORKERS):
+    """Start the background indexing threads (idempotent). Pending jobs left over
+    from a previous run are picked up on the first poll."""
+    if _workers:
+        return
+    for i in range(num_workers):
+        t = threading.Thread(target=_worker_loop, args=(SessionLocal,), name=f"ingest-worker-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+    print(f"Started {num_workers} ingest worker(s).")
+
+def queue_stats(db, recent: int = 20) -> dict:
+    counts = dict(db.query(models.IndexJob.status, func.count(models.IndexJob.id)).group_by(models.IndexJob.status).all())
+    jobs = db.query(models.IndexJob).order_by(models.IndexJob.id.desc()).limit(recent).all()
+    return {
+        "depth": counts.get("pending", 0) + counts.get("processing", 0),
+        "counts": counts,
+        "workers": len(_workers),
+        "recent": [job_to_dict(j) for j in jobs]
+    }
+
+def job_to_dict(job: models.IndexJob) -> dict:
+    return {
+        "id": job.id,
+        "source_type": job.source_type,
+        "title": job.title,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": job.result,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
+    }
@@ -0,0 +1,355 @@
+import os
+import re
+import time
+import select
+import socket
+import threading
+import itertools
+import imaplib
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import models
+import email_utils
+import ingest_utils
+import mail_pool_utils
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Push delivery of new mail. Each EmailAccount gets a listener thread holding
+# its own IMAP connection in IDLE; when the server reports new messages the
+# INBOX is synced into mail_messages (headers only, see email_utils.sync_mailbox).
+# One shared indexer thread then fetches the bodies of stored messages that are
+# not in memory yet and queues them as "email" index jobs (ingest_utils).
+# Every app process (e.g. each gunicorn worker) starts the indexer thread, but
+# only the holder of the "mail-listener" lease row runs the listeners and
+# indexes, so each account has one IDLE connection.
+MAIL_LISTENER_ENABLED = os.getenv("MAIL_LISTENER_ENABLED", "1") == "1"
+# Renewed every indexer round and before each message of a round; a process that
+# stops renewing is taken over after this
+MAIL_LISTENER_LEASE_SECONDS = float(os.getenv("MAIL_LISTENER_LEASE_SECONDS", "120"))
+# Servers end IDLE after 30 minutes; it is renewed before that (RFC 2177)
+MAIL_IDLE_SECONDS = float(os.getenv("MAIL_IDLE_SECONDS", "1500"))
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "300"))  # servers without IDLE
+MAIL_LISTENER_BACKOFF_MAX = float(os.getenv("MAIL_LISTENER_BACKOFF_MAX", "300"))
+MAIL_LISTENER_BACKOFF_MIN = 5.0
+MAIL_ACCOUNT_RESCAN_SECONDS = 60  # pick up added or removed accounts
+# Backpressure: at most MAIL_INDEX_MAX_PENDING email jobs wait in the ingest
+# queue; the indexer queues MAIL_INDEX_BATCH messages per round and pauses between
+# rounds, so a flood of mail drains gradually next to the rest of the app.
+MAIL_INDEX_BATCH = int(os.getenv("MAIL_INDEX_BATCH", "16"))
+MAIL_INDEX_MAX_PENDING = int(os.getenv("MAIL_INDEX_MAX_PENDING", "64"))
+MAIL_INDEX_PAUSE_SECONDS = float(os.getenv("MAIL_INDEX_PAUSE_SECONDS", "1"))
+MAIL_INDEX_POLL_SECONDS = 10.0  # also how soon a full queue is checked again
+MAIL_INDEX_MAX_CHARS = int(os.getenv("MAIL_INDEX_MAX_CHARS", "20000"))
+MAIL_INDEX_MAX_ATTEMPTS = 3  # body fetches; then the message is indexed from its headers
+MAIL_INDEX_RETRY_SECONDS = 60
+
+_EXISTS_RE = re.compile(rb"\* \d+ (EXISTS|RECENT)")
+_LEASE = "mail-listener"
+# Tags for IDLE commands, sent outside imaplib (distinct from its own tag prefix)
+_idle_tags = itertools.count(1)
+
+# Global state
+_SessionLocal = None
+_lock = threading.Lock()
+_listeners = {}  # account id -> {"thread", "stop", "creds", "state", "last_event", "errors"}
+_wake = threading.Event()
+_indexer = None
+_holder = None  # this process in the lease row
+_leader = False
+_failures = {}  # message id -> (attempts, retry at)
+_stats = Counter()
+
+def init(SessionLocal):
+    """Start the indexer, which also starts a listener per account while this
+    process holds the listener lease (idempotent)."""
+    global _SessionLocal, _indexer, _holder
+    if not MAIL_LISTENER_ENABLED or _indexer is not None:
+        return
+    _SessionLocal = SessionLocal
+    _holder = f"{socket.gethostname()}:{os.getpid()}"
+    _indexer = threading.Thread(target=_indexer_loop, name="mail-indexer", daemon=True)
+    _indexer.start()
+
+def notify():
+    """New rows in mail_messages (e.g. a manual fetch): index them without waiting for the next poll."""
+    _wake.set()
+
+# --- Listeners ---------------------------------------------------------------
+
+def _set(account_id, **fields):
+    with _lock:
+        if account_id in _listeners:
+            _listeners[account_id].update(fields)
+
+def idle(M, stop, seconds) -> bool:
+    """One IMAP IDLE round on a connection opened with unbuffered=True (imaplib
+    has no IDLE command). Returns when the server reports new mail, after
+    `seconds`, or when stop is set; True if new mail was reported."""
+    tag = b"IDLE%d" % next(_idle_tags)
+    M.send(tag + b" IDLE\r\n")
+    changed = False
+    while True:
+        line = M.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed before IDLE")
+        if line.startswith(b"+"):
+            break
+        if line.startswith(tag):
+            raise imaplib.IMAP4.error(f"IDLE refused: {line.decode(errors='replace').strip()}")
+        changed = changed or bool(_EXISTS_RE.match(line))
+    deadline = time.monotonic() + seconds
+    # Wake every second to notice stop
+    while not changed and not stop.is_set() and time.monotonic() < deadline:
+        if M.sock.pending() or select.select([M.sock], [], [], 1.0)[0]:
+            line = M.readline()
+            if not line or line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            changed = bool(_EXISTS_RE.match(line))
+    M.send(b"DONE\r\n")
+    while True:
+        line = M.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed ending IDLE")
+        if line.startswith(tag):
+            return changed
+        changed = changed or bool(_EXISTS_RE.match(line))
+
+def _sync(account_id) -> bool:
+    """Sync one account's INBOX. Returns False once the account is gone."""
+    db = _SessionLocal()
+    try:
+        account = db.query(models.EmailAccount).get(account_id)
+        if not account:
+            return False
+        result = email_utils.sync_mailbox(db, account)
+    finally:
+        db.close()
+    with _lock:
+        _stats["syncs"] += 1
+        _stats["new_messages"] += result["new"]
+    if result["error"]:
+        raise RuntimeError(result["error"])
+    if result["new"]:
+        print(f"[mail-listener] {result['new']} new message(s) for account {account_id}")
+        notify()
+    return True
+
+def _listen(account_id, creds, stop):
+    backoff = MAIL_LISTENER_BACKOFF_MIN
+    while not stop.is_set():
+        M = None
+        try:
+            _set(account_id, state="connecting")
+            M = mail_pool_utils.open_imap(*creds, unbuffered=True)
+            M.select("INBOX", readonly=True)
+            push = "IDLE" in M.capabilities
+            # Catch up on anything that arrived while disconnected
+            if not _sync(account_id):
+                return
+            backoff = MAIL_LISTENER_BACKOFF_MIN
+            _set(account_id, error=None)
+            while not stop.is_set():
+                _set(account_id, state="idle" if push else "polling")
+                if push:
+                    changed = idle(M, stop, MAIL_IDLE_SECONDS)
+                else:
+                    changed = not stop.wait(MAIL_POLL_SECONDS)
+                    M.noop()
+                if stop.is_set():
+                    break
+                if changed:
+                    _set(account_id, last_event=datetime.utcnow().isoformat())
+                # Also after an IDLE timeout: a cheap UIDNEXT check when nothing is new
+                if not _sync(account_id):
+                    return
+        except Exception as e:
+            with _lock:
+                _stats["listener_errors"] += 1
+                if account_id in _listeners:
+                    _listeners[account_id]["errors"] += 1
+            _set(account_id, state="backoff", error=str(e))
+            print(f"[mail-listener] account {account_id}: {e}; reconnecting in {backoff:.0f}s")
+            stop.wait(backoff)
+            backoff = min(backoff * 2, MAIL_LISTENER_BACKOFF_MAX)
+        finally:
+            if M is not None:
+                try:
+                    M.logout()
+                except Exception:
+                    pass
+
+def _hold_lease(db, holder) -> bool:
+    """Take the listener lease if it is free or expired, or renew it if held. True if held."""
+    now = datetime.utcnow()
+    db.execute(sqlite_insert(models.ServiceLease).values(name=_LEASE, holder=holder, expires_at=now)
+               .on_conflict_do_nothing())
+    held = db.query(models.ServiceLease).filter(
+        models.ServiceLease.name == _LEASE,
+        (models.ServiceLease.holder == holder) | (models.ServiceLease.expires_at < now)
+    ).update({"holder": holder, "expires_at": now + timedelta(seconds=MAIL_LISTENER_LEASE_SECONDS)},
+             synchronize_session=False)
+    db.commit()
+    return bool(held)
+
+def _stop_listeners():
+    with _lock:
+        for listener in _listeners.values():
+            listener["stop"].set()
+        _listeners.clear()
+
+def _rescan():
+    """Start listeners for new accounts, restart those whose credentials changed
+    and stop those whose account was deleted."""
+    db = _SessionLocal()
+    try:
+        accounts = {a.id: email_utils.imap_creds(a) for a in db.query(models.EmailAccount).all()
+                    if a.email and a.password}
+    finally:
+        db.close()
+    with _lock:
+        for account_id, listener in list(_listeners.items()):
+            if accounts.get(account_id) != listener["creds"] or not listener["thread"].is_alive():
+                listener["stop"].set()
+                del _listeners[account_id]
+        for account_id, creds in accounts.items():
+            if account_id in _listeners:
+                continue
+            stop = threading.Event()
+            thread = threading.Thread(target=_listen, args=(account_id, creds, stop),
+                                      name=f"mail-listener-{account_id}", daemon=True)
+            _listeners[account_id] = {"thread": thread, "stop": stop, "creds": creds, "state": "starting",
+                                      "last_event": None, "errors": 0, "error": None}
+            thread.start()
+
+# --- Indexing ----------------------------------------------------------------
+
+def _email_text(account, message, body) -> str:
+    head = f"From: {message.sender}\nDate: {message.date_header}\nSubject: {message.subject}\nTo: {account.email}"
+    return f"{head}\n\n{(body or '')[:MAIL_INDEX_MAX_CHARS]}".strip()
+
+def _memory_key(message) -> str:
+    """source_id of a message's chunks. Row ids change when a new UIDVALIDITY makes
+    sync_mailbox rebuild the INBOX; the Message-ID does not, so the re-synced copy
+    replaces the chunks of the old one instead of adding a second set."""
+    if message.message_id:
+        return f"{message.account_id}:{message.message_id}"
+    return f"{message.account_id}:{message.uid_validity}:{message.uid}"
+
+def _claim(db, message) -> bool:
+    # Conditional: another process may run an indexer on the same database
+    return bool(db.query(models.MailMessage).filter(
+        models.MailMessage.id == message.id, models.MailMessage.indexed_at.is_(None)
+    ).update({"indexed_at": datetime.utcnow()}, synchronize_session=False))
+
+def index_round(db, holder: str = None) -> int:
+    """Queue one batch of not yet indexed messages for memory indexing. Returns
+    how many were queued; 0 when there is nothing to do or the queue is full.
+    With `holder`, the listener lease is renewed before each message (body
+    fetches can be slow) and the round stops as soon as it is lost."""
+    waiting = db.query(func.count(models.IndexJob.id)).filter(
+        models.IndexJob.source_type == "email", models.IndexJob.status.in_(("pending", "processing"))).scalar()
+    room = min(MAIL_INDEX_BATCH, MAIL_INDEX_MAX_PENDING - waiting)
+    if room <= 0:
+        with _lock:
+            _stats["throttled"] += 1
+        return 0
+    now = time.time()
+    with _lock:
+        deferred = [mid for mid, (_, retry_at) in _failures.items() if retry_at > now]
+    candidates = db.query(models.MailMessage).filter(
+        models.MailMessage.indexed_at.is_(None), models.MailMessage.id.notin_(deferred)
+    ).order_by(models.MailMessage.id).limit(room).all()
+
+    queued = 0
+    accounts = {}
+    for message in candidates:
+        if holder is not None and not _hold_lease(db, holder):
+            with _lock:
+                _stats["lease_lost"] += 1
+            print(f"[mail-indexer] {holder} lost the listener lease; ending the round")
+            # The indexer loop notices on its next pass and stops the listeners
+            _wake.set()
+            break
+        if message.account_id not in accounts:
+            accounts[message.account_id] = db.get(models.EmailAccount, message.account_id)
+        account = accounts[message.account_id]
+        if account is None:
+            # Left behind by a deleted account: mark it so it is not picked up again
+            _claim(db, message)
+            db.commit()
+            continue
+        body, err = email_utils.get_body(db, account, message)
+        if err:
+            with _lock:
+                attempts = _failures.get(message.id, (0, 0))[0] + 1
+                _stats["body_errors"] += 1
+                if attempts < MAIL_INDEX_MAX_ATTEMPTS:
+                    _failures[message.id] = (attempts, now + MAIL_INDEX_RETRY_SECONDS * attempts)
+                else:
+                    _failures.pop(message.id, None)
+            if attempts < MAIL_INDEX_MAX_ATTEMPTS:
+                continue
+            print(f"[mail-indexer] message {message.id}: {err}; indexing headers only")
+        else:
+            with _lock:
+                _failures.pop(message.id, None)
+        # Claim and job commit together: if enqueue fails or the process dies
+        # first, the message is still unclaimed and the next round retries it
+        if not _claim(db, message):
+            db.rollback()
+            continue
+        ingest_utils.enqueue(db, "email", message.subject or "(no subject)", _email_text(account, message, body),
+                             extra_meta={"sender": message.sender, "account": account.email,
+                                         "email_date": message.sent_date.strftime('%Y-%m-%d %H:%M') if message.sent_date else "",
+                                         "message_id": message.message_id},
+                             source_id=_memory_key(message))
+        db.commit()
+        queued += 1
+    with _lock:
+        _stats["indexed"] += queued
+    return queued
+
+def _indexer_loop():
+    global _leader
+    last_rescan = 0
+    while True:
+        db = _SessionLocal()
+        queued = 0
+        try:
+            leader = _hold_lease(db, _holder)
+            if leader != _leader:
+                print(f"[mail-listener] {_holder} {'holds' if leader else 'lost'} the listener lease")
+                _leader = leader
+                last_rescan = 0
+                if not leader:
+                    _stop_listeners()
+            if leader and time.time() - last_rescan >= MAIL_ACCOUNT_RESCAN_SECONDS:
+                try:
+                    _rescan()
+                except Exception as e:
+                    print(f"[mail-listener] account scan failed: {e}")
+                last_rescan = time.time()
+            if leader:
+                queued = index_round(db, _holder)
+        except Exception as e:
+            db.rollback()
+            print(f"[mail-indexer] {e}")
+        finally:
+            db.close()
+        if queued:
+            # Leave the database and the mail server to web requests between batches
+            time.sleep(MAIL_INDEX_PAUSE_SECONDS)
+            continue
+        _wake.wait(MAIL_INDEX_POLL_SECONDS)
+        _wake.clear()
+
+def get_stats() -> dict:
+    with _lock:
+        listeners = {account_id: {k: l[k] for k in ("state", "last_event", "errors", "error")}
+                     for account_id, l in _listeners.items()}
+        return dict(_stats, enabled=MAIL_LISTENER_ENABLED, leader=_leader, listeners=listeners, retrying=len(_failures),
+                    max_pending=MAIL_INDEX_MAX_PENDING)
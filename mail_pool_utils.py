@@ -0,0 +1,296 @@
+import os
+import ssl
+import time
+import imaplib
+import smtplib
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Authenticated IMAP/SMTP sessions kept per account (host, port, login) and
+# reused across requests. Idle IMAP sessions are kept alive with NOOP; SMTP
+# sessions are held briefly so a burst of sends shares one login. Each mail
+# provider (host) gets at most MAIL_POOL_MAX_PER_PROVIDER live connections,
+# since providers throttle or reject accounts that open too many.
+MAIL_POOL_MAX_PER_PROVIDER = int(os.getenv("MAIL_POOL_MAX_PER_PROVIDER", "4"))
+MAIL_POOL_KEEPALIVE_SECONDS = float(os.getenv("MAIL_POOL_KEEPALIVE_SECONDS", "120"))  # NOOP idle IMAP sessions this often
+MAIL_POOL_IDLE_SECONDS = float(os.getenv("MAIL_POOL_IDLE_SECONDS", "900"))  # then log out
+SMTP_POOL_IDLE_SECONDS = float(os.getenv("SMTP_POOL_IDLE_SECONDS", "30"))
+MAIL_POOL_TIMEOUT = float(os.getenv("MAIL_POOL_TIMEOUT", "15"))  # socket timeout, and the wait for a free slot
+
+# TLS settings for every pooled connection; None means ssl.create_default_context()
+SSL_CONTEXT = None
+
+# The session is gone (dropped, timed out, server BYE): reconnect and retry once.
+# Command failures (NO/BAD, auth errors) are not in here and are raised as is.
+IMAP_CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+SMTP_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+def _ssl_context():
+    return SSL_CONTEXT or ssl.create_default_context()
+
+def open_imap(host, port, user, password, unbuffered=False):
+    """A logged-in IMAP connection outside the pool. unbuffered reads the socket
+    directly, so select() on it tells whether a response is waiting (IDLE)."""
+    conn = imaplib.IMAP4_SSL(host, port, ssl_context=_ssl_context(), timeout=MAIL_POOL_TIMEOUT)
+    if unbuffered:
+        conn.file.close()
+        conn.file = conn.sock.makefile("rb", buffering=0)
+    try:
+        conn.login(user, password)
+    except Exception:
+        _close_imap(conn)
+        raise
+    return conn
+
+def _ping_imap(conn):
+    conn.noop()
+
+def _close_imap(conn):
+    try:
+        conn.logout()
+    except Exception:
+        pass
+
+def _open_smtp(host, port, user, password):
+    if port == 465:
+        conn = smtplib.SMTP_SSL(host, port, timeout=MAIL_POOL_TIMEOUT, context=_ssl_context())
+    else:
+        conn = smtplib.SMTP(host, port, timeout=MAIL_POOL_TIMEOUT)
+    try:
+        if port != 465:
+            conn.starttls(context=_ssl_context())
+        conn.login(user, password)
+    except Exception:
+        _close_smtp(conn)
+        raise
+    return conn
+
+def _ping_smtp(conn):
+    code, _ = conn.noop()
+    if code != 250:
+        raise smtplib.SMTPServerDisconnected(f"NOOP returned {code}")
+
+def _close_smtp(conn):
+    try:
+        conn.quit()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+class _Session:
+    __slots__ = ("conn", "key", "last_used", "last_ping")
+
+    def __init__(self, conn, key):
+        self.conn = conn
+        self.key = key
+        self.last_used = self.last_ping = time.monotonic()
+
+class MailPool:
+    """Authenticated connections of one protocol, keyed by (host, port, user, password).
+
+    call() checks out a session of the account (opening one if none is idle),
+    runs fn(conn) on it and puts it back. A session idle for longer than
+    ping_after is checked with NOOP first. If the connection turns out to be
+    dead, it is discarded and fn runs once more on a fresh one.
+    """
+
+    def __init__(self, kind, opener, pinger, closer, connection_errors, ping_after, idle_seconds,
+                 max_per_provider=MAIL_POOL_MAX_PER_PROVIDER):
+        self.kind = kind
+        self.opener = opener
+        self.pinger = pinger
+        self.closer = closer
+        self.connection_errors = connection_errors
+        self.ping_after = ping_after
+        self.idle_seconds = idle_seconds
+        self.max_per_provider = max_per_provider
+        self._cond = threading.Condition()
+        self._idle = {}  # (host, port, user, password) -> [_Session], most recently used last
+        self._live = Counter()  # host -> open connections, idle or checked out
+        self._stats = Counter()
+
+    def _take_idle_of_provider(self, host):
+        """Oldest idle session of any account on this host (its slot passes to the caller)."""
+        oldest = None
+        for key, sessions in self._idle.items():
+            if key[0] == host and sessions and (oldest is None or sessions[0].last_used < oldest.last_used):
+                oldest = sessions[0]
+        if oldest:
+            self._idle[oldest.key].remove(oldest)
+        return oldest
+
+    def _checkout(self, key):
+        """An idle session of this account, or None once a connection slot is reserved."""
+        host = key[0]
+        deadline = time.monotonic() + MAIL_POOL_TIMEOUT
+        with self._cond:
+            while True:
+                sessions = self._idle.get(key)
+                if sessions:
+                    self._stats["reused"] += 1
+                    return sessions.pop(), None
+                if self._live[host] < self.max_per_provider:
+                    self._live[host] += 1
+                    return None, None
+                # At the cap: give up another account's idle connection rather than wait
+                victim = self._take_idle_of_provider(host)
+                if victim:
+                    self._stats["evicted"] += 1
+                    return None, victim
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["wait_timeouts"] += 1
+                    raise TimeoutError(f"No free {self.kind} connection to {host} "
+                                       f"(limit {self.max_per_provider} per provider)")
+                self._stats["waits"] += 1
+                self._cond.wait(remaining)
+
+    def _release_slot(self, host):
+        with self._cond:
+            self._live[host] -= 1
+            if not self._live[host]:
+                del self._live[host]
+            self._cond.notify()
+
+    def _acquire(self, creds):
+        host, port, user, password = creds
+        # The password is part of the key: changed credentials never reuse an old login
+        key = tuple(creds)
+        session, victim = self._checkout(key)
+        if victim:
+            self.closer(victim.conn)
+        if session and time.monotonic() - session.last_used >= self.ping_after:
+            try:
+                self.pinger(session.conn)
+                session.last_ping = time.monotonic()
+            except Exception:
+                with self._cond:
+                    self._stats["stale"] += 1
+                self.closer(session.conn)
+                session = None
+        if session is None:
+            try:
+                session = _Session(self.opener(host, port, user, password), key)
+            except Exception:
+                self._release_slot(host)
+                raise
+            with self._cond:
+                self._stats["opened"] += 1
+            _start_keeper()
+        return session
+
+    def _checkin(self, session):
+        session.last_used = time.monotonic()
+        with self._cond:
+            self._idle.setdefault(session.key, []).append(session)
+            self._cond.notify()
+
+    def _discard(self, session):
+        self.closer(session.conn)
+        self._release_slot(session.key[0])
+
+    def call(self, creds, fn):
+        """fn(conn) on a pooled, logged-in connection of creds = (host, port, user, password)."""
+        for attempt in range(2):
+            session = self._acquire(creds)
+            try:
+                result = fn(session.conn)
+            except self.connection_errors:
+                self._discard(session)
+                if attempt:
+                    raise
+                with self._cond:
+                    self._stats["reconnects"] += 1
+                continue
+            except Exception:
+                # A command error leaves the session usable
+                self._checkin(session)
+                raise
+            self._checkin(session)
+            return result
+
+    def maintain(self, keepalive):
+        """Close sessions idle for longer than idle_seconds; with keepalive, NOOP
+        the others once they have been quiet for ping_after."""
+        now = time.monotonic()
+        expired, due = [], []
+        with self._cond:
+            for sessions in self._idle.values():
+                for s in list(sessions):
+                    if now - s.last_used >= self.idle_seconds:
+                        sessions.remove(s)
+                        expired.append(s)
+                    elif keepalive and now - max(s.last_used, s.last_ping) >= self.ping_after:
+                        # Out of the pool while pinging so no request picks it up mid-NOOP
+                        sessions.remove(s)
+                        due.append(s)
+        for s in expired:
+            self._discard(s)
+        with self._cond:
+            self._stats["closed_idle"] += len(expired)
+        for s in due:
+            try:
+                self.pinger(s.conn)
+            except Exception:
+                with self._cond:
+                    self._stats["stale"] += 1
+                self._discard(s)
+                continue
+            s.last_ping = time.monotonic()
+            with self._cond:
+                self._stats["keepalives"] += 1
+                # Back in without touching last_used, so idle expiry still applies
+                self._idle.setdefault(s.key, []).append(s)
+                self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            sessions = [s for group in self._idle.values() for s in group]
+            self._idle.clear()
+        for s in sessions:
+            self._discard(s)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(self._stats, live=dict(self._live), idle=sum(len(s) for s in self._idle.values()),
+                        max_per_provider=self.max_per_provider)
+
+# Global state
+imap_pool = MailPool("imap", open_imap, _ping_imap, _close_imap, IMAP_CONNECTION_ERRORS,
+                     ping_after=MAIL_POOL_KEEPALIVE_SECONDS, idle_seconds=MAIL_POOL_IDLE_SECONDS)
+# SMTP sessions are not kept alive: they only bridge a burst of sends
+smtp_pool = MailPool("smtp", _open_smtp, _ping_smtp, _close_smtp, SMTP_CONNECTION_ERRORS,
+                     ping_after=SMTP_POOL_IDLE_SECONDS / 2, idle_seconds=SMTP_POOL_IDLE_SECONDS)
+_keeper = None
+_keeper_lock = threading.Lock()
+
+def _keep_alive():
+    interval = max(1.0, min(MAIL_POOL_KEEPALIVE_SECONDS, SMTP_POOL_IDLE_SECONDS) / 2)
+    while True:
+        time.sleep(interval)
+        try:
+            imap_pool.maintain(keepalive=True)
+            smtp_pool.maintain(keepalive=False)
+        except Exception as e:
+            print(f"Mail pool maintenance failed: {e}")
+
+def _start_keeper():
+    global _keeper
+    with _keeper_lock:
+        if _keeper is None:
+            _keeper = threading.Thread(target=_keep_alive, name="mail-pool-keeper", daemon=True)
+            _keeper.start()
+
+def imap_call(creds: tuple, fn):
+    return imap_pool.call(creds, fn)
+
+def smtp_call(creds: tuple, fn):
+    return smtp_pool.call(creds, fn)
+
+def get_stats() -> dict:
+    return {"imap": imap_pool.stats(), "smtp": smtp_pool.stats()}
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import email_utils
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Unread/total counts for the /email sidebar. Served from memory; entries older
+# than the TTL (or missing) are refreshed in the background, all accounts
+# concurrently, so rendering never waits on IMAP.
+MAIL_STATS_TTL_SECONDS = float(os.getenv("MAIL_STATS_TTL_SECONDS", "120"))
+MAIL_STATS_WORKERS = int(os.getenv("MAIL_STATS_WORKERS", "4"))
+
+EMPTY_STATS = {"unread": 0, "total": 0, "error": None}
+
+# Global state
+_lock = threading.Lock()
+_entries = {}  # account id -> {"stats": dict, "at": float, "creds": tuple}
+_refreshing = set()
+_executor = None
+_stats = {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+def _creds(account) -> tuple:
+    # Plain values: the ORM object must not cross into worker threads
+    return email_utils.imap_creds(account)
+
+def _refresh(account_id: int, creds: tuple):
+    try:
+        stats = email_utils.get_mail_stats(*creds)
+    except Exception as e:
+        stats = dict(EMPTY_STATS, error=str(e))
+    with _lock:
+        _refreshing.discard(account_id)
+        _stats["refreshes"] += 1
+        if stats.get("error"):
+            _stats["errors"] += 1
+            # Keep showing the last good counts, but retry after the next TTL
+            previous = _entries.get(account_id)
+            if previous and not previous["stats"].get("error"):
+                stats = dict(previous["stats"], error=stats["error"])
+        _entries[account_id] = {"stats": stats, "at": time.time(), "creds": creds}
+
+def refresh(accounts):
+    """Queue a background refresh of these accounts (skips ones already in flight)."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAIL_STATS_WORKERS, thread_name_prefix="mail-stats")
+        todo = [(a.id, _creds(a)) for a in accounts if a.id not in _refreshing]
+        _refreshing.update(account_id for account_id, _ in todo)
+    for account_id, creds in todo:
+        _executor.submit(_refresh, account_id, creds)
+
+def get_all(accounts) -> dict:
+    """Cached stats per account id, without blocking. Missing, stale or
+    re-credentialed entries are refreshed in the background; until then the
+    last known (or empty, "pending") stats are returned."""
+    now = time.time()
+    out = {}
+    stale = []
+    with _lock:
+        for a in accounts:
+            entry = _entries.get(a.id)
+            if entry and entry["creds"] == _creds(a):
+                _stats["hits"] += 1
+                out[a.id] = entry["stats"]
+                if now - entry["at"] >= MAIL_STATS_TTL_SECONDS:
+                    stale.append(a)
+            else:
+                _stats["misses"] += 1
+                out[a.id] = dict(EMPTY_STATS, pending=True)
+                stale.append(a)
+    if stale:
+        refresh(stale)
+    return out
+
+def get_stats() -> dict:
+    with _lock:
+        return dict(_stats, accounts=len(_entries), refreshing=len(_refreshing), ttl_seconds=MAIL_STATS_TTL_SECONDS)
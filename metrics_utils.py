@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import event, func, select, case, inspect, true
+from sqlalchemy.orm import Session
+import models
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Snapshot lifetime. Inserts and deletes are applied to the snapshot as they
+# commit, so the TTL only bounds drift from time-based metrics (upcoming
+# meetings, completed today) and bulk query().update()/delete() calls.
+METRICS_TTL_SECONDS = float(os.getenv("METRICS_TTL_SECONDS", "60"))
+
+TASK_STATUSES = ("Pending", "In Progress", "Completed")
+
+# Global state
+_lock = threading.Lock()
+_snapshot = None
+_loaded_at = 0.0
+_stats = {"hits": 0, "refreshes": 0, "deltas": 0, "invalidations": 0}
+
+def _count(model, *where):
+    return select(func.count()).select_from(model).where(*where).scalar_subquery()
+
+def compute_metrics(db) -> dict:
+    """All dashboard and report numbers in a single SELECT of scalar subqueries.
+    Task and expense figures are read from the rollup tables (see rollup_utils),
+    so only the time-dependent counts touch the base tables; each table is read
+    by one subquery (meetings and upcoming meetings share a conditional SUM)."""
+    now = datetime.now()
+    today = datetime.utcnow().date()
+    T, R = models.TaskRollup, models.ExpenseRollup
+    task_row = select(
+        func.coalesce(func.sum(T.count), 0),
+        *[func.coalesce(func.sum(case((T.status == s, T.count), else_=0)), 0) for s in TASK_STATUSES]
+    ).subquery()
+    # Every aggregate returns exactly one row, so the joins are a plain 1x1 product
+    expense_row = select(func.coalesce(func.sum(R.count), 0), func.coalesce(func.sum(R.amount), 0.0)).where(R.grain == "month").subquery()
+    M = models.Meeting
+    meeting_row = select(func.count(), func.coalesce(func.sum(case((M.date_time > now, 1), else_=0)), 0)).select_from(M).subquery()
+
+    row = db.execute(select(
+        _count(models.Contact),
+        *meeting_row.c,
+        _count(models.Voicemail),
+        _count(models.CallLog),
+        _count(models.Message, models.Message.read == False),
+        *task_row.c,
+        _count(models.Task, models.Task.status == "Completed", models.Task.due_date >= today),
+        *expense_row.c
+    ).select_from(task_row.join(expense_row, true()).join(meeting_row, true()))).one()
+
+    (contacts, meetings, upcoming, voicemails, calls, unread,
+     tasks, pending, in_progress, completed, completed_today, expenses, amount) = row
+    return {
+        "total_contacts": contacts,
+        "total_meetings": meetings,
+        "upcoming_meetings": upcoming,
+        "total_voicemails": voicemails,
+        "total_calls": calls,
+        "unread_messages": unread,
+        "total_tasks": tasks,
+        "pending_tasks": pending,
+        "in_progress_tasks": in_progress,
+        "completed_tasks": completed,
+        "completed_today": completed_today,
+        "total_expenses": expenses,
+        "total_amount": float(amount or 0)
+    }
+
+def get_metrics(db) -> dict:
+    """Cached metrics snapshot, recomputed when older than METRICS_TTL_SECONDS."""
+    global _snapshot, _loaded_at
+    with _lock:
+        if _snapshot is not None and time.time() - _loaded_at < METRICS_TTL_SECONDS:
+            _stats["hits"] += 1
+            return dict(_snapshot)
+    fresh = compute_metrics(db)
+    with _lock:
+        _snapshot, _loaded_at = fresh, time.time()
+        _stats["refreshes"] += 1
+        return dict(fresh)
+
+def invalidate():
+    global _snapshot
+    with _lock:
+        _snapshot = None
+        _stats["invalidations"] += 1
+
+def get_stats() -> dict:
+    with _lock:
+        return dict(_stats, age_seconds=round(time.time() - _loaded_at, 1) if _snapshot else None)
+
+# --- Incremental refresh -------------------------------------------------
+
+def _task_status(task):
+    return task.status or "Pending"
+
+def _row_delta(obj, sign: int, delta: Counter):
+    if isinstance(obj, models.Contact):
+        delta["total_contacts"] += sign
+    elif isinstance(obj, models.Meeting):
+        delta["total_meetings"] += sign
+        if obj.date_time and obj.date_time > datetime.now():
+            delta["upcoming_meetings"] += sign
+    elif isinstance(obj, models.Voicemail):
+        delta["total_voicemails"] += sign
+    elif isinstance(obj, models.CallLog):
+        delta["total_calls"] += sign
+    elif isinstance(obj, models.Message):
+        if not obj.read:
+            delta["unread_messages"] += sign
+    elif isinstance(obj, models.Task):
+        status = _task_status(obj)
+        delta["total_tasks"] += sign
+        key = {"Pending": "pending_tasks", "In Progress": "in_progress_tasks", "Completed": "completed_tasks"}.get(status)
+        if key:
+            delta[key] += sign
+        if status == "Completed" and obj.due_date and obj.due_date >= datetime.utcnow().date():
+            delta["completed_today"] += sign
+    elif isinstance(obj, models.Expense):
+        delta["total_expenses"] += sign
+        delta["total_amount"] += sign * (obj.amount or 0)
+
+# Columns whose in-place edits change a metric; such edits drop the snapshot
+_TRACKED_UPDATES = {
+    models.Task: ("status", "due_date"),
+    models.Message: ("read",),
+    models.Meeting: ("date_time",),
+    models.Expense: ("amount",)
+}
+
+def _tracked_update(obj) -> bool:
+    cols = _TRACKED_UPDATES.get(type(obj))
+    if not cols:
+        return False
+    state = inspect(obj)
+    return any(state.attrs[c].history.has_changes() for c in cols)
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    # Dirty-state history is only available before the flush writes it out
+    if any(_tracked_update(obj) for obj in session.dirty):
+        session.info["metrics_stale"] = True
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    delta = session.info.setdefault("metrics_delta", Counter())
+    for obj in session.new:
+        _row_delta(obj, 1, delta)
+    for obj in session.deleted:
+        _row_delta(obj, -1, delta)
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    delta = session.info.pop("metrics_delta", None)
+    if session.info.pop("metrics_stale", False):
+        invalidate()
+        return
+    if not delta:
+        return
+    with _lock:
+        if _snapshot is None:
+            return
+        for k, v in delta.items():
+            _snapshot[k] = _snapshot.get(k, 0) + v
+        _stats["deltas"] += 1
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("metrics_delta", None)
+    session.info.pop("metrics_stale", None)
@@ -0,0 +1,140 @@
+"""Versioned, in-place schema migrations for the SQLite app database.
+
+`models.init_db` runs `create_all` (new tables) and then `migrate`, which
+applies every migration not yet recorded in `schema_migrations` in one
+transaction holding the database write lock, so workers starting together
+run each step once. Steps must be idempotent: on a fresh database `create_all`
+has already built the current schema and the steps find nothing to do.
+
+To change the schema, update the model in models.py and append a migration
+here that brings an existing database to the same state, e.g.:
+
+    @migration(2, "Add contacts.phone")
+    def _(conn):
+        add_column(conn, "contacts", "phone", "VARCHAR")
+
+Usage: python migrations.py [db_path] [--status]
+"""
+import sys
+from datetime import datetime
+from sqlalchemy import create_engine, text
+
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+# --- Helpers ---------------------------------------------------------------
+
+def table_exists(conn, table: str) -> bool:
+    return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:t"), {"t": table}).first() is not None
+
+def column_exists(conn, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(text(f'PRAGMA table_info("{table}")')))
+
+def add_column(conn, table: str, column: str, ddl: str):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if not column_exists(conn, table, column):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}'))
+
+def create_index(conn, name: str, table: str, columns: list[str], unique: bool = False):
+    cols = ", ".join(f'"{c}"' for c in columns)
+    conn.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS "{name}" ON "{table}" ({cols})'))
+
+# --- Migrations ------------------------------------------------------------
+
+@migration(1, "Secondary indexes for list ordering and dashboard filters")
+def _(conn):
+    # Names match SQLAlchemy's ix_<table>_<column> so fresh and migrated DBs agree
+    for table, column in [
+        ("contacts", "name"),
+        ("meetings", "date_time"),
+        ("tasks", "due_date"),
+        ("expenses", "date"),
+        ("call_logs", "call_date"),
+        ("messages", "message_date"),
+        ("messages", "read"),
+        ("calendar_events", "event_date"),
+        ("logs", "timestamp"),
+        ("voicemails", "received_date"),
+    ]:
+        create_index(conn, f"ix_{table}_{column}", table, [column])
+    create_index(conn, "ix_tasks_status_due_date", "tasks", ["status", "due_date"])
+
+@migration(2, "IMAP sync position on email_accounts")
+def _(conn):
+    # mail_messages itself is a new table, created by create_all
+    add_column(conn, "email_accounts", "uid_validity", "INTEGER")
+    add_column(conn, "email_accounts", "uid_next", "INTEGER")
+    add_column(conn, "email_accounts", "last_synced", "DATETIME")
+
+@migration(3, "Lazy body columns on mail_messages")
+def _(conn):
+    for column, ddl in [("body_section", "VARCHAR"), ("body_subtype", "VARCHAR"), ("body_encoding", "VARCHAR"),
+                        ("body_charset", "VARCHAR"), ("attachments", "INTEGER DEFAULT 0")]:
+        add_column(conn, "mail_messages", column, ddl)
+
+@migration(4, "Memory indexing marker on mail_messages")
+def _(conn):
+    add_column(conn, "mail_messages", "indexed_at", "DATETIME")
+    create_index(conn, "ix_mail_messages_indexed_at", "mail_messages", ["indexed_at"])
+
+# --- Runner ----------------------------------------------------------------
+
+def _ensure_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR, applied_at DATETIME)"
+    ))
+
+def applied_versions(engine) -> set[int]:
+    with engine.begin() as conn:
+        _ensure_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def migrate(engine) -> list[int]:
+    """Apply pending migrations in version order. Returns the versions applied.
+
+    The run takes SQLite's write lock up front (BEGIN IMMEDIATE) and reads the
+    applied versions under it: a second process migrating at the same time
+    waits for the lock, then finds those versions recorded and skips them.
+    """
+    applied = []
+    with engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            _ensure_table(conn)
+            done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+            for version, description, fn in MIGRATIONS:
+                if version in done:
+                    continue
+                fn(conn)
+                conn.execute(text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                             {"v": version, "d": description, "t": datetime.utcnow()})
+                applied.append((version, description))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    for version, description in applied:
+        print(f"Applied migration {version}: {description}")
+    return [version for version, _ in applied]
+
+def status(engine) -> list[dict]:
+    done = applied_versions(engine)
+    return [{"version": v, "description": d, "applied": v in done} for v, d, _ in MIGRATIONS]
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    engine = create_engine(f"sqlite:///{args[0] if args else 'ai_secretary_app.db'}")
+    if "--status" not in sys.argv:
+        # Importing models registers the tables; create_all adds any that are missing
+        import models
+        models.Base.metadata.create_all(engine)
+        migrate(engine)
+    for m in status(engine):
+        print(f"{'x' if m['applied'] else ' '} {m['version']:>3}  {m['description']}")
@@ -1,13 +1,15 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Date, Boolean, Float
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Date, Boolean, Float, UniqueConstraint, Index, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
+import os
+import migrations
 
 Base = declarative_base()
 
 class Contact(Base):
     __tablename__ = "contacts"
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    name = Column(String, index=True)
     email = Column(String)
     organization = Column(String)
     role = Column(String)
@@ -18,7 +20,7 @@ class Meeting(Base):
     __tablename__ = "meetings"
     id = Column(Integer, primary_key=True)
     title = Column(String)
-    date_time = Column(DateTime)
+    date_time = Column(DateTime, index=True)
     participants = Column(String) # Comma separated
     notes = Column(Text)
     sentiment = Column(String, default="Neutral") # Fake analytics field
@@ -29,7 +31,8 @@ class Task(Base):
     title = Column(String)
     status = Column(String, default="Pending") # Pending, In Progress, Completed
     priority = Column(String, default="Medium") # Low, Medium, High
-    due_date = Column(Date)
+    due_date = Column(Date, index=True)
+    __table_args__ = (Index("ix_tasks_status_due_date", "status", "due_date"),)
 
 class Decision(Base):
     __tablename__ = "decisions"
@@ -54,7 +57,7 @@ class Expense(Base):
     title = Column(String)
     amount = Column(Float)
     category = Column(String)
-    date = Column(Date)
+    date = Column(Date, index=True)
     receipt_path = Column(String)
     notes = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -65,7 +68,7 @@ class CallLog(Base):
     caller_name = Column(String)
     caller_number = Column(String)
     duration = Column(Integer)  # seconds
-    call_date = Column(DateTime)
+    call_date = Column(DateTime, index=True)
     notes = Column(Text)
     status = Column(String, default="Completed")
 
@@ -75,8 +78,8 @@ class Message(Base):
     sender = Column(String)
     content = Column(Text)
     message_type = Column(String)  # sms, chat, etc
-    message_date = Column(DateTime)
-    read = Column(Boolean, default=False)
+    message_date = Column(DateTime, index=True)
+    read = Column(Boolean, default=False, index=True)
 
 
 
@@ -84,7 +87,7 @@ class CalendarEvent(Base):
     __tablename__ = "calendar_events"
     id = Column(Integer, primary_key=True)
     title = Column(String)
-    event_date = Column(DateTime)
+    event_date = Column(DateTime, index=True)
     duration = Column(Integer)  # minutes
     description = Column(Text)
     attendees = Column(String)
@@ -95,11 +98,72 @@ class LogEntry(Base):
     id = Column(Integer, primary_key=True)
     event_type = Column(String) # email_fetch, doc_upload, chat_query
     description = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+
+# SQLite storage profiles. "tuned" lets readers run alongside a writer (WAL) and
+# makes writers wait for the lock instead of failing with "database is locked".
+# "legacy" is the previous bare engine, kept for comparison (bench_sqlite.py).
+STORAGE_PROFILES = {
+    "legacy": {
+        "journal_mode": None,
+        "busy_timeout_ms": 5000, # sqlite3 module default
+        "synchronous": None,
+        "mmap_size": None,
+        "cache_size": None
+    },
+    "tuned": {
+        "journal_mode": "WAL",
+        "busy_timeout_ms": 15000,
+        "synchronous": "NORMAL", # durable in WAL mode except on power loss
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000 # negative = KiB, i.e. 64 MB per connection
+    }
+}
+
+def storage_profile(name: str = None) -> dict:
+    """Named profile with SQLITE_* environment overrides applied."""
+    name = name or os.getenv("SQLITE_PROFILE", "tuned")
+    profile = dict(STORAGE_PROFILES[name])
+    for key in profile:
+        value = os.getenv(f"SQLITE_{key.upper()}")
+        if value is not None:
+            profile[key] = int(value) if value.lstrip("-").isdigit() else value
+    profile["name"] = name
+    return profile
+
+def create_db_engine(db_path, profile: dict = None):
+    profile = profile or storage_profile()
+    # Threads per gunicorn worker share one pool; size it to the thread count
+    pool_size = int(os.getenv("DB_POOL_SIZE", os.getenv("GUNICORN_THREADS", "8")))
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False, "timeout": profile["busy_timeout_ms"] / 1000},
+        pool_size=pool_size,
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "4")),
+        pool_timeout=int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        if profile["journal_mode"]:
+            cur.execute(f"PRAGMA journal_mode={profile['journal_mode']}")
+        cur.execute(f"PRAGMA busy_timeout={int(profile['busy_timeout_ms'])}")
+        if profile["synchronous"]:
+            cur.execute(f"PRAGMA synchronous={profile['synchronous']}")
+        if profile["mmap_size"] is not None:
+            cur.execute(f"PRAGMA mmap_size={int(profile['mmap_size'])}")
+        if profile["cache_size"] is not None:
+            cur.execute(f"PRAGMA cache_size={int(profile['cache_size'])}")
+        cur.close()
 
-def init_db(db_path):
-    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    return engine
+
+def init_db(db_path, profile: dict = None):
+    engine = create_db_engine(db_path, profile)
     Base.metadata.create_all(engine)
+    # create_all only adds missing tables; migrations bring existing ones up to date
+    migrations.migrate(engine)
     return sessionmaker(bind=engine, autocommit=False, autoflush=False)
 
 class Voicemail(Base):
@@ -110,7 +174,7 @@ class Voicemail(Base):
     transcription = Column(Text)
     audio_path = Column(String, nullable=True)
     duration = Column(Integer, default=0)
-    received_date = Column(DateTime, default=datetime.utcnow)
+    received_date = Column(DateTime, default=datetime.utcnow, index=True)
     is_read = Column(Boolean, default=False)
 
 class EmailAccount(Base):
@@ -123,4 +187,92 @@ class EmailAccount(Base):
     smtp_host = Column(String, default="smtp.gmail.com")
     smtp_port = Column(Integer, default=587)
     provider = Column(String, default="gmail") # gmail, outlook, etc.
+    # INBOX sync position (email_utils.sync_mailbox); a new UIDVALIDITY means a full resync
+    uid_validity = Column(Integer, nullable=True)
+    uid_next = Column(Integer, nullable=True)
+    last_synced = Column(DateTime, nullable=True)
+
+class MailMessage(Base):
+    """Local copy of one INBOX message, keyed by the account's UIDVALIDITY and UID."""
+    __tablename__ = "mail_messages"
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, nullable=False)
+    uid_validity = Column(Integer, nullable=False)
+    uid = Column(Integer, nullable=False)
+    message_id = Column(String)
+    subject = Column(String)
+    sender = Column(String, index=True)
+    date_header = Column(String)
+    sent_date = Column(DateTime) # Parsed Date header (UTC), INTERNALDATE if missing
+    seen = Column(Boolean, default=False)
+    size = Column(Integer, default=0)
+    body = Column(Text) # Filled on first open (email_utils.get_body)
+    # Readable part located from BODYSTRUCTURE at sync time
+    body_section = Column(String)
+    body_subtype = Column(String)
+    body_encoding = Column(String)
+    body_charset = Column(String)
+    attachments = Column(Integer, default=0)
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    indexed_at = Column(DateTime, nullable=True, index=True) # Queued for memory indexing (mail_listener_utils)
+    __table_args__ = (
+        UniqueConstraint("account_id", "uid_validity", "uid", name="uq_mail_messages_uid"),
+        Index("ix_mail_messages_account_date", "account_id", "sent_date"),
+    )
+
+class IndexJob(Base):
+    __tablename__ = "index_jobs"
+    id = Column(Integer, primary_key=True)
+    source_type = Column(String)
+    title = Column(String)
+    full_text = Column(Text)
+    extra_meta = Column(Text) # JSON encoded
+    status = Column(String, default="pending", index=True) # pending, processing, done, failed
+    attempts = Column(Integer, default=0)
+    result = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DocumentJob(Base):
+    __tablename__ = "document_jobs"
+    id = Column(Integer, primary_key=True)
+    filename = Column(String)
+    path = Column(String)
+    source_type = Column(String, default="document")
+    summarize = Column(Boolean, default=True)
+    status = Column(String, default="queued", index=True) # queued, running, done, failed
+    stage = Column(String, default="queued") # extract, chunk, embed, summarize
+    pages_total = Column(Integer, default=0)
+    pages_done = Column(Integer, default=0)
+    chunks_indexed = Column(Integer, default=0)
+    preview = Column(Text) # first extracted text, available while the job runs
+    summary = Column(Text)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ExpenseRollup(Base):
+    __tablename__ = "expense_rollups"
+    id = Column(Integer, primary_key=True)
+    grain = Column(String, nullable=False) # day, month
+    period = Column(String, nullable=False) # YYYY-MM-DD or YYYY-MM, "" for undated expenses
+    category = Column(String, nullable=False, default="")
+    count = Column(Integer, default=0)
+    amount = Column(Float, default=0.0)
+    __table_args__ = (UniqueConstraint("grain", "period", "category"),)
+
+class TaskRollup(Base):
+    __tablename__ = "task_rollups"
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default="")
+    priority = Column(String, nullable=False, default="")
+    count = Column(Integer, default=0)
+    __table_args__ = (UniqueConstraint("status", "priority"),)
 
+class ServiceLease(Base):
+    """A named lease held by one process at a time (e.g. the mail listener), renewed before it expires."""
+    __tablename__ = "service_leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String) # host:pid
+    expires_at = Column(DateTime)
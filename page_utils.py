@@ -0,0 +1,93 @@
+import base64
+import json
+import os
+from datetime import date, datetime
+from sqlalchemy import tuple_
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "25"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(value, row_id: int) -> str:
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, column):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        row_id = int(row_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+    if value is not None:
+        py_type = column.type.python_type
+        try:
+            if py_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif py_type is date:
+                value = date.fromisoformat(value)
+            else:
+                value = py_type(value)
+        except (TypeError, ValueError):
+            raise InvalidCursor("Invalid cursor")
+    return value, row_id
+
+def page_limit(raw, default: int = PAGE_SIZE) -> int:
+    try:
+        return max(1, min(int(raw), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+def keyset_page(query, column, id_column, cursor: str = None, limit: int = PAGE_SIZE, desc: bool = True) -> dict:
+    """One page of `query` ordered by (column, id), starting after `cursor`.
+
+    Rows are located with a range seek on the ordered column's index instead of
+    OFFSET, so every page costs the same however deep it is. SQLite sorts NULLs
+    last when descending and first when ascending; the NULL run is paged by id
+    and a page that crosses into or out of it is topped up with a second query.
+    """
+    order = (column.desc(), id_column.desc()) if desc else (column.asc(), id_column.asc())
+    # One extra row tells whether another page exists without a COUNT
+    want = limit + 1
+    if not cursor:
+        rows = query.order_by(*order).limit(want).all()
+    else:
+        value, last_id = decode_cursor(cursor, column)
+        null_run = query.filter(column.is_(None)).order_by(id_column.desc() if desc else id_column.asc())
+        if value is None:
+            rows = null_run.filter(id_column < last_id if desc else id_column > last_id).limit(want).all()
+            if not desc and len(rows) < want:
+                rows += query.filter(column.isnot(None)).order_by(*order).limit(want - len(rows)).all()
+        else:
+            after = tuple_(column, id_column) < (value, last_id) if desc else tuple_(column, id_column) > (value, last_id)
+            rows = query.filter(after).order_by(*order).limit(want).all()
+            if desc and len(rows) < want:
+                rows += null_run.limit(want - len(rows)).all()
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), getattr(last, id_column.key))
+    return {"items": items, "next_cursor": next_cursor, "limit": limit}
+
+def row_to_dict(row, exclude: tuple = ()) -> dict:
+    out = {}
+    for col in row.__table__.columns:
+        if col.key in exclude:
+            continue
+        value = getattr(row, col.key)
+        out[col.key] = value.isoformat() if isinstance(value, (datetime, date)) else value
+    return out
+
+def page_to_json(page: dict, exclude: tuple = ()) -> dict:
+    return {
+        "items": [row_to_dict(r, exclude) for r in page["items"]],
+        "next_cursor": page["next_cursor"],
+        "limit": page["limit"]
+    }
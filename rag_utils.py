@@ -1,9 +1,16 @@
 import os
+import re
 import time
-import chromadb
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import http_utils
+from cache_utils import EmbeddingCache, AnswerCache, text_hash
+from search_utils import LexicalIndex, LEXICAL_DB_PATH
+import rerank_utils
+import context_utils
 # from chromadb.utils import embedding_functions
 from datetime import datetime, timezone
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -23,44 +30,230 @@ SYSTEM_PROMPT = "You are Seva-Sakha, an executive assistant for the CEO. Be conc
 
 # Global state
 memory_collection = None
+embedding_provider = None
+embedding_function = None
+embedding_cache = None
+answer_cache = None
+lexical_index = None
 
-class MistralEmbeddingFunction:
-    def __call__(self, input: list[str]) -> list[list[float]]:
-        if not MISTRAL_API_KEY:
-            print("Error: MISTRAL_API_KEY not found.")
-            return []
-        
-        # Mistral embedding API expects 'input' as list of strings
-        # Remove newlines as recommended for some models, though Mistral is robust.
-        # We process in batches if needed, but for now simple pass-through.
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
+# Embedding provider: "mistral" (API) or "local" (sentence-transformers model on CPU, in process)
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "mistral").lower()
+EMBED_MODEL = "mistral-embed"
+MISTRAL_EMBED_DIM = 1024
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_BATCH_SIZE = int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "64"))
+LOCAL_EMBED_THREADS = int(os.getenv("LOCAL_EMBED_THREADS", "0"))  # 0 = torch default
+
+# Embedding batch limits (token counts are estimated locally, ~4 chars/token)
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", "64"))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "8000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_BATCH_RETRIES = int(os.getenv("EMBED_BATCH_RETRIES", "2"))
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text or "") // 4)
+
+def make_embed_batches(texts: list[str], max_items:int=EMBED_BATCH_MAX_ITEMS, max_tokens:int=EMBED_BATCH_MAX_TOKENS) -> list[list[int]]:
+    """Group input positions into batches bounded by item count and estimated tokens."""
+    batches=[]; current=[]; current_tokens=0
+    for i, t in enumerate(texts):
+        n = estimate_tokens(t)
+        if current and (len(current) >= max_items or current_tokens + n > max_tokens):
+            batches.append(current)
+            current=[]; current_tokens=0
+        current.append(i)
+        current_tokens += n
+    if current:
+        batches.append(current)
+    return batches
+
+class EmbeddingProvider(ABC):
+    """Turns texts into vectors. `name`, `model` and `dim` identify the vector
+    space and are recorded on the collection; `embed` returns one vector per
+    input, or [] on failure."""
+    name = ""
+    model = ""
+    dim = 0
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        ...
+
+    def describe(self) -> dict:
+        return {"embed_provider": self.name, "embed_model": self.model, "embed_dim": self.dim}
+
+class MistralEmbeddingProvider(EmbeddingProvider):
+    name = "mistral"
+    model = EMBED_MODEL
+    dim = MISTRAL_EMBED_DIM
+
+    @property
+    def cache_key(self) -> str:
+        # Bare model name, as used by the embedding cache before providers existed
+        return self.model
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]] | None:
         payload = {
-            "model": "mistral-embed",
-            "input": input
+            "model": self.model,
+            "input": texts
         }
-        
         try:
-            resp = requests.post(MISTRAL_EMBED_URL, headers=headers, json=payload, timeout=30)
+            resp = http_utils.post_json("embed", MISTRAL_EMBED_URL, payload)
             if resp.status_code == 200:
                 data = resp.json().get('data', [])
                 # Ensure correct order
+                data = sorted(data, key=lambda item: item.get('index', 0))
                 embeddings = [item['embedding'] for item in data]
-                return embeddings
+                if len(embeddings) == len(texts):
+                    return embeddings
+                print(f"Mistral Embed Error: expected {len(texts)} embeddings, got {len(embeddings)}")
             else:
                 print(f"Mistral Embed Error: {resp.status_code} - {resp.text}")
-                return []
         except Exception as e:
             print(f"Embedding failed: {e}")
+        return None
+
+    def embed(self, input: list[str]) -> list[list[float]]:
+        if not MISTRAL_API_KEY:
+            print("Error: MISTRAL_API_KEY not found.")
+            return []
+
+        batches = make_embed_batches(input)
+        results = [None] * len(input)
+        pending = list(range(len(batches)))
+
+        for attempt in range(EMBED_BATCH_RETRIES + 1):
+            if not pending:
+                break
+            if attempt:
+                print(f"Retrying {len(pending)} failed embedding batch(es), attempt {attempt}")
+                time.sleep(0.5 * attempt)
+            workers = max(1, min(EMBED_CONCURRENCY, len(pending)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {b: pool.submit(self._embed_batch, [input[i] for i in batches[b]]) for b in pending}
+            failed = []
+            for b, fut in futures.items():
+                vectors = fut.result()
+                if vectors is None:
+                    failed.append(b)
+                    continue
+                for pos, vec in zip(batches[b], vectors):
+                    results[pos] = vec
+            pending = failed
+
+        if pending:
+            print(f"Embedding failed for {len(pending)} of {len(batches)} batch(es).")
+            return []
+        return results
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """sentence-transformers model loaded once and kept warm on CPU.
+
+    Inputs are encoded in batches of LOCAL_EMBED_BATCH_SIZE as one padded
+    tensor per batch; vectors are L2-normalised so cosine and L2 rankings agree.
+    Requires the optional `sentence-transformers` package.
+    """
+    name = "local"
+
+    def __init__(self, model: str = LOCAL_EMBED_MODEL, batch_size: int = LOCAL_EMBED_BATCH_SIZE):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("EMBED_PROVIDER=local needs the sentence-transformers package (pip install sentence-transformers)")
+        if LOCAL_EMBED_THREADS > 0:
+            import torch
+            torch.set_num_threads(LOCAL_EMBED_THREADS)
+        t0 = time.time()
+        self.model = model
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model, device="cpu")
+        self._model.eval()
+        self.dim = self._model.get_sentence_embedding_dimension()
+        # The model is shared by request and indexing threads
+        self._lock = threading.Lock()
+        # First call pays for lazy allocations; do it now rather than on a user query
+        self.embed(["warm up"])
+        print(f"Local embedding model {model} ready (dim {self.dim}) in {time.time() - t0:.1f}s")
+
+    def embed(self, input: list[str]) -> list[list[float]]:
+        try:
+            with self._lock:
+                vectors = self._model.encode(list(input), batch_size=self.batch_size, convert_to_numpy=True,
+                                             normalize_embeddings=True, show_progress_bar=False)
+            return vectors.tolist()
+        except Exception as e:
+            print(f"Local embedding failed: {e}")
             return []
 
+EMBED_PROVIDERS = {
+    "mistral": MistralEmbeddingProvider,
+    "local": LocalEmbeddingProvider
+}
+
+def make_embedding_provider(name: str = EMBED_PROVIDER) -> EmbeddingProvider:
+    if name not in EMBED_PROVIDERS:
+        raise ValueError(f"Unknown EMBED_PROVIDER {name!r}; expected one of {', '.join(EMBED_PROVIDERS)}")
+    return EMBED_PROVIDERS[name]()
+
+class CachedEmbeddingFunction:
+    """Chroma embedding function: cache lookups in front of a provider."""
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache | None = None):
+        self.provider = provider
+        self.cache = cache
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        if not input:
+            return []
+        if self.cache is None:
+            return self.provider.embed(input)
+
+        key = self.provider.cache_key
+        results = [None] * len(input)
+        for i, vec in self.cache.get_many(key, input).items():
+            results[i] = vec
+        missing = list(dict.fromkeys(t for t, r in zip(input, results) if r is None))
+        if missing:
+            vectors = self.provider.embed(missing)
+            if not vectors:
+                return []
+            self.cache.put_many(key, missing, vectors)
+            fresh = dict(zip(missing, vectors))
+            results = [r if r is not None else fresh[t] for t, r in zip(input, results)]
+        return results
+
+def collection_name_for(provider: EmbeddingProvider) -> str:
+    """One collection per vector space. The Mistral collection keeps its original name."""
+    if provider.name == "mistral":
+        return CHROMA_COLLECTION
+    slug = re.sub(r"[^a-z0-9]+", "_", provider.model.split("/")[-1].lower()).strip("_")
+    return f"executive_memory_{provider.name}_{slug}"[:63]
+
+def check_collection_space(collection, provider: EmbeddingProvider):
+    """Record the provider/model/dim on the collection, or refuse one built by another provider."""
+    meta = dict(collection.metadata or {})
+    expected = provider.describe()
+    recorded = {k: meta[k] for k in expected if k in meta}
+    if not recorded:
+        # Collections created before providers were tracked were all built by Mistral
+        if provider.name != "mistral" and collection.count() > 0:
+            raise RuntimeError(f"Collection {collection.name} has untagged vectors; refusing to use it with {provider.cache_key}")
+        meta.pop("hnsw:space", None)  # fixed at creation, cannot be modified
+        collection.modify(metadata={**meta, **expected})
+        return
+    if recorded != expected:
+        raise RuntimeError(f"Collection {collection.name} holds {recorded} vectors; refusing to mix in {expected}")
+
 def init_chroma():
-    global memory_collection
+    global memory_collection, embedding_provider, embedding_function, embedding_cache, answer_cache
     print("Initializing Chroma at:", CHROMA_PATH)
     
+    # Imported here so the rest of the module (chunking, retrieval) loads without chromadb
+    import chromadb
     # Disable telemetry to avoid startup errors
     from chromadb.config import Settings
     chroma_client = chromadb.PersistentClient(
@@ -68,9 +261,39 @@ def init_chroma():
         settings=Settings(anonymized_telemetry=False)
     )
     
-    embedding_fn = MistralEmbeddingFunction()
-    memory_collection = chroma_client.get_or_create_collection(name=CHROMA_COLLECTION, embedding_function=embedding_fn)
-    print("Chroma collection ready:", memory_collection.name)
+    embedding_provider = make_embedding_provider()
+    embedding_cache = EmbeddingCache()
+    answer_cache = AnswerCache(space=embedding_provider.cache_key)
+    embedding_function = CachedEmbeddingFunction(embedding_provider, cache=embedding_cache)
+    # No metadata here: get_or_create would overwrite what an existing collection recorded
+    memory_collection = chroma_client.get_or_create_collection(name=collection_name_for(embedding_provider), embedding_function=embedding_function)
+    check_collection_space(memory_collection, embedding_provider)
+    print(f"Chroma collection ready: {memory_collection.name} ({embedding_provider.cache_key}, dim {embedding_provider.dim})")
+    _init_lexical_index()
+
+def _init_lexical_index():
+    global lexical_index
+    # The lexical index mirrors one collection, so each collection gets its own file
+    path = LEXICAL_DB_PATH
+    if memory_collection.name != CHROMA_COLLECTION:
+        root, ext = os.path.splitext(LEXICAL_DB_PATH)
+        path = f"{root}_{memory_collection.name}{ext}"
+    lexical_index = LexicalIndex(path)
+    # An index created next to an existing collection starts empty: copy the chunks over once
+    if lexical_index.count() == 0 and memory_collection.count() > 0:
+        def backfill():
+            n = lexical_index.backfill(memory_collection)
+            print(f"Lexical index backfilled with {n} chunks.")
+        threading.Thread(target=backfill, name="lexical-backfill", daemon=True).start()
+
+def _lexical_write(op: str, *args):
+    # The lexical index mirrors Chroma; a failure here must not fail the Chroma write
+    if lexical_index is None:
+        return
+    try:
+        getattr(lexical_index, op)(*args)
+    except Exception as e:
+        print(f"Lexical index {op} failed: {e}")
 
 def init_llm():
     # Deprecated: Local LLM is replaced by Mistral API
@@ -87,51 +310,276 @@ def chunk_text(text: str, chunk_size:int=900, overlap:int=200) -> list[str]:
         start = max(0, end-overlap)
     return chunks
 
-def index_into_memory(source_type: str, title: str, full_text: str, extra_meta: dict[str,any] = None) -> str:
-    if memory_collection is None:
-        return "Memory not initialized."
-        
-    full_text = (full_text or "").strip()
-    if not full_text: return "Nothing to index."
+def iter_page_chunks(pages, chunk_size:int=900, overlap:int=200):
+    """Streaming counterpart of chunk_text over (page_number, text) pairs.
+
+    Yields (page_number, chunk) as soon as enough text has arrived; windows may
+    span page breaks and are attributed to the page they start on. Only about
+    one chunk plus the current page is held in memory.
+    """
+    buf = ""
+    starts = []  # (offset in buf, page_number), first entry always at offset 0
+    step = chunk_size - overlap
+    for page_no, text in pages:
+        text = (text or "").strip()
+        if not text:
+            continue
+        if buf:
+            buf += "\n"
+        starts.append((len(buf), page_no))
+        buf += text
+        while len(buf) > chunk_size:
+            yield starts[0][1], buf[:chunk_size]
+            buf = buf[step:]
+            shifted = [(off - step, p) for off, p in starts]
+            before = [p for off, p in shifted if off <= 0]
+            starts = [(0, before[-1])] + [(off, p) for off, p in shifted if off > 0]
+    if buf:
+        yield starts[0][1], buf
+
+def _clean_meta(extra_meta: dict[str,any] = None) -> dict:
+    # Ensure all meta values are strings, ints, or floats for Chroma
+    return {k: str(v) if v is not None else "" for k,v in (extra_meta or {}).items()}
+
+def chunk_id(source_type: str, source_id: str, chunk: str, seen: dict = None) -> str:
+    """Deterministic chunk ID: same source row + same chunk text -> same ID.
+    `seen` disambiguates identical chunks repeated within one source."""
+    h = text_hash(chunk)[:16]
+    if seen is not None:
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        if n:
+            h = f"{h}-{n}"
+    return f"{source_type}:{source_id}:{h}"
+
+def _source_id(source_id, full_text: str) -> str:
+    # Rows without an SQL id (translations, voice commands, notes) are keyed by content,
+    # so indexing the same text twice is still a no-op
+    return str(source_id) if source_id not in (None, "") else f"content-{text_hash(full_text)[:16]}"
+
+def _build_chunk_records(source_type: str, title: str, full_text: str, extra_meta: dict[str,any] = None, source_id=None):
     chunks = chunk_text(full_text)
-    if not chunks: return "No non-empty chunks."
+    sid = _source_id(source_id, full_text)
     
     now_iso = datetime.now(timezone.utc).isoformat()
     base_meta = {"source_type": source_type, "title": title or "", "created_at": now_iso}
-    if extra_meta: 
-        # Ensure all meta values are strings, ints, or floats for Chroma
-        clean_extra = {k: str(v) if v is not None else "" for k,v in extra_meta.items()}
-        base_meta.update(clean_extra)
+    base_meta.update(_clean_meta(extra_meta))
+    base_meta["source_id"] = sid
     
     ids=[]; metadatas=[]; documents=[]
-    import uuid
-    
+    seen = {}
     for i,chunk in enumerate(chunks):
-        # Use UUID to prevent collisions if multiple items indexed same second
-        unique_id = f"{source_type}_{uuid.uuid4().hex[:8]}_{i}"
-        ids.append(unique_id)
+        ids.append(chunk_id(source_type, sid, chunk, seen))
         m = base_meta.copy(); m["chunk_index"] = i
         metadatas.append(m)
         documents.append(chunk)
+    return sid, ids, metadatas, documents
+
+def _existing_ids(source_type: str, source_id: str) -> set[str]:
+    res = memory_collection.get(where={"$and": [{"source_type": source_type}, {"source_id": source_id}]}, include=[])
+    return set(res.get("ids", []))
+
+def _plan_sync(source_type: str, sid: str, ids, metadatas, documents):
+    """Split a source's chunk records into new ones (need embedding), unchanged ones
+    (metadata refresh only) and stale IDs that are no longer produced."""
+    existing = _existing_ids(source_type, sid)
+    new = [(i, m, d) for i, m, d in zip(ids, metadatas, documents) if i not in existing]
+    kept = [(i, m) for i, m in zip(ids, metadatas) if i in existing]
+    stale = sorted(existing - set(ids))
+    return new, kept, stale
+
+def _apply_sync(new, kept, stale):
+    if stale:
+        memory_collection.delete(ids=stale)
+        _lexical_write("delete", stale)
+    if new:
+        memory_collection.upsert(ids=[n[0] for n in new], metadatas=[n[1] for n in new], documents=[n[2] for n in new])
+        _lexical_write("upsert", [n[0] for n in new], [n[1] for n in new], [n[2] for n in new])
+    if kept:
+        # Metadata-only update: no documents are passed, so nothing is re-embedded
+        memory_collection.update(ids=[k[0] for k in kept], metadatas=[k[1] for k in kept])
+        _lexical_write("update_metadata", [k[0] for k in kept], [k[1] for k in kept])
+
+def index_into_memory(source_type: str, title: str, full_text: str, extra_meta: dict[str,any] = None, source_id=None) -> str:
+    """Idempotently index one source item.
+
+    Chunk IDs derive from (source_type, source_id, chunk hash). Chunks already
+    stored are not embedded again, chunks the item no longer produces are
+    deleted, so re-indexing an edited row only touches what changed.
+    """
+    if memory_collection is None:
+        return "Memory not initialized."
+        
+    full_text = (full_text or "").strip()
+    if not full_text: return "Nothing to index."
+    sid, ids, metadatas, documents = _build_chunk_records(source_type, title, full_text, extra_meta, source_id)
+    if not documents: return "No non-empty chunks."
         
     try:
-        print(f"Indexing {len(chunks)} chunks for {source_type}: {title}")
-        memory_collection.add(documents=documents, metadatas=metadatas, ids=ids)
-        return f"✅ Indexed {len(chunks)} chunks of {source_type} '{title}' into memory."
+        new, kept, stale = _plan_sync(source_type, sid, ids, metadatas, documents)
+        print(f"Indexing {source_type}: {title} ({len(new)} new, {len(kept)} unchanged, {len(stale)} removed chunks)")
+        _apply_sync(new, kept, stale)
+        if answer_cache is not None and (new or stale):
+            answer_cache.bump_version(source_type)
+        if not new and not stale:
+            return f"✅ {source_type} '{title}' already up to date in memory."
+        return f"✅ Indexed {len(new)} new chunks of {source_type} '{title}' into memory ({len(kept)} unchanged, {len(stale)} removed)."
     except Exception as e:
         print(f"Indexing Error: {e}")
         return f"❌ Indexing failed: {e}"
 
-def safe_call_llm(messages: list[dict[str,str]], max_new_tokens:int=400, temperature:float=0.2) -> str:
+def remove_from_memory(source_type: str, source_id, keep: set[str] = None) -> int:
+    """Delete every chunk of one source item (e.g. after its SQL row is deleted),
+    or, with `keep`, only the chunks whose IDs are not in it."""
+    if memory_collection is None:
+        return 0
+    try:
+        ids = sorted(_existing_ids(source_type, str(source_id)) - (keep or set()))
+        if ids:
+            memory_collection.delete(ids=ids)
+            _lexical_write("delete", ids)
+            if answer_cache is not None:
+                answer_cache.bump_version(source_type)
+        return len(ids)
+    except Exception as e:
+        print(f"Memory delete failed: {e}")
+        return 0
+
+def index_chunks_into_memory(source_type: str, title: str, chunks: list[str], extra_meta: dict[str,any] = None, start_index: int = 0, pages: list[int] = None, source_id=None, produced: set[str] = None) -> str:
+    """Index text that has already been chunked (used by the document pipeline,
+    which feeds chunks as pages are extracted). chunk_index continues from start_index;
+    `pages` optionally gives the source page of each chunk for citations.
+    IDs are deterministic per (source_type, source_id, chunk_index, chunk hash); chunks
+    already stored are not embedded again. A batch is only part of its source, so
+    nothing is deleted here: collect the IDs in `produced` and pass them to
+    remove_from_memory(keep=...) once the whole source has been indexed.
+    `source_id` is required: the full text is not known up front, so there is no
+    content to key the source by."""
+    if source_id in (None, ""):
+        raise ValueError("index_chunks_into_memory needs a source_id")
+    if memory_collection is None:
+        return "Memory not initialized."
+    pages = pages or [None] * len(chunks)
+    kept = [(c, p) for c, p in zip(chunks, pages) if c and c.strip()]
+    if not kept: return "No non-empty chunks."
+    chunks = [c for c, _ in kept]
+    pages = [p for _, p in kept]
+    
+    sid = str(source_id)
+    now_iso = datetime.now(timezone.utc).isoformat()
+    base_meta = {"source_type": source_type, "title": title or "", "created_at": now_iso}
+    base_meta.update(_clean_meta(extra_meta))
+    base_meta["source_id"] = sid
+    
+    ids = [chunk_id(source_type, sid, f"{start_index+i}:{c}") for i, c in enumerate(chunks)]
+    metadatas = []
+    for i in range(len(chunks)):
+        m = base_meta.copy(); m["chunk_index"] = start_index + i
+        if pages[i] is not None:
+            m["page"] = pages[i]
+        metadatas.append(m)
+    if produced is not None:
+        produced.update(ids)
+    
+    try:
+        new, unchanged, _ = _plan_sync(source_type, sid, ids, metadatas, chunks)
+        _apply_sync(new, unchanged, [])
+        if answer_cache is not None and new:
+            answer_cache.bump_version(source_type)
+        return f"✅ Indexed {len(new)} new chunks of {source_type} '{title}' into memory ({len(unchanged)} unchanged)."
+    except Exception as e:
+        print(f"Indexing Error: {e}")
+        return f"❌ Indexing failed: {e}"
+
+def index_pages_into_memory(source_type: str, title: str, pages, extra_meta: dict[str,any] = None, batch_size: int = 32, source_id=None) -> str:
+    """Stream (page_number, text) pairs (e.g. cv_utils.iter_pdf_pages) into memory,
+    indexing `batch_size` chunks at a time with their page number in the metadata.
+    Chunks of an earlier version of the source that were not produced again are
+    removed at the end. `source_id` is required, as for index_chunks_into_memory."""
+    if source_id in (None, ""):
+        raise ValueError("index_pages_into_memory needs a source_id")
+    total = 0
+    produced = set()
+    batch = []; batch_pages = []
+    for page_no, chunk in iter_page_chunks(pages):
+        batch.append(chunk); batch_pages.append(page_no)
+        if len(batch) >= batch_size:
+            res = index_chunks_into_memory(source_type, title, batch, extra_meta, start_index=total, pages=batch_pages, source_id=source_id, produced=produced)
+            if not res.startswith("✅"):
+                return res
+            total += len(batch)
+            batch = []; batch_pages = []
+    if batch:
+        res = index_chunks_into_memory(source_type, title, batch, extra_meta, start_index=total, pages=batch_pages, source_id=source_id, produced=produced)
+        if not res.startswith("✅"):
+            return res
+        total += len(batch)
+    if not total:
+        return "Nothing to index."
+    removed = remove_from_memory(source_type, source_id, keep=produced)
+    return f"✅ Indexed {total} chunks of {source_type} '{title}' into memory ({removed} removed)."
+
+def index_batch_into_memory(entries: list[dict]) -> list[str]:
+    """Index several items with one upsert (one round of embedding calls).
+
+    Each entry has the index_into_memory arguments as keys. Returns one status
+    message per entry, in order. If the combined write fails, items are retried
+    one by one so a single bad entry does not fail the whole batch.
+    """
+    if memory_collection is None:
+        return ["Memory not initialized."] * len(entries)
+    
+    results = [None] * len(entries)
+    all_new=[]; all_kept=[]; all_stale=[]; planned=[]
+    try:
+        records = {}
+        for n, e in enumerate(entries):
+            full_text = (e.get("full_text") or "").strip()
+            if not full_text:
+                results[n] = "Nothing to index."
+                continue
+            sid, ids, metas, docs = _build_chunk_records(e.get("source_type"), e.get("title"), full_text, e.get("extra_meta"), e.get("source_id"))
+            if not docs:
+                results[n] = "No non-empty chunks."
+                continue
+            # Several updates to the same source in one batch: only the latest is written
+            key = (e.get("source_type"), sid)
+            if key in records:
+                prev = records[key][0]
+                results[prev] = f"✅ {e.get('source_type')} '{entries[prev].get('title')}' superseded by a newer update."
+            records[key] = (n, sid, ids, metas, docs)
+        for key, (n, sid, ids, metas, docs) in records.items():
+            new, kept, stale = _plan_sync(key[0], sid, ids, metas, docs)
+            all_new += new; all_kept += kept; all_stale += stale
+            planned.append((n, len(new), len(kept), len(stale)))
+        if not planned:
+            return results
+        print(f"Indexing batch of {len(planned)} items ({len(all_new)} new, {len(all_kept)} unchanged, {len(all_stale)} removed chunks)")
+        _apply_sync(all_new, all_kept, all_stale)
+    except Exception as ex:
+        print(f"Batch Indexing Error: {ex}, falling back to single items")
+        for n, e in enumerate(entries):
+            if results[n] is None or "superseded" in results[n]:
+                results[n] = index_into_memory(e.get("source_type"), e.get("title"), e.get("full_text"), e.get("extra_meta"), e.get("source_id"))
+        return results
+    
+    if answer_cache is not None:
+        for source_type in {entries[n].get("source_type") for n, added, _, removed in planned if added or removed}:
+            answer_cache.bump_version(source_type)
+    for n, added, kept, removed in planned:
+        e = entries[n]
+        if not added and not removed:
+            results[n] = f"✅ {e.get('source_type')} '{e.get('title')}' already up to date in memory."
+        else:
+            results[n] = f"✅ Indexed {added} new chunks of {e.get('source_type')} '{e.get('title')}' into memory ({kept} unchanged, {removed} removed)."
+    return results
+
+def safe_call_llm(messages: list[dict[str,str]], max_new_tokens:int=400, temperature:float=0.2, route:str="default") -> str:
     if not MISTRAL_API_KEY:
         return "❌ Error: MISTRAL_API_KEY not found in .env"
 
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    
+    # Route budgets: trims an oversized prompt, caps max_tokens and logs the prompt size
+    messages, max_new_tokens = context_utils.enforce(route, messages, max_new_tokens)
     payload = {
         "model": MISTRAL_MODEL,
         "messages": messages,
@@ -141,10 +589,11 @@ def safe_call_llm(messages: list[dict[str,str]], max_new_tokens:int=400, tempera
     
     try:
         print(f"Calling Mistral Chat API: {MISTRAL_MODEL}")
-        response = requests.post(MISTRAL_API_URL, headers=headers, json=payload, timeout=30)
+        response = http_utils.post_json("chat", MISTRAL_API_URL, payload)
         
         if response.status_code == 200:
             result = response.json()
+            context_utils.record_usage(route, result.get('usage'))
             content = result['choices'][0]['message']['content']
             return content
         else:
@@ -153,38 +602,142 @@ def safe_call_llm(messages: list[dict[str,str]], max_new_tokens:int=400, tempera
     except Exception as e:
         return f"❌ LLM Call Failed: {str(e)}"
 
-def ask_seva_sakha(query: str, scope: str="all") -> str:
+# Retrieval. "hybrid" fuses BM25 and vector scores; queries that look like exact
+# lookups (emails, phone numbers, amounts) are answered from the lexical index
+# alone when it has hits. "lexical" never calls the embed API.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid") # hybrid, vector, lexical
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.6")) # weight of the vector score in hybrid mode
+RETRIEVAL_TOP_K = 8
+EXACT_TOKEN_RE = re.compile(r"[\w.+-]+@[\w-]+\.\w+|\+?\d[\d ().-]{5,}\d|\$ ?\d")
+
+def looks_like_exact_lookup(query: str) -> bool:
+    return bool(EXACT_TOKEN_RE.search(query or ""))
+
+def vector_search(q: str, q_emb, n: int = RETRIEVAL_TOP_K, scope: str = "all") -> list[dict]:
+    where = {"source_type": scope} if scope and scope != "all" else None
+    if q_emb is not None:
+        res = memory_collection.query(query_embeddings=[q_emb], n_results=n, where=where)
+    else:
+        res = memory_collection.query(query_texts=[q], n_results=n, where=where)
+    ids = res.get("ids", [[]])[0]
+    docs = res.get("documents", [[]])[0]
+    metas = res.get("metadatas", [[]])[0]
+    dists = (res.get("distances") or [[None] * len(ids)])[0]
+    return [{"id": i, "document": d, "meta": m or {}, "score": -(dist or 0.0)} for i, d, m, dist in zip(ids, docs, metas, dists)]
+
+def lexical_search(q: str, n: int = RETRIEVAL_TOP_K, scope: str = "all") -> list[dict]:
+    if lexical_index is None:
+        return []
+    return lexical_index.search(q, n=n, source_type=scope if scope and scope != "all" else None)
+
+def _normalized(hits: list[dict]) -> dict[str, float]:
+    if not hits:
+        return {}
+    scores = [h["score"] for h in hits]
+    lo, hi = min(scores), max(scores)
+    return {h["id"]: (h["score"] - lo) / (hi - lo) if hi > lo else 1.0 for h in hits}
+
+def fuse_hits(vector_hits: list[dict], lexical_hits: list[dict], alpha: float = HYBRID_ALPHA, n: int = RETRIEVAL_TOP_K) -> list[dict]:
+    """Weighted sum of min-max normalized scores; a chunk missing from one list scores 0 there."""
+    vec, lex = _normalized(vector_hits), _normalized(lexical_hits)
+    by_id = {h["id"]: h for h in lexical_hits}
+    by_id.update({h["id"]: h for h in vector_hits})
+    fused = []
+    for cid, h in by_id.items():
+        fused.append(dict(h, score=alpha * vec.get(cid, 0.0) + (1 - alpha) * lex.get(cid, 0.0),
+                          vector_score=vec.get(cid), lexical_score=lex.get(cid)))
+    fused.sort(key=lambda h: h["score"], reverse=True)
+    return fused[:n]
+
+def search_memory(q: str, q_emb=None, scope: str = "all", mode: str = None) -> list[dict]:
+    """Vector (or fused hybrid) candidates for the re-ranker."""
+    mode = mode or RETRIEVAL_MODE
+    n = rerank_utils.RERANK_CANDIDATES
+    hits = vector_search(q, q_emb, n=n, scope=scope)
+    if mode == "hybrid":
+        hits = fuse_hits(hits, lexical_search(q, n=n, scope=scope), n=n)
+    return hits
+
+def retrieve(query: str, scope: str = "all", mode: str = None) -> list[dict]:
+    """Re-ranked memory passages for a query, for routes that put memory context
+    into their own prompt instead of asking for a finished answer."""
+    q = (query or "").strip()
+    mode = mode or RETRIEVAL_MODE
+    hits = []
+    if mode == "lexical" or (mode == "hybrid" and looks_like_exact_lookup(q)):
+        hits = lexical_search(q, n=rerank_utils.RERANK_CANDIDATES, scope=scope)
+    if not hits and mode != "lexical" and memory_collection is not None:
+        try:
+            hits = search_memory(q, scope=scope, mode=mode)
+        except Exception as e:
+            print(f"Search error: {e}")
+            return []
+    return rerank_utils.rerank(q, hits, top_k=RETRIEVAL_TOP_K)
+
+def memory_passages(hits: list[dict]) -> list[dict]:
+    """Re-ranked hits as context_utils passages, labelled with their source. They
+    keep the MMR order, so pass them to build_context with ranked=True."""
+    passages = []
+    for h in hits:
+        m = h["meta"]
+        s_page = f", Page: {m['page']}" if m.get('page') else ""
+        passages.append({
+            "text": h["document"],
+            "score": h.get("rerank_score", h["score"]),
+            "label": f"Category: {m.get('source_type', 'unknown')}, Title: {m.get('title', 'unknown')}{s_page}"
+        })
+    return passages
+
+def ask_seva_sakha(query: str, scope: str="all", mode: str = None) -> str:
     q = (query or "").strip()
     if not q: return "Please enter a question."
+    scope = scope or "all"
+    mode = mode or RETRIEVAL_MODE
     
-    where = None
-    if scope and scope != "all": 
-        where = {"source_type": scope}
+    hits = None
+    if mode == "lexical" or (mode == "hybrid" and looks_like_exact_lookup(q)):
+        # Fast path: no embedding round trip
+        hits = lexical_search(q, n=rerank_utils.RERANK_CANDIDATES, scope=scope)
+        print(f"Lexical search ({scope}): {len(hits)} hits")
+        if not hits and mode == "hybrid":
+            hits = None
     
-    print(f"Querying memory with scope: {scope}, where filter: {where}")
+    # Embed once: the vector serves both the answer cache and the Chroma query
+    q_emb = None
+    version = 0
+    if hits is None and answer_cache is not None and embedding_function is not None:
+        version = answer_cache.version(scope)
+        embs = embedding_function([q])
+        q_emb = embs[0] if embs else None
+        if q_emb is not None:
+            cached = answer_cache.lookup(scope, q_emb)
+            if cached is not None:
+                print(f"Answer cache hit for scope: {scope}")
+                return cached
     
-    try:
-        # Increase n_results to find more potential matches
-        res = memory_collection.query(query_texts=[q], n_results=8, where=where)
-        docs = res.get("documents", [[]])[0]
-        metas = res.get("metadatas", [[]])[0]
-        
-        print(f"Found {len(docs)} documents in memory for query.")
-    except Exception as e:
-        print(f"Search error: {e}")
-        return f"Memory search failed: {e}"
+    if hits is None:
+        print(f"Querying memory with scope: {scope}, mode: {mode}")
+        try:
+            hits = search_memory(q, q_emb, scope=scope, mode=mode)
+            print(f"Found {len(hits)} documents in memory for query.")
+        except Exception as e:
+            print(f"Search error: {e}")
+            return f"Memory search failed: {e}"
         
-    if not docs:
+    if not hits:
         return f"No relevant memory found for '{scope}' scope. Please ensure you have indexed data in this category."
-        
-    ctx = ""
-    for i, (d, m) in enumerate(zip(docs, metas), 1):
-        s_type = m.get('source_type', 'unknown')
-        s_title = m.get('title', 'unknown')
-        ctx += f"--- Result {i} (Category: {s_type}, Title: {s_title}) ---\n{d}\n\n"
+    
+    # Merge overlapping windows, drop duplicates and re-rank, then pack into the "ask" budget
+    hits = rerank_utils.rerank(q, hits, top_k=RETRIEVAL_TOP_K)
+    instruction = f"Based on the following context, please answer the question: {q}\n\nContext:\n\n\nAnswer:"
+    ctx = context_utils.build_context("ask", memory_passages(hits), reserved=[SYSTEM_PROMPT, instruction],
+                                      ranked=True)
         
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": f"Based on the following context, please answer the question: {q}\n\nContext:\n{ctx}\n\nAnswer:"}
     ]
-    return safe_call_llm(messages, max_new_tokens=500)
+    answer = safe_call_llm(messages, max_new_tokens=500, route="ask")
+    if q_emb is not None and not answer.startswith("❌"):
+        answer_cache.put(scope, q, q_emb, answer, version)
+    return answer
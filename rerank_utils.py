@@ -0,0 +1,171 @@
+import os
+import re
+import math
+import threading
+from collections import Counter
+from cache_utils import text_hash
+from search_utils import STOPWORDS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Post-retrieval stage for ask_seva_sakha: fetch RERANK_CANDIDATES chunks, merge
+# overlapping windows, drop near-duplicates, re-rank locally and order a diverse
+# set with MMR. context_utils.build_context then packs it into the "ask" budget.
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "32"))
+RERANK_MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", "0.7"))  # 1.0 = relevance only
+RERANK_DUP_THRESHOLD = float(os.getenv("RERANK_DUP_THRESHOLD", "0.8"))  # shared shingles, relative to the smaller passage
+RERANK_RETRIEVAL_WEIGHT = 0.5  # rest goes to query-term coverage
+MAX_CHUNK_OVERLAP = 300  # chunk_text overlaps windows by 200 chars
+MAX_MERGED_CHUNKS = 3  # longer runs are split so one source cannot fill the budget
+
+# Global state
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _terms(text: str) -> list[str]:
+    return [t for t in re.findall(r"\w+", (text or "").lower()) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b`."""
+    for k in range(min(len(a), len(b), MAX_CHUNK_OVERLAP), 0, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+def _document_key(h: dict):
+    """What identifies the document a chunk belongs to, or None if unknown."""
+    m = h["meta"]
+    if m.get("source_id") not in (None, ""):
+        return (m.get("source_type"), str(m["source_id"]))
+    # Chunks indexed before source ids have ids "<source_type>_<uuid>_<i>", one uuid per document
+    prefix, sep, _ = (h.get("id") or "").rpartition("_")
+    return (m.get("source_type"), "legacy:" + prefix) if sep else None
+
+def merge_adjacent(hits: list[dict]) -> list[dict]:
+    """Join hits that are consecutive windows of the same source into one passage,
+    dropping the repeated overlap. The passage keeps the best score of its parts.
+    Hits whose document cannot be told are left as they are."""
+    groups = {}
+    loose = []
+    for h in hits:
+        key = _document_key(h)
+        try:
+            idx = int(h["meta"].get("chunk_index"))
+        except (TypeError, ValueError):
+            key = None
+        if key is None:
+            loose.append(h)
+            continue
+        groups.setdefault(key, []).append((idx, h))
+    merged = []
+    for parts in groups.values():
+        parts.sort(key=lambda p: p[0])
+        run_idx, run = parts[0]
+        for idx, h in parts[1:]:
+            if idx == run_idx + 1 and len(run.get("ids", [run["id"]])) < MAX_MERGED_CHUNKS:
+                text = run["document"] + h["document"][_overlap(run["document"], h["document"]):]
+                run = dict(run, document=text, score=max(run["score"], h["score"]),
+                           ids=run.get("ids", [run["id"]]) + [h["id"]])
+            else:
+                merged.append(run)
+                run = h
+            run_idx = idx
+        merged.append(run)
+    merged.extend(loose)
+    merged.sort(key=lambda h: h["score"], reverse=True)
+    return merged
+
+def _shingles(text: str, k: int = 5) -> set:
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) <= k:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+def drop_duplicates(hits: list[dict], threshold: float = RERANK_DUP_THRESHOLD) -> list[dict]:
+    """Keep the best-scored copy of identical or near-identical passages (e.g. the
+    same email indexed twice, or a chunk contained in a merged passage).
+    Similarity is shingle overlap relative to the smaller passage. Expects hits
+    sorted by score."""
+    kept = []
+    seen_hashes = set()
+    kept_shingles = []
+    for h in hits:
+        digest = text_hash(" ".join((h["document"] or "").split()))
+        if digest in seen_hashes:
+            continue
+        sh = _shingles(h["document"])
+        if any(len(sh & other) / min(len(sh), len(other)) >= threshold for other in kept_shingles):
+            continue
+        seen_hashes.add(digest)
+        kept_shingles.append(sh)
+        kept.append(h)
+    return kept
+
+def rerank_scores(query: str, hits: list[dict], retrieval_weight: float = RERANK_RETRIEVAL_WEIGHT) -> list[float]:
+    """Cheap local relevance: the normalized retrieval score blended with the
+    IDF-weighted share of query terms the passage contains (IDF over the candidates)."""
+    q_terms = set(_terms(query))
+    doc_terms = [set(_terms(h["document"]) + _terms(h["meta"].get("title", ""))) for h in hits]
+    n = len(hits)
+    idf = {t: math.log(1 + n / (1 + sum(t in d for d in doc_terms))) for t in q_terms}
+    total = sum(idf.values())
+    scores = [h["score"] for h in hits]
+    lo, hi = min(scores), max(scores)
+    out = []
+    for h, terms in zip(hits, doc_terms):
+        retrieval = (h["score"] - lo) / (hi - lo) if hi > lo else 1.0
+        coverage = sum(w for t, w in idf.items() if t in terms) / total if total else 0.0
+        out.append(retrieval_weight * retrieval + (1 - retrieval_weight) * coverage)
+    return out
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(v * b.get(t, 0) for t, v in a.items())
+    return dot / (math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values())))
+
+def mmr_order(hits: list[dict], relevance: list[float], lam: float = RERANK_MMR_LAMBDA) -> list[int]:
+    """Maximal marginal relevance over term-frequency vectors: each pick trades
+    relevance against similarity to the passages already picked."""
+    vectors = [Counter(_terms(h["document"])) for h in hits]
+    remaining = list(range(len(hits)))
+    order = []
+    while remaining:
+        best, best_val = None, None
+        for i in remaining:
+            redundancy = max((_cosine(vectors[i], vectors[j]) for j in order), default=0.0)
+            val = lam * relevance[i] - (1 - lam) * redundancy
+            if best_val is None or val > best_val:
+                best, best_val = i, val
+        order.append(best)
+        remaining.remove(best)
+    return order
+
+def rerank(query: str, hits: list[dict], top_k: int = 8) -> list[dict]:
+    """Candidates from retrieval -> at most top_k passages for the prompt, in MMR
+    order. Each returned hit gets a `rerank_score`; `mmr_rank` is its position."""
+    if not hits:
+        return []
+    merged = drop_duplicates(merge_adjacent(hits))
+    relevance = rerank_scores(query, merged)
+    order = mmr_order(merged, relevance)[:top_k]
+    kept = [dict(merged[i], rerank_score=round(relevance[i], 4), mmr_rank=r) for r, i in enumerate(order)]
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["candidates"] += len(hits)
+        _stats["after_dedupe"] += len(merged)
+        _stats["kept"] += len(kept)
+    return kept
+
+def get_stats() -> dict:
+    with _stats_lock:
+        calls = _stats["calls"]
+        return {
+            "candidates": RERANK_CANDIDATES,
+            "mmr_lambda": RERANK_MMR_LAMBDA,
+            "calls": calls,
+            "avg_candidates": round(_stats["candidates"] / calls, 1) if calls else 0.0,
+            "avg_after_dedupe": round(_stats["after_dedupe"] / calls, 1) if calls else 0.0,
+            "avg_kept": round(_stats["kept"] / calls, 1) if calls else 0.0
+        }
@@ -0,0 +1,169 @@
+from collections import defaultdict
+from sqlalchemy import event, func, select, delete
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+import models
+
+# Rollup tables are kept in step with expenses and tasks inside the same
+# transaction as the write (see the flush hooks at the bottom), so reports read
+# a handful of pre-aggregated rows instead of scanning the base tables.
+# Bulk query().update()/delete() bypass the hooks; init() detects the drift
+# on the next start and rebuilds.
+
+EXPENSE_COLS = ("date", "category", "amount")
+TASK_COLS = ("status", "priority")
+
+def _expense_keys(d, category):
+    day = d.strftime("%Y-%m-%d") if d else ""
+    return [("day", day, category or ""), ("month", day[:7], category or "")]
+
+def _default(model, col):
+    default = model.__table__.c[col].default
+    return default.arg if default is not None and not callable(default.arg) else None
+
+def _values(obj, cols):
+    return {c: getattr(obj, c) if getattr(obj, c) is not None else _default(type(obj), c) for c in cols}
+
+# --- Queries -------------------------------------------------------------
+
+def month_period(d, months_back: int = 0) -> str:
+    """YYYY-MM period of the month `months_back` calendar months before date `d`."""
+    n = d.year * 12 + d.month - 1 - months_back
+    return f"{n // 12:04d}-{n % 12 + 1:02d}"
+
+def expense_totals(db) -> dict:
+    count, amount = db.execute(
+        select(func.coalesce(func.sum(models.ExpenseRollup.count), 0), func.coalesce(func.sum(models.ExpenseRollup.amount), 0.0))
+        .where(models.ExpenseRollup.grain == "month")
+    ).one()
+    return {"count": count, "amount": float(amount)}
+
+def expense_series(db, grain: str = "month", start: str = None, end: str = None, category: str = None) -> list[dict]:
+    """Expense count/amount per period, oldest first. `start`/`end` are inclusive
+    period strings (YYYY-MM or YYYY-MM-DD, matching the grain)."""
+    R = models.ExpenseRollup
+    q = select(R.period, func.sum(R.count), func.sum(R.amount)).where(R.grain == grain, R.period != "")
+    if start:
+        q = q.where(R.period >= start)
+    if end:
+        q = q.where(R.period <= end)
+    if category is not None:
+        q = q.where(R.category == category)
+    rows = db.execute(q.group_by(R.period).order_by(R.period)).all()
+    return [{"period": p, "count": c, "amount": round(float(a or 0), 2)} for p, c, a in rows]
+
+def expense_by_category(db, start: str = None, end: str = None) -> list[dict]:
+    R = models.ExpenseRollup
+    q = select(R.category, func.sum(R.count), func.sum(R.amount)).where(R.grain == "month")
+    if start:
+        q = q.where(R.period >= start)
+    if end:
+        q = q.where(R.period <= end)
+    rows = db.execute(q.group_by(R.category).order_by(func.sum(R.amount).desc())).all()
+    return [{"category": c or "Uncategorized", "count": n, "amount": round(float(a or 0), 2)} for c, n, a in rows]
+
+def task_breakdown(db) -> dict:
+    rows = db.query(models.TaskRollup.status, models.TaskRollup.priority, models.TaskRollup.count).all()
+    by_status, by_priority = defaultdict(int), defaultdict(int)
+    for status, priority, count in rows:
+        by_status[status] += count
+        by_priority[priority] += count
+    return {"total": sum(by_status.values()), "by_status": dict(by_status), "by_priority": dict(by_priority)}
+
+# --- Rebuild ---------------------------------------------------------------
+
+def rebuild(db):
+    """Recompute both rollup tables from the base tables."""
+    E = models.Expense
+    day = func.coalesce(func.strftime("%Y-%m-%d", E.date), "")
+    month = func.coalesce(func.strftime("%Y-%m", E.date), "")
+    category = func.coalesce(E.category, "")
+    db.execute(delete(models.ExpenseRollup))
+    db.execute(delete(models.TaskRollup))
+    for grain, period in (("day", day), ("month", month)):
+        rows = db.execute(select(period, category, func.count(), func.coalesce(func.sum(E.amount), 0.0)).group_by(period, category)).all()
+        db.add_all(models.ExpenseRollup(grain=grain, period=p, category=c, count=n, amount=a) for p, c, n, a in rows)
+    status = func.coalesce(models.Task.status, "")
+    priority = func.coalesce(models.Task.priority, "")
+    rows = db.execute(select(status, priority, func.count()).group_by(status, priority)).all()
+    db.add_all(models.TaskRollup(status=s, priority=p, count=n) for s, p, n in rows)
+    db.commit()
+
+def in_sync(db) -> bool:
+    expenses = db.execute(select(func.count(), func.coalesce(func.sum(models.Expense.amount), 0.0))).one()
+    tasks = db.query(models.Task).count()
+    rolled = expense_totals(db)
+    return (expenses[0] == rolled["count"] and abs(expenses[1] - rolled["amount"]) < 0.005
+            and tasks == task_breakdown(db)["total"])
+
+def init(SessionLocal):
+    """Backfill rollups for rows written without the hooks (seed data, bulk edits)."""
+    db = SessionLocal()
+    try:
+        if not in_sync(db):
+            print("Rebuilding expense/task rollups...")
+            rebuild(db)
+    finally:
+        db.close()
+
+# --- Maintenance hooks -----------------------------------------------------
+
+def _stored_values(session, model, cols, objs) -> dict:
+    # Old values come from the DB: attribute history lacks them when an
+    # expired instance is modified without being loaded first
+    ids = [o.id for o in objs]
+    with session.no_autoflush:
+        rows = session.execute(select(model.id, *[getattr(model, c) for c in cols]).where(model.id.in_(ids))).all()
+    return {r[0]: dict(zip(cols, r[1:])) for r in rows}
+
+def _add_expense(delta, values, sign):
+    for key in _expense_keys(values["date"], values["category"]):
+        delta["expense"][key][0] += sign
+        delta["expense"][key][1] += sign * (values["amount"] or 0)
+
+def _add_task(delta, values, sign):
+    delta["task"][(values["status"] or "", values["priority"] or "")] += sign
+
+@event.listens_for(Session, "before_flush")
+def _before_flush(session, flush_context, instances):
+    delta = {"expense": defaultdict(lambda: [0, 0.0]), "task": defaultdict(int)}
+    for model, cols, add in ((models.Expense, EXPENSE_COLS, _add_expense), (models.Task, TASK_COLS, _add_task)):
+        for obj in session.new:
+            if isinstance(obj, model):
+                add(delta, _values(obj, cols), 1)
+        changed = [o for o in session.dirty if isinstance(o, model) and session.is_modified(o)]
+        removed = [o for o in session.deleted if isinstance(o, model)]
+        stored = _stored_values(session, model, cols, changed + removed) if changed or removed else {}
+        for obj in changed:
+            if obj.id in stored:
+                add(delta, stored[obj.id], -1)
+                add(delta, _values(obj, cols), 1)
+        for obj in removed:
+            if obj.id in stored:
+                add(delta, stored[obj.id], -1)
+    if delta["expense"] or delta["task"]:
+        session.info["rollup_delta"] = delta
+    else:
+        session.info.pop("rollup_delta", None)
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    delta = session.info.pop("rollup_delta", None)
+    if not delta:
+        return
+    conn = session.connection()
+    R, T = models.ExpenseRollup, models.TaskRollup
+    for (grain, period, category), (count, amount) in delta["expense"].items():
+        if not count and not amount:
+            continue
+        stmt = insert(R).values(grain=grain, period=period, category=category, count=count, amount=amount)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=["grain", "period", "category"],
+            set_={"count": R.count + stmt.excluded.count, "amount": R.amount + stmt.excluded.amount}))
+    for (status, priority), count in delta["task"].items():
+        if not count:
+            continue
+        stmt = insert(T).values(status=status, priority=priority, count=count)
+        conn.execute(stmt.on_conflict_do_update(index_elements=["status", "priority"], set_={"count": T.count + stmt.excluded.count}))
+    conn.execute(delete(R).where(R.count <= 0))
+    conn.execute(delete(T).where(T.count <= 0))
@@ -0,0 +1,144 @@
+import os
+import re
+import json
+import threading
+from cache_utils import connect_sqlite
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEXICAL_DB_PATH = os.getenv("LEXICAL_DB_PATH", "lexical_index.db")
+# bm25 column weights: (title, document)
+LEXICAL_TITLE_WEIGHT = 2.0
+LEXICAL_DOC_WEIGHT = 1.0
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from had has have how i in is it its me my of on or our please show
+tell that the their there this to was we were what when where which who whom why will with you your
+""".split())
+
+def fts_query(text: str) -> str | None:
+    """FTS5 MATCH expression for free text: every significant token OR'ed, plus a
+    phrase for each punctuated word so "555-0100" or "a.b@corp.com" also match
+    as a sequence (tokens are split on punctuation at index time too)."""
+    terms = []
+    for word in (text or "").lower().split():
+        parts = re.findall(r"\w+", word)
+        significant = [p for p in parts if p not in STOPWORDS and (len(p) > 1 or p.isdigit())]
+        if len(parts) > 1 and significant:
+            terms.append('"' + " ".join(parts) + '"')
+        terms.extend(f'"{p}"' for p in significant)
+    terms = list(dict.fromkeys(terms))
+    return " OR ".join(terms) if terms else None
+
+class LexicalIndex:
+    """SQLite FTS5 (BM25) index over the same chunks as the Chroma collection.
+
+    lexical_chunks holds chunk id, metadata and text; lexical_fts is an
+    external-content FTS5 table over its title and document columns, kept in
+    step by hand on every write.
+    """
+
+    def __init__(self, path: str = LEXICAL_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lexical_chunks (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT UNIQUE NOT NULL,
+                source_type TEXT,
+                title TEXT,
+                meta TEXT,
+                document TEXT
+            );
+            CREATE INDEX IF NOT EXISTS ix_lexical_chunks_source_type ON lexical_chunks (source_type);
+            CREATE VIRTUAL TABLE IF NOT EXISTS lexical_fts USING fts5(
+                title, document, content='lexical_chunks', content_rowid='rowid'
+            );
+        """)
+        self._conn.commit()
+        self.searches = 0
+
+    def _remove(self, chunk_ids):
+        for cid in chunk_ids:
+            row = self._conn.execute("SELECT rowid, title, document FROM lexical_chunks WHERE chunk_id = ?", (cid,)).fetchone()
+            if row:
+                self._conn.execute("INSERT INTO lexical_fts (lexical_fts, rowid, title, document) VALUES ('delete', ?, ?, ?)", row)
+                self._conn.execute("DELETE FROM lexical_chunks WHERE rowid = ?", (row[0],))
+
+    def upsert(self, ids: list[str], metadatas: list[dict], documents: list[str]):
+        with self._lock:
+            self._remove(ids)
+            for cid, meta, doc in zip(ids, metadatas, documents):
+                meta = meta or {}
+                # Another process (e.g. a second worker's backfill) may have written the
+                # chunk since _remove looked: keep its row, chunk ids are deterministic
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO lexical_chunks (chunk_id, source_type, title, meta, document) VALUES (?, ?, ?, ?, ?)",
+                    (cid, meta.get("source_type"), meta.get("title", ""), json.dumps(meta), doc))
+                if cur.rowcount:
+                    self._conn.execute("INSERT INTO lexical_fts (rowid, title, document) VALUES (?, ?, ?)",
+                                       (cur.lastrowid, meta.get("title", ""), doc))
+            self._conn.commit()
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict]):
+        with self._lock:
+            for cid, meta in zip(ids, metadatas):
+                meta = meta or {}
+                row = self._conn.execute("SELECT rowid, title, document FROM lexical_chunks WHERE chunk_id = ?", (cid,)).fetchone()
+                if not row:
+                    continue
+                title = meta.get("title", "")
+                if title != row[1]:
+                    # Title is indexed: swap the FTS entry as well
+                    self._conn.execute("INSERT INTO lexical_fts (lexical_fts, rowid, title, document) VALUES ('delete', ?, ?, ?)", row)
+                    self._conn.execute("INSERT INTO lexical_fts (rowid, title, document) VALUES (?, ?, ?)", (row[0], title, row[2]))
+                self._conn.execute("UPDATE lexical_chunks SET source_type = ?, title = ?, meta = ? WHERE rowid = ?",
+                                   (meta.get("source_type"), title, json.dumps(meta), row[0]))
+            self._conn.commit()
+
+    def delete(self, ids: list[str]):
+        with self._lock:
+            self._remove(ids)
+            self._conn.commit()
+
+    def search(self, query: str, n: int = 8, source_type: str = None) -> list[dict]:
+        """Top-n chunks by BM25. `score` is the negated bm25 value (higher is better)."""
+        expr = fts_query(query)
+        if not expr:
+            return []
+        sql = (f"SELECT c.chunk_id, c.meta, c.document, -bm25(lexical_fts, {LEXICAL_TITLE_WEIGHT}, {LEXICAL_DOC_WEIGHT}) AS score "
+               "FROM lexical_fts JOIN lexical_chunks c ON c.rowid = lexical_fts.rowid WHERE lexical_fts MATCH ?")
+        params = [expr]
+        if source_type:
+            sql += " AND c.source_type = ?"
+            params.append(source_type)
+        sql += " ORDER BY score DESC LIMIT ?"
+        params.append(n)
+        with self._lock:
+            self.searches += 1
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{"id": cid, "meta": json.loads(meta or "{}"), "document": doc, "score": score} for cid, meta, doc, score in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM lexical_chunks").fetchone()[0]
+
+    def backfill(self, collection, batch_size: int = 500) -> int:
+        """Copy every chunk of a Chroma collection into the index (used once, when
+        the index is created next to an already populated collection)."""
+        total = 0
+        offset = 0
+        while True:
+            res = collection.get(include=["metadatas", "documents"], limit=batch_size, offset=offset)
+            ids = res.get("ids", [])
+            if not ids:
+                break
+            self.upsert(ids, res.get("metadatas") or [{}] * len(ids), res.get("documents") or [""] * len(ids))
+            total += len(ids)
+            offset += len(ids)
+        return total
+
+    def stats(self) -> dict:
+        return {"chunks": self.count(), "searches": self.searches}
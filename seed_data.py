@@ -11,9 +11,10 @@ fake = Faker()
 db_path = "ai_secretary_app.db"
 # Since models.py uses a relative path in init_db that assumes cwd is where app runs,
 # and we run this script from root, it should be fine.
-# But let's delete the old db to ensure schema update if migration isn't a thing (we used create_all matching new schema).
+# Start from an empty DB so demo rows are not duplicated. Schema changes do not
+# need this: init_db applies pending migrations (migrations.py) in place.
 if os.path.exists(db_path):
-    print("Removing old DB to refresh schema...")
+    print("Removing old DB to reseed...")
     os.remove(db_path)
 
 SessionLocal = models.init_db(db_path)
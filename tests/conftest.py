@@ -0,0 +1,67 @@
+import os
+import sys
+import pytest
+
+# Tests import the app modules the way app.py does, from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+import email_utils
+import mail_pool_utils
+import fake_mail
+import fake_chroma
+import rag_utils
+from cache_utils import LRUCache, AnswerCache
+from search_utils import LexicalIndex
+
+def _fresh(pool):
+    return mail_pool_utils.MailPool(pool.kind, pool.opener, pool.pinger, pool.closer, pool.connection_errors,
+                                    ping_after=pool.ping_after, idle_seconds=pool.idle_seconds)
+
+@pytest.fixture
+def servers(tmp_path, monkeypatch):
+    imap, smtp, client_context = fake_mail.start(fake_mail.USERS, str(tmp_path))
+    monkeypatch.setattr(mail_pool_utils, "SSL_CONTEXT", client_context)
+    # Fresh pools, so sessions and counters do not carry over between tests
+    monkeypatch.setattr(mail_pool_utils, "imap_pool", _fresh(mail_pool_utils.imap_pool))
+    monkeypatch.setattr(mail_pool_utils, "smtp_pool", _fresh(mail_pool_utils.smtp_pool))
+    yield imap, smtp
+    mail_pool_utils.imap_pool.close_all()
+    mail_pool_utils.smtp_pool.close_all()
+    for server in (imap, smtp):
+        server.shutdown()
+        server.drop_all()
+        server.server_close()
+
+@pytest.fixture
+def session_factory(tmp_path):
+    return models.init_db(str(tmp_path / "mail.db"))
+
+@pytest.fixture
+def db(session_factory):
+    db = session_factory()
+    yield db
+    db.close()
+
+@pytest.fixture
+def account(db, servers, monkeypatch):
+    imap, smtp = servers
+    # Bodies are cached by (account id, UIDVALIDITY, UID), which repeat across tests
+    monkeypatch.setattr(email_utils, "body_cache", LRUCache(email_utils.MAIL_BODY_CACHE_SIZE))
+    account = models.EmailAccount(email="me@example.com", password="secret", imap_host="localhost",
+                                  imap_port=imap.port, smtp_host="localhost", smtp_port=smtp.port)
+    db.add(account)
+    db.commit()
+    imap.box.add("Quarterly numbers", "Revenue is up 12 percent.")
+    imap.box.add("Contract", "Signed copy attached.", attachment=b"\x00" * 64)
+    return account
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    """rag_utils wired to an in-memory collection, a lexical index and an answer cache in tmp_path."""
+    collection = fake_chroma.Collection()
+    monkeypatch.setattr(rag_utils, "memory_collection", collection)
+    monkeypatch.setattr(rag_utils, "embedding_function", collection.embedding_function)
+    monkeypatch.setattr(rag_utils, "lexical_index", LexicalIndex(str(tmp_path / "lexical.db")))
+    monkeypatch.setattr(rag_utils, "answer_cache", AnswerCache(str(tmp_path / "cache.db"), space="fake"))
+    return collection
@@ -0,0 +1,106 @@
+"""In-memory stand-in for a Chroma collection, for tests that run without chromadb.
+
+Collection implements the part of the Chroma collection API rag_utils uses:
+get (by ids or a where filter with "$and", with limit/offset), upsert, update,
+delete, query (cosine distance), count, name, metadata and modify. Documents
+are embedded with the collection's embedding function on upsert, and every
+embedded text is recorded in `embedded` so tests can check what was sent to
+the embedding API.
+"""
+import re
+import zlib
+import numpy as np
+
+DIM = 64
+
+class HashEmbedding:
+    """Deterministic bag-of-words vectors; counts the texts it embeds."""
+
+    def __init__(self):
+        self.calls = 0
+        self.texts = []
+
+    def __call__(self, input):
+        self.calls += 1
+        self.texts += list(input)
+        vectors = []
+        for text in input:
+            v = np.zeros(DIM, dtype=np.float32)
+            for word in re.findall(r"\w+", text.lower()):
+                v[zlib.crc32(word.encode()) % DIM] += 1.0
+            vectors.append((v / (np.linalg.norm(v) or 1.0)).tolist())
+        return vectors
+
+def _matches(meta, where):
+    if not where:
+        return True
+    if "$and" in where:
+        return all(_matches(meta, w) for w in where["$and"])
+    return all(meta.get(k) == v for k, v in where.items())
+
+class Collection:
+    def __init__(self, name="executive_memory_mistral", embedding_function=None, metadata=None):
+        self.name = name
+        self.metadata = metadata
+        self.embedding_function = embedding_function or HashEmbedding()
+        self.rows = {}  # id -> {"document", "metadata", "embedding"}
+        self.embedded = []
+
+    def _embed(self, documents):
+        self.embedded += list(documents)
+        return self.embedding_function(list(documents))
+
+    def count(self):
+        return len(self.rows)
+
+    def modify(self, metadata=None):
+        self.metadata = metadata
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=None):
+        keys = [i for i in (ids if ids is not None else self.rows) if i in self.rows]
+        keys = [i for i in keys if _matches(self.rows[i]["metadata"], where)]
+        keys = keys[offset or 0:][:limit] if limit is not None else keys[offset or 0:]
+        res = {"ids": keys}
+        if "metadatas" in include:
+            res["metadatas"] = [dict(self.rows[i]["metadata"]) for i in keys]
+        if "documents" in include:
+            res["documents"] = [self.rows[i]["document"] for i in keys]
+        return res
+
+    def upsert(self, ids, metadatas=None, documents=None):
+        vectors = self._embed(documents)
+        if len(vectors) != len(ids):
+            raise ValueError("embedding function returned no vectors")
+        for n, i in enumerate(ids):
+            self.rows[i] = {"document": documents[n], "metadata": dict((metadatas or [{}] * len(ids))[n]),
+                            "embedding": np.asarray(vectors[n], dtype=np.float32)}
+
+    def update(self, ids, metadatas=None, documents=None):
+        vectors = self._embed(documents) if documents is not None else None
+        for n, i in enumerate(ids):
+            if i not in self.rows:
+                continue
+            if metadatas is not None:
+                self.rows[i]["metadata"] = dict(metadatas[n])
+            if documents is not None:
+                self.rows[i]["document"] = documents[n]
+                self.rows[i]["embedding"] = np.asarray(vectors[n], dtype=np.float32)
+
+    def delete(self, ids=None, where=None):
+        for i in list(ids if ids is not None else self.rows):
+            if i in self.rows and _matches(self.rows[i]["metadata"], where):
+                del self.rows[i]
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=10, where=None):
+        if query_embeddings is None:
+            query_embeddings = self._embed(query_texts)
+        res = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for q in query_embeddings:
+            q = np.asarray(q, dtype=np.float32)
+            scored = sorted((1.0 - float(r["embedding"] @ q), i) for i, r in self.rows.items()
+                            if _matches(r["metadata"], where))[:n_results]
+            res["ids"].append([i for _, i in scored])
+            res["documents"].append([self.rows[i]["document"] for _, i in scored])
+            res["metadatas"].append([dict(self.rows[i]["metadata"]) for _, i in scored])
+            res["distances"].append([d for d, _ in scored])
+        return res
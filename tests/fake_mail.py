@@ -0,0 +1,366 @@
+"""Local fake IMAP and SMTP servers for the mail tests.
+
+Both servers speak just enough of the protocols for email_utils: IMAP over
+implicit TLS (LOGIN, SELECT/EXAMINE, STATUS, UID SEARCH, UID FETCH of headers,
+BODYSTRUCTURE and body sections, NOOP, IDLE) and SMTP with STARTTLS and AUTH
+PLAIN. TLS uses a throwaway self-signed certificate for "localhost" that the
+client context returned by start() trusts, so the real TLS code paths run.
+"""
+import base64
+import datetime
+import email
+import ipaddress
+import os
+import re
+import select
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+
+# Logins the conftest.py fixtures start the servers with
+USERS = {"me@example.com": "secret", "two@example.com": "secret", "three@example.com": "secret"}
+
+class MailBox:
+    """INBOX shared by every fake IMAP connection."""
+
+    def __init__(self):
+        self.uidvalidity = 1000
+        self.next_uid = 1
+        self.messages = []  # {"uid", "raw", "flags"}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def add(self, subject, body, sender="alice@example.com", attachment=None):
+        msg = EmailMessage()
+        msg["From"] = sender
+        msg["To"] = "me@example.com"
+        msg["Subject"] = subject
+        msg["Date"] = email.utils.format_datetime(datetime.datetime.now(datetime.timezone.utc))
+        msg["Message-ID"] = email.utils.make_msgid(domain="example.com")
+        msg.set_content(body)
+        if attachment:
+            msg.add_attachment(attachment, maintype="application", subtype="octet-stream", filename="attachment.bin")
+        with self.changed:
+            self.messages.append({"uid": self.next_uid, "raw": msg.as_bytes(), "flags": []})
+            self.next_uid += 1
+            self.changed.notify_all()
+
+def _uid_set(spec, max_uid):
+    uids = set()
+    for part in spec.split(","):
+        lo, _, hi = part.partition(":")
+        lo = max_uid if lo == "*" else int(lo)
+        hi = lo if not hi else (max_uid if hi == "*" else int(hi))
+        uids.update(range(min(lo, hi), max(lo, hi) + 1))
+    return uids
+
+def _quote(value):
+    return "NIL" if value is None else '"' + str(value).replace('"', '\\"') + '"'
+
+def _bodystructure(part):
+    if part.is_multipart():
+        children = "".join(_bodystructure(p) for p in part.get_payload())
+        return f"({children} {_quote(part.get_content_subtype().upper())} NIL NIL NIL NIL)"
+    payload = part.get_payload().encode()
+    charset = part.get_content_charset()
+    params = f'("CHARSET" {_quote(charset)})' if charset else "NIL"
+    encoding = (part.get("Content-Transfer-Encoding") or "7bit").upper()
+    filename = part.get_filename()
+    disposition = f'("ATTACHMENT" ("FILENAME" {_quote(filename)}))' if filename else "NIL"
+    fields = f"{_quote(part.get_content_maintype().upper())} {_quote(part.get_content_subtype().upper())} {params} NIL NIL {_quote(encoding)} {len(payload)}"
+    if part.get_content_maintype() == "text":
+        fields += " " + str(payload.count(b"\n"))
+    return f"({fields} NIL {disposition} NIL NIL)"
+
+def _section(msg, spec):
+    part = msg
+    for n in spec.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(n) - 1]
+    return part.get_payload().encode()
+
+class _TLSServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handler, context, implicit_tls):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.context = context
+        self.implicit_tls = implicit_tls
+        self.lock = threading.Lock()
+        self.sockets = set()
+        self.log = []  # (connection number, command)
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        if self.implicit_tls:
+            sock = self.context.wrap_socket(sock, server_side=True)
+        return sock, addr
+
+    def drop_all(self):
+        """Close every open connection without a goodbye, like a provider timing out sessions."""
+        with self.lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+            sock.close()
+
+    def count(self, command):
+        with self.lock:
+            return sum(1 for _, c in self.log if c == command)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+            self.number = self.server.connections
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+            self.server.sockets.add(self.request)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.active -= 1
+            self.server.sockets.discard(self.request)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode())
+        self.wfile.flush()
+
+    def record(self, command):
+        with self.server.lock:
+            self.server.log.append((self.number, command))
+
+    def readline(self):
+        try:
+            return self.rfile.readline()
+        except (OSError, ValueError):
+            return b""
+
+class FakeIMAPHandler(_Handler):
+    def handle(self):
+        box = self.server.box
+        self.exists = 0  # message count this connection was last told
+        self.send("* OK fake IMAP ready\r\n")
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                sub, _, args = args.partition(" ")
+                command = "UID " + sub.upper()
+            self.record(command)
+            time.sleep(self.server.delays.get(command, 0))
+            if command == "CAPABILITY":
+                self.send(f"* CAPABILITY IMAP4rev1 IDLE AUTH=PLAIN\r\n{tag} OK done\r\n")
+            elif command == "LOGIN":
+                user, password = [a.strip('"') for a in args.split(" ", 1)]
+                if self.server.users.get(user) == password:
+                    self.send(f"{tag} OK logged in\r\n")
+                else:
+                    self.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials\r\n")
+            elif command == "NOOP":
+                self.send(f"{tag} OK noop\r\n")
+            elif command == "LOGOUT":
+                self.send(f"* BYE logging out\r\n{tag} OK bye\r\n")
+                return
+            elif command in ("SELECT", "EXAMINE"):
+                with box.lock:
+                    self.exists = len(box.messages)
+                    self.send(f"* {len(box.messages)} EXISTS\r\n* OK [UIDVALIDITY {box.uidvalidity}] ok\r\n"
+                              f"* OK [UIDNEXT {box.next_uid}] ok\r\n{tag} OK [READ-ONLY] selected\r\n")
+            elif command == "STATUS":
+                with box.lock:
+                    unseen = sum(1 for m in box.messages if "\\Seen" not in m["flags"])
+                    self.send(f"* STATUS INBOX (MESSAGES {len(box.messages)} UNSEEN {unseen})\r\n{tag} OK done\r\n")
+            elif command == "UID SEARCH":
+                with box.lock:
+                    max_uid = box.messages[-1]["uid"] if box.messages else 0
+                    spec = re.search(r"UID (\S+)", args)
+                    wanted = _uid_set(spec.group(1), max_uid) if spec else None
+                    found = [str(m["uid"]) for m in box.messages if wanted is None or m["uid"] in wanted]
+                self.send(f"* SEARCH {' '.join(found)}\r\n{tag} OK done\r\n".replace("SEARCH \r", "SEARCH\r"))
+            elif command == "UID FETCH":
+                self.fetch(tag, args)
+            elif command == "IDLE":
+                self.idle(tag)
+            else:
+                self.send(f"{tag} BAD unknown command\r\n")
+
+    def fetch(self, tag, args):
+        box = self.server.box
+        spec, _, items = args.partition(" ")
+        with box.lock:
+            max_uid = box.messages[-1]["uid"] if box.messages else 0
+            wanted = _uid_set(spec, max_uid)
+            selected = [(seq, m) for seq, m in enumerate(box.messages, 1) if m["uid"] in wanted]
+        for seq, m in selected:
+            msg = email.message_from_bytes(m["raw"])
+            fields = [f"UID {m['uid']}", f"FLAGS ({' '.join(m['flags'])})",
+                      f'INTERNALDATE "{time.strftime("%d-%b-%Y %H:%M:%S +0000", time.gmtime())}"',
+                      f"RFC822.SIZE {len(m['raw'])}"]
+            if "BODYSTRUCTURE" in items:
+                fields.append("BODYSTRUCTURE " + _bodystructure(msg))
+            literal = None
+            if "BODY.PEEK[]" in items:
+                literal = ("BODY[]", m["raw"])
+            elif "HEADER.FIELDS" in items:
+                header = m["raw"].split(b"\n\n", 1)[0].replace(b"\r\n", b"\n").replace(b"\n", b"\r\n") + b"\r\n\r\n"
+                literal = ("BODY[HEADER.FIELDS (SUBJECT FROM DATE MESSAGE-ID)]", header)
+            else:
+                section = re.search(r"BODY\.PEEK\[([\d.]+)\]", items)
+                if section:
+                    literal = (f"BODY[{section.group(1)}]", _section(msg, section.group(1)))
+            head = f"* {seq} FETCH (" + " ".join(fields)
+            if literal:
+                self.send(f"{head} {literal[0]} {{{len(literal[1])}}}\r\n".encode() + literal[1] + b")\r\n")
+            else:
+                self.send(head + ")\r\n")
+        self.send(f"{tag} OK fetched\r\n")
+
+    def idle(self, tag):
+        box = self.server.box
+        self.send("+ idling\r\n")
+        # Mail that arrived since the client last heard the count is reported right away
+        seen = self.exists
+        while True:
+            with box.changed:
+                if len(box.messages) == seen:
+                    box.changed.wait(0.05)
+                if len(box.messages) != seen:
+                    seen = self.exists = len(box.messages)
+                    self.send(f"* {seen} EXISTS\r\n")
+            try:
+                ready, _, _ = select.select([self.request], [], [], 0)
+            except (OSError, ValueError):
+                return
+            if ready or self.request.pending():
+                line = self.readline()
+                if not line:
+                    return
+                if line.strip().upper() == b"DONE":
+                    self.send(f"{tag} OK idle done\r\n")
+                    return
+
+class FakeSMTPHandler(_Handler):
+    def handle(self):
+        self.send("220 fake SMTP ready\r\n")
+        user = None
+        sender, recipients = None, []
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            text = line.decode().rstrip("\r\n")
+            command = text.split(" ", 1)[0].upper()
+            self.record(command)
+            if command in ("EHLO", "HELO"):
+                tls = isinstance(self.request, ssl.SSLSocket)
+                self.send("250-fake\r\n" + ("" if tls else "250-STARTTLS\r\n") + "250 AUTH PLAIN\r\n")
+            elif command == "STARTTLS":
+                self.send("220 go ahead\r\n")
+                self.request = self.server.context.wrap_socket(self.request, server_side=True)
+                with self.server.lock:
+                    self.server.sockets.add(self.request)
+                self.rfile = self.request.makefile("rb")
+                self.wfile = self.request.makefile("wb")
+            elif command == "AUTH":
+                _, _, initial = text.split(" ", 2)
+                _, login, password = base64.b64decode(initial).decode().split("\0")
+                if self.server.users.get(login) == password:
+                    user = login
+                    self.send("235 authenticated\r\n")
+                else:
+                    self.send("535 invalid credentials\r\n")
+            elif command == "MAIL":
+                if not user:
+                    self.send("530 authentication required\r\n")
+                    continue
+                sender, recipients = re.search(r"<(.*?)>", text).group(1), []
+                self.send("250 ok\r\n")
+            elif command == "RCPT":
+                recipients.append(re.search(r"<(.*?)>", text).group(1))
+                self.send("250 ok\r\n")
+            elif command == "DATA":
+                self.send("354 end with .\r\n")
+                lines = []
+                while True:
+                    data = self.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data)
+                with self.server.lock:
+                    self.server.delivered.append({"from": sender, "to": recipients, "data": b"".join(lines)})
+                self.send("250 queued\r\n")
+            elif command in ("NOOP", "RSET"):
+                self.send("250 ok\r\n")
+            elif command == "QUIT":
+                self.send("221 bye\r\n")
+                return
+            else:
+                self.send("502 not implemented\r\n")
+
+def make_certificate(directory):
+    """Self-signed certificate for localhost/127.0.0.1; returns (cert path, key path)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5)).not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"),
+                                                        x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256()))
+    cert_path = os.path.join(directory, "fake_mail_cert.pem")
+    key_path = os.path.join(directory, "fake_mail_key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+def start(users: dict, directory: str = None):
+    """Start both servers in daemon threads. Returns (imap server, smtp server, client
+    SSL context that trusts their certificate). users maps login -> password."""
+    directory = directory or tempfile.mkdtemp(prefix="fake_mail_")
+    cert_path, key_path = make_certificate(directory)
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(cert_path, key_path)
+    client_context = ssl.create_default_context(cafile=cert_path)
+
+    imap = _TLSServer(FakeIMAPHandler, server_context, implicit_tls=True)
+    imap.box = MailBox()
+    imap.delays = {}  # command -> seconds to stall before answering
+    smtp = _TLSServer(FakeSMTPHandler, server_context, implicit_tls=False)
+    smtp.delivered = []
+    for server in (imap, smtp):
+        server.users = users
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    return imap, smtp, client_context
@@ -0,0 +1,18 @@
+import argparse
+import bench_sqlite
+
+def test_short_run_reports_each_profile():
+    args = argparse.Namespace(workers=2, readers=2, writers=1, seconds=0.5, rows=200)
+    for name in ("legacy", "tuned"):
+        r = bench_sqlite.run_profile(name, args)
+        assert r["profile"] == name
+        assert r["reads_per_s"] > 0 and r["writes_per_s"] > 0
+        assert 0 < r["read_p50_ms"] <= r["read_p99_ms"]
+        assert r["other_errors"] == 0
+    # The point of the tuned profile: writers wait for the lock instead of failing
+    assert r["locked_errors"] == 0
+
+def test_percentiles():
+    assert bench_sqlite._pct([], 0.5) == 0.0
+    assert bench_sqlite._pct([0.003, 0.001, 0.002], 0.5) == 2.0
+    assert bench_sqlite._pct([0.001, 0.002], 0.99) == 2.0
@@ -0,0 +1,38 @@
+import cache_utils
+from cache_utils import EmbeddingCache
+
+def test_embedding_cache_round_trip(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=10)
+    cache.put_many("m", ["a", "b"], [[1.0, 2.0], [3.0, 4.0]])
+    assert cache.get_many("m", ["b", "x", "a"]) == {0: [3.0, 4.0], 2: [1.0, 2.0]}
+    # Other models do not share entries
+    assert cache.get_many("other", ["a"]) == {}
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 2, 2)
+
+def test_embedding_cache_replaces_existing_keys(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=10)
+    cache.put_many("m", ["a"], [[1.0]])
+    cache.put_many("m", ["a", "a", "b"], [[2.0], [2.0], [3.0]])
+    assert cache._count == 2
+    assert cache.get_many("m", ["a"]) == {0: [2.0]}
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=3)
+    for i, text in enumerate("abc"):
+        cache.put_many("m", [text], [[float(i)]])
+    cache.get_many("m", ["a"])  # "b" is now the least recently used
+    cache.put_many("m", ["d"], [[3.0]])
+    assert cache.stats()["entries"] == 3
+    assert cache.evictions == 1
+    assert set(cache.get_many("m", list("abcd"))) == {0, 2, 3}
+
+def test_embedding_cache_recounts_rows_from_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_utils, "EMBED_CACHE_RECOUNT_EVERY", 2)
+    path = str(tmp_path / "cache.db")
+    mine, other = EmbeddingCache(path, max_entries=4), EmbeddingCache(path, max_entries=4)
+    other.put_many("m", list("abcd"), [[0.0]] * 4)
+    mine.put_many("m", ["e"], [[1.0]])
+    assert mine.stats()["entries"] == 5  # not noticed yet
+    mine.put_many("m", ["f"], [[1.0]])
+    assert mine.stats()["entries"] == 4
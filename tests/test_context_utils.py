@@ -0,0 +1,47 @@
+import context_utils
+
+def words(tag, n):
+    return " ".join(f"{tag}{i}" for i in range(n))
+
+def test_trim_to_tokens():
+    text = "First sentence here. " + words("w", 100)
+    assert context_utils.trim_to_tokens("short text", 10) == "short text"
+    cut = context_utils.trim_to_tokens(text, 40)
+    assert cut.endswith(" …") and cut.startswith("First sentence here. w0")
+    assert context_utils.count_tokens(cut) <= 40
+
+def test_trim_to_tokens_prefers_sentence_boundary():
+    text = words("a", 30) + ". " + words("b", 30)
+    assert context_utils.trim_to_tokens(text, 45) == words("a", 30) + ". …"
+
+def test_build_context_keeps_ranked_order():
+    # MMR order A, B, A2; A2 scores above B but B was picked for diversity
+    passages = [{"text": words("a", 50), "score": 0.9, "label": "A"},
+                {"text": words("b", 50), "score": 0.5, "label": "B"},
+                {"text": words("c", 50), "score": 0.85, "label": "A2"}]
+    by_score = context_utils.build_context("ask", passages, budget=130)
+    assert "(A)" in by_score and "(A2)" in by_score and "(B)" not in by_score
+    ranked = context_utils.build_context("ask", passages, budget=130, ranked=True)
+    assert ranked.index("(A)") < ranked.index("(B)") and "(A2)" not in ranked
+
+def test_build_context_trims_or_skips_what_does_not_fit():
+    passages = [{"text": words("a", 50), "score": 1.0}, {"text": words("b", 200), "score": 0.5}]
+    ctx = context_utils.build_context("ask", passages, budget=200)
+    assert ctx.startswith("--- Result 1 () ---\na0") and "--- Result 2 () ---\nb0" in ctx and ctx.endswith(" …")
+    assert context_utils.count_tokens(ctx) <= 200
+    # Reserved prompt parts come off the budget first
+    assert context_utils.build_context("ask", passages, reserved=[words("r", 100)], budget=200).count("Result") == 1
+
+def test_build_context_keep_order():
+    passages = [{"text": "opening", "score": 0.1}, {"text": "middle", "score": 0.9}, {"text": "end", "score": 0.5}]
+    assert context_utils.build_context("document_summary", passages, fmt="{text}", joiner=" | ",
+                                       keep_order=True, budget=100) == "opening | middle | end"
+
+def test_enforce_keeps_the_closing_instruction(monkeypatch):
+    monkeypatch.setenv("LLM_BUDGET_TEST", "120,50")
+    content = f"Based on the following context, please answer the question: why?\n\nContext:\n{words('c', 300)}\n\nAnswer:"
+    messages, max_tokens = context_utils.enforce("test", [{"role": "user", "content": content}], 500)
+    trimmed = messages[0]["content"]
+    assert trimmed.startswith("Based on the following context") and trimmed.endswith(" …\n\nAnswer:")
+    assert context_utils.count_message_tokens(messages) <= 120
+    assert max_tokens == 50
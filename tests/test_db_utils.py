@@ -0,0 +1,58 @@
+import pytest
+from flask import Flask
+import models
+import db_utils
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_utils, "QUERY_PROFILER", True)
+    monkeypatch.setattr(db_utils, "QUERY_PROFILER_MAX_QUERIES", 3)
+    monkeypatch.setattr(db_utils, "_route_stats", {})
+    SessionLocal = models.init_db(str(tmp_path / "app.db"))
+    app = Flask(__name__)
+    db_utils.init_app(app, SessionLocal)
+
+    @app.route("/tasks/<int:n>")
+    def tasks(n):
+        db = db_utils.get_db()
+        assert db is db_utils.get_db()
+        for _ in range(n):
+            db.query(models.Task).count()
+        return "ok"
+
+    @app.route("/add")
+    def add():
+        db = db_utils.get_db()
+        db.add(models.Task(title="left pending"))
+        db.flush()
+        raise RuntimeError("boom")
+
+    @app.route("/static-page")
+    def static_page():
+        return "no queries"
+
+    app.config["PROPAGATE_EXCEPTIONS"] = False
+    with app.test_client() as client:
+        client.SessionLocal = SessionLocal
+        yield client
+
+def test_query_count_header(client):
+    assert client.get("/tasks/2").headers["X-Query-Count"] == "2"
+    assert "X-Query-Count" not in client.get("/static-page").headers
+
+def test_routes_over_the_limit_are_flagged(client):
+    client.get("/tasks/2")
+    client.get("/tasks/5")
+    route = db_utils.profiler_stats()["routes"]["GET /tasks/<int:n>"]
+    assert (route["requests"], route["queries"], route["max_queries"], route["flagged"], route["avg_queries"]) == (2, 7, 5, 1, 3.5)
+    assert db_utils.profiler_stats()["max_queries"] == 3
+
+def test_failed_request_is_rolled_back(client):
+    assert client.get("/add").status_code == 500
+    db = client.SessionLocal()
+    assert db.query(models.Task).count() == 0
+    db.close()
+
+def test_stats_are_off_without_the_profiler(monkeypatch):
+    monkeypatch.setattr(db_utils, "QUERY_PROFILER", False)
+    assert db_utils.profiler_stats() is None
@@ -0,0 +1,81 @@
+import pytest
+import models
+import doc_pipeline
+import rag_utils
+
+@pytest.fixture
+def SessionLocal(tmp_path, monkeypatch):
+    SessionLocal = models.init_db(str(tmp_path / "app.db"))
+    monkeypatch.setattr(doc_pipeline, "_SessionLocal", SessionLocal)
+    monkeypatch.setattr(doc_pipeline, "DOC_EMBED_BATCH_CHUNKS", 2)
+    return SessionLocal
+
+@pytest.fixture
+def writes_left(memory, monkeypatch):
+    """Collection writes allowed before the embed API "goes down" (None: no limit)."""
+    left = [None]
+    upsert = memory.upsert
+
+    def flaky_upsert(**kwargs):
+        if left[0] is not None:
+            if left[0] == 0:
+                raise RuntimeError("embed API down")
+            left[0] -= 1
+        upsert(**kwargs)
+
+    monkeypatch.setattr(memory, "upsert", flaky_upsert)
+    return left
+
+def _chunk_indexes(memory):
+    return sorted(m["chunk_index"] for m in memory.get(include=["metadatas"])["metadatas"])
+
+def _run(SessionLocal, path):
+    db = SessionLocal()
+    job = models.DocumentJob(filename="notes.txt", path=str(path), source_type="document", summarize=False)
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    doc_pipeline.run_job(job_id)
+    db = SessionLocal()
+    try:
+        job = db.get(models.DocumentJob, job_id)
+        return job.status, job.chunks_indexed
+    finally:
+        db.close()
+
+def test_partly_indexed_file_is_completed_on_retry(SessionLocal, memory, writes_left, tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("\n\n".join(f"Paragraph {i}. " + "word " * 150 for i in range(12)))
+    writes_left[0] = 1  # first batch lands, the rest fail
+    status, _ = _run(SessionLocal, path)
+    assert status == "failed" and _chunk_indexes(memory) == [0, 1]
+
+    writes_left[0] = None
+    status, indexed = _run(SessionLocal, path)
+    assert status == "done"
+    # The retry completed the same chunk positions instead of skipping the file
+    assert indexed == memory.count() > 2
+    assert _chunk_indexes(memory) == list(range(indexed))
+    # and did not embed the first batch a second time
+    assert len(memory.embedded) == indexed
+
+def test_reupload_of_edited_file_replaces_old_chunks(SessionLocal, memory, tmp_path):
+    path = tmp_path / "notes.txt"
+    paragraphs = [f"Paragraph {i}. " + "word " * 150 for i in range(12)]
+    path.write_text("\n\n".join(paragraphs))
+    _run(SessionLocal, path)
+    before = set(memory.get(include=[])["ids"])
+    embedded = len(memory.embedded)
+
+    # Same upload name, last paragraphs edited and the file shorter
+    edited = "\n\n".join(paragraphs[:9] + ["Paragraph 9. The figures were revised downwards."])
+    path.write_text(edited)
+    status, indexed = _run(SessionLocal, path)
+    chunks = [c for _, c in rag_utils.iter_page_chunks([(1, edited)])]
+    expected = {rag_utils.chunk_id("document", "notes.txt", f"{i}:{c}") for i, c in enumerate(chunks)}
+    assert status == "done" and indexed == len(chunks)
+    assert set(memory.get(include=[])["ids"]) == expected
+    # Only the chunks that changed were embedded again
+    assert sorted(memory.embedded[embedded:]) == sorted(memory.get(ids=sorted(expected - before))["documents"])
+    assert expected & before
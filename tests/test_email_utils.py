@@ -0,0 +1,63 @@
+import pytest
+import email_utils
+
+def test_uid_ranges():
+    assert list(email_utils.uid_ranges([])) == []
+    assert list(email_utils.uid_ranges([7])) == ["7"]
+    assert list(email_utils.uid_ranges([153, 101, 102, 103, 105, 106])) == ["101:103,105:106,153"]
+
+def test_uid_ranges_batches():
+    uids = list(range(1, 11)) + [20, 22]
+    assert list(email_utils.uid_ranges(uids, batch_size=5)) == ["1:5", "6:10", "20,22"]
+    # Every UID lands in exactly one batch
+    sets = list(email_utils.uid_ranges(range(1, 2000, 3), batch_size=50))
+    assert len(sets) == 14
+    assert all(s.count(",") == 49 for s in sets[:-1])
+
+PLAIN = b'("TEXT" "PLAIN" ("CHARSET" "ISO-8859-1") NIL NIL "QUOTED-PRINTABLE" 120 4 NIL NIL NIL)'
+MIXED = (b'((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL)'
+         b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 100 2 NIL NIL NIL) "ALTERNATIVE" ("BOUNDARY" "b1") NIL NIL)'
+         b'("APPLICATION" "PDF" ("NAME" "q3.pdf") NIL NIL "BASE64" 5000 NIL ("ATTACHMENT" ("FILENAME" "q3.pdf")) NIL)'
+         b' "MIXED" ("BOUNDARY" "b0") NIL NIL)')
+
+def test_parse_list():
+    data = b'* 1 FETCH (UID 9 BODYSTRUCTURE ("a" NIL (1 "b \\"c\\"") "d\\\\e") FLAGS ())'
+    start = data.index(b"(", data.index(b"BODYSTRUCTURE"))
+    parsed, end = email_utils._parse_list(data, start)
+    assert parsed == ["a", None, ["1", 'b "c"'], "d\\e"]
+    assert data[end:] == b" FLAGS ())"
+
+def test_parse_list_non_ascii_atom():
+    parsed, _ = email_utils._parse_list("(café x)".encode())
+    assert parsed == ["café", "x"]
+
+@pytest.mark.parametrize("data", [b'("a" (b)', b'("a'])
+def test_parse_list_unterminated(data):
+    with pytest.raises(ValueError):
+        email_utils._parse_list(data)
+
+def test_body_parts_single_part():
+    structure, _ = email_utils._parse_list(PLAIN)
+    assert email_utils.body_parts(structure) == {"body_section": "1", "body_subtype": "plain",
+                                                 "body_encoding": "quoted-printable",
+                                                 "body_charset": "ISO-8859-1", "attachments": 0}
+
+def test_body_parts_prefers_plain_in_nested_alternative():
+    structure, _ = email_utils._parse_list(MIXED)
+    parts = email_utils.body_parts(structure)
+    assert (parts["body_section"], parts["body_subtype"], parts["body_encoding"]) == ("1.1", "plain", "7bit")
+    assert parts["attachments"] == 1
+
+def test_body_parts_html_only_and_text_attachment():
+    data = (b'(("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "BASE64" 100 2 NIL NIL NIL)'
+            b'("TEXT" "PLAIN" ("NAME" "notes.txt") NIL NIL "7BIT" 40 2 NIL ("ATTACHMENT" ("FILENAME" "notes.txt")) NIL)'
+            b' "MIXED" ("BOUNDARY" "b0") NIL NIL)')
+    structure, _ = email_utils._parse_list(data)
+    parts = email_utils.body_parts(structure)
+    assert (parts["body_section"], parts["body_subtype"], parts["body_encoding"]) == ("1", "html", "base64")
+    assert parts["attachments"] == 1
+
+def test_body_parts_without_text():
+    structure, _ = email_utils._parse_list(b'("IMAGE" "PNG" NIL NIL NIL "BASE64" 300 NIL NIL NIL)')
+    assert email_utils.body_parts(structure) == {"body_section": None, "body_subtype": None, "body_encoding": None,
+                                                 "body_charset": None, "attachments": 1}
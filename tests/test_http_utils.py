@@ -0,0 +1,56 @@
+import http.server
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import http_utils
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+def test_connection_count_under_concurrency(server_url, monkeypatch):
+    monkeypatch.setattr(http_utils, "_session", None)
+    monkeypatch.setattr(http_utils, "_stats", {})
+    monkeypatch.setattr(http_utils, "_connections_opened", 0)
+    with ThreadPoolExecutor(4) as ex:
+        list(ex.map(lambda _: http_utils.post_json("chat", server_url, {}), range(40)))
+    stats = http_utils.get_stats()
+    assert stats["calls"] == 40
+    assert stats["endpoints"]["chat"]["errors"] == 0
+    # At most one socket per concurrent caller; everything else reused a pooled one
+    assert 1 <= stats["connections_opened"] <= 4
+    chat = stats["endpoints"]["chat"]
+    assert chat["connections"] == stats["connections_opened"]
+    assert chat["pool_hits"] == stats["pool_hits"] == 40 - chat["connections"]
+
+def test_pool_hits_per_endpoint(server_url, monkeypatch):
+    monkeypatch.setattr(http_utils, "_session", None)
+    monkeypatch.setattr(http_utils, "_stats", {})
+    monkeypatch.setattr(http_utils, "_connections_opened", 0)
+    for _ in range(3):
+        http_utils.post_json("embed", server_url, {})
+    for _ in range(2):
+        http_utils.post_json("chat", server_url, {})
+    stats = http_utils.get_stats()
+    # One connection, opened by the first embed call, serves every later call
+    assert stats["connections_opened"] == 1
+    assert (stats["endpoints"]["embed"]["connections"], stats["endpoints"]["embed"]["pool_hits"]) == (1, 2)
+    assert (stats["endpoints"]["chat"]["connections"], stats["endpoints"]["chat"]["pool_hits"]) == (0, 2)
+    assert stats["pool_hits"] == 4
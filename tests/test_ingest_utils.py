@@ -0,0 +1,56 @@
+import pytest
+import models
+import ingest_utils
+import rag_utils
+
+@pytest.fixture
+def SessionLocal(tmp_path):
+    return models.init_db(str(tmp_path / "app.db"))
+
+def _enqueue(SessionLocal, n=2):
+    db = SessionLocal()
+    for i in range(n):
+        ingest_utils.enqueue(db, "task", f"task {i}", f"text {i}", source_id=i)
+    db.commit()
+    db.close()
+
+def _jobs(SessionLocal):
+    db = SessionLocal()
+    try:
+        return [(j.status, j.attempts) for j in db.query(models.IndexJob).order_by(models.IndexJob.id)]
+    finally:
+        db.close()
+
+def test_batch_that_raises_counts_an_attempt(SessionLocal, monkeypatch):
+    def boom(entries):
+        raise RuntimeError("collection unavailable")
+    monkeypatch.setattr(rag_utils, "index_batch_into_memory", boom)
+    _enqueue(SessionLocal)
+    assert ingest_utils.process_batch(SessionLocal) == 2
+    assert _jobs(SessionLocal) == [("pending", 1), ("pending", 1)]
+
+def test_batch_that_always_raises_ends_failed(SessionLocal, monkeypatch):
+    monkeypatch.setattr(rag_utils, "index_batch_into_memory", lambda entries: 1 / 0)
+    _enqueue(SessionLocal, n=1)
+    for _ in range(ingest_utils.INGEST_MAX_ATTEMPTS):
+        ingest_utils.process_batch(SessionLocal)
+    assert _jobs(SessionLocal) == [("failed", ingest_utils.INGEST_MAX_ATTEMPTS)]
+    # Nothing left to claim
+    assert ingest_utils.process_batch(SessionLocal) == 0
+
+def test_batch_results_mark_jobs(SessionLocal, monkeypatch):
+    monkeypatch.setattr(rag_utils, "index_batch_into_memory",
+                        lambda entries: ["✅ Indexed 1 new chunks", "❌ Indexing failed: boom"])
+    _enqueue(SessionLocal)
+    ingest_utils.process_batch(SessionLocal)
+    assert _jobs(SessionLocal) == [("done", 0), ("pending", 1)]
+
+def test_batch_lands_in_memory(SessionLocal, memory):
+    _enqueue(SessionLocal)
+    ingest_utils.process_batch(SessionLocal)
+    assert _jobs(SessionLocal) == [("done", 0), ("done", 0)]
+    assert sorted(m["source_id"] for m in memory.get(include=["metadatas"])["metadatas"]) == ["0", "1"]
+    # Queueing the same rows again finds them up to date: nothing is embedded twice
+    _enqueue(SessionLocal)
+    ingest_utils.process_batch(SessionLocal)
+    assert memory.embedded == ["text 0", "text 1"]
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import pytest
+import models
+import email_utils
+import mail_pool_utils
+import mail_listener_utils as listener
+
+@pytest.fixture
+def listener_state(session_factory, monkeypatch):
+    monkeypatch.setattr(listener, "_SessionLocal", session_factory)
+    monkeypatch.setattr(listener, "_failures", {})
+    monkeypatch.setattr(listener, "_stats", Counter())
+    monkeypatch.setattr(listener, "MAIL_INDEX_MAX_PENDING", 3)
+
+def _email_jobs(db):
+    return db.query(models.IndexJob).filter(models.IndexJob.source_type == "email").order_by(models.IndexJob.id).all()
+
+def _finish(db, jobs):
+    for job in jobs:
+        job.status = "done"
+    db.commit()
+
+def _wait(condition, seconds=10):
+    deadline = time.time() + seconds
+    while time.time() < deadline and not condition():
+        time.sleep(0.05)
+    return condition()
+
+def test_index_round_holds_to_pending_cap(db, servers, account, listener_state):
+    imap, _ = servers
+    for i in range(3):
+        imap.box.add(f"Update {i}", f"Update number {i}.")
+    assert email_utils.sync_mailbox(db, account)["new"] == 5
+    assert listener.index_round(db) == 3
+    assert listener.index_round(db) == 0 and listener.get_stats()["throttled"] == 1
+    _finish(db, _email_jobs(db))
+    assert listener.index_round(db) == 2
+    jobs = _email_jobs(db)
+    assert len(jobs) == 5 and any("Revenue is up" in j.full_text for j in jobs)
+    assert db.query(models.MailMessage).filter(models.MailMessage.indexed_at.is_(None)).count() == 0
+
+def test_failed_enqueue_leaves_message_unclaimed(db, servers, account, listener_state, monkeypatch):
+    email_utils.sync_mailbox(db, account)
+    enqueue = listener.ingest_utils.enqueue
+    def broken(*args, **kwargs):
+        raise RuntimeError("queue unavailable")
+    monkeypatch.setattr(listener.ingest_utils, "enqueue", broken)
+    with pytest.raises(RuntimeError):
+        listener.index_round(db)
+    db.rollback()  # as _indexer_loop does
+    unclaimed = db.query(models.MailMessage).filter(models.MailMessage.indexed_at.is_(None))
+    assert unclaimed.count() == 2 and _email_jobs(db) == []
+    monkeypatch.setattr(listener.ingest_utils, "enqueue", enqueue)
+    assert listener.index_round(db) == 2 and unclaimed.count() == 0
+
+def test_resync_keeps_memory_keys(db, servers, account, listener_state):
+    # A new UIDVALIDITY rebuilds the INBOX, so row ids no longer name the same
+    # message; the re-indexed message must replace its own chunks
+    imap, _ = servers
+    email_utils.sync_mailbox(db, account)
+    listener.index_round(db)
+    keys = {j.title: json.loads(j.extra_meta)["source_id"] for j in _email_jobs(db)}
+    _finish(db, _email_jobs(db))
+    with imap.box.lock:
+        imap.box.messages.pop(0)
+        imap.box.uidvalidity += 1
+    assert email_utils.sync_mailbox(db, account)["new"] == 1
+    assert listener.index_round(db) == 1
+    job = _email_jobs(db)[-1]
+    assert job.title == "Contract" and json.loads(job.extra_meta)["source_id"] == keys["Contract"]
+
+def test_idle_reports_new_mail(servers, account):
+    imap, _ = servers
+    M = mail_pool_utils.open_imap(*email_utils.imap_creds(account), unbuffered=True)
+    try:
+        M.select("INBOX", readonly=True)
+        stop = threading.Event()
+        assert listener.idle(M, stop, 0.2) is False
+        threading.Timer(0.2, imap.box.add, args=("Pushed", "Hello")).start()
+        assert listener.idle(M, stop, 5) is True
+    finally:
+        M.logout()
+
+def test_listener_stores_pushed_mail(db, servers, account, listener_state):
+    imap, _ = servers
+    stop = threading.Event()
+    thread = threading.Thread(target=listener._listen, args=(account.id, email_utils.imap_creds(account), stop),
+                              daemon=True)
+    thread.start()
+    try:
+        stored = lambda: email_utils.mailbox_query(db, account.id).count()
+        assert _wait(lambda: stored() == 2)
+        imap.box.add("Pushed", "Arrived while idling.")
+        assert _wait(lambda: stored() == 3)
+    finally:
+        stop.set()
+        thread.join(5)
+    assert not thread.is_alive()
+    assert imap.count("IDLE") >= 1
+
+def test_one_process_holds_the_listener_lease(db, monkeypatch):
+    assert listener._hold_lease(db, "host:1")
+    assert not listener._hold_lease(db, "host:2")
+    assert listener._hold_lease(db, "host:1")  # renewal
+    # The holder stops renewing: once the lease expires another process takes over
+    lease = db.get(models.ServiceLease, "mail-listener")
+    lease.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert listener._hold_lease(db, "host:2")
+    assert not listener._hold_lease(db, "host:1")
+
+def test_round_stops_when_the_lease_is_lost(db, servers, account, listener_state, monkeypatch):
+    email_utils.sync_mailbox(db, account)
+    assert listener._hold_lease(db, "host:1")
+    get_body = email_utils.get_body
+    def slow_body(db, account, message):
+        # The first fetch outlasts the lease and another process takes over
+        db.query(models.ServiceLease).update({"holder": "host:2", "expires_at": datetime.utcnow() + timedelta(minutes=5)})
+        db.commit()
+        return get_body(db, account, message)
+    monkeypatch.setattr(email_utils, "get_body", slow_body)
+    assert listener.index_round(db, "host:1") == 1
+    assert listener.get_stats()["lease_lost"] == 1
+    assert db.query(models.MailMessage).filter(models.MailMessage.indexed_at.is_(None)).count() == 1
+    # The new holder's round picks up the rest
+    monkeypatch.setattr(email_utils, "get_body", get_body)
+    assert listener.index_round(db, "host:2") == 1
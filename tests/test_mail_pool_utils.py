@@ -0,0 +1,80 @@
+import threading
+import time
+import models
+import email_utils
+import mail_pool_utils
+import fake_mail
+
+def _stats(account, user=None, password="secret"):
+    return email_utils.get_mail_stats(account.imap_host, account.imap_port, user or account.email, password)
+
+def test_calls_share_one_session(db, servers, account):
+    imap, _ = servers
+    assert email_utils.sync_mailbox(db, account) == {"new": 2, "error": None}
+    assert _stats(account) == {"unread": 2, "total": 2, "error": None}
+    message = email_utils.mailbox_query(db, account.id).filter(models.MailMessage.uid == 1).one()
+    body, err = email_utils.get_body(db, account, message)
+    assert err is None and "Revenue is up" in body
+    imap.box.add("Lunch", "Noon on Friday?")
+    assert email_utils.sync_mailbox(db, account) == {"new": 1, "error": None}
+    assert imap.count("LOGIN") == 1 and imap.connections == 1
+
+def test_reconnects_after_server_drop(db, servers, account):
+    imap, _ = servers
+    email_utils.sync_mailbox(db, account)
+    imap.drop_all()
+    time.sleep(0.1)
+    imap.box.add("After the drop", "Still arriving.")
+    assert email_utils.sync_mailbox(db, account) == {"new": 1, "error": None}
+    assert mail_pool_utils.imap_pool.stats()["reconnects"] == 1
+
+def test_keepalive_noops_idle_sessions(servers, account, monkeypatch):
+    imap, _ = servers
+    pool = mail_pool_utils.imap_pool
+    _stats(account)
+    noops, logins = imap.count("NOOP"), imap.count("LOGIN")
+    monkeypatch.setattr(pool, "ping_after", 0.05)
+    time.sleep(0.1)
+    pool.maintain(keepalive=True)
+    monkeypatch.setattr(pool, "ping_after", mail_pool_utils.MAIL_POOL_KEEPALIVE_SECONDS)
+    assert _stats(account)["error"] is None
+    assert imap.count("NOOP") == noops + 1 and imap.count("LOGIN") == logins
+
+def test_connection_cap_per_provider(servers, account, monkeypatch):
+    # Three accounts on one host, at most two connections at a time
+    imap, _ = servers
+    monkeypatch.setattr(mail_pool_utils.imap_pool, "max_per_provider", 2)
+    imap.delays["STATUS"] = 0.3
+    outcomes = []
+    threads = [threading.Thread(target=lambda u=u: outcomes.append(_stats(account, user=u))) for u in fake_mail.USERS]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [o["error"] for o in outcomes] == [None] * len(fake_mail.USERS)
+    assert imap.max_active <= 2
+
+def test_idle_sessions_are_logged_out(servers, account, monkeypatch):
+    imap, _ = servers
+    pool = mail_pool_utils.imap_pool
+    _stats(account)
+    monkeypatch.setattr(pool, "idle_seconds", 0)
+    pool.maintain(keepalive=True)
+    assert pool.stats()["live"] == {} and imap.count("LOGOUT") == 1
+
+def test_changed_password_does_not_reuse_session(servers, account):
+    imap, _ = servers
+    assert _stats(account)["error"] is None
+    assert "invalid credentials" in _stats(account, password="wrong")["error"]
+    assert imap.count("LOGIN") == 2
+
+def test_smtp_burst_shares_one_connection(servers):
+    _, smtp = servers
+    send = lambda subject, password="secret": email_utils.send_email_smtp(
+        "localhost", smtp.port, "me@example.com", password, "bob@example.com", subject, "Hello")
+    assert all(send(f"Update {i}").startswith("✅") for i in range(5))
+    assert smtp.connections == 1 and len(smtp.delivered) == 5
+    smtp.drop_all()
+    time.sleep(0.1)
+    assert send("After drop").startswith("✅") and len(smtp.delivered) == 6
+    assert send("x", password="wrong").startswith("❌")
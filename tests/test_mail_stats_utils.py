@@ -0,0 +1,68 @@
+import time
+import pytest
+import email_utils
+import mail_stats_utils as mail_stats
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(mail_stats, "_entries", {})
+    monkeypatch.setattr(mail_stats, "_refreshing", set())
+    monkeypatch.setattr(mail_stats, "_stats", {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0})
+    monkeypatch.setattr(mail_stats, "_executor", None)
+    yield
+    if mail_stats._executor is not None:
+        mail_stats._executor.shutdown(wait=True)
+
+def _settled(seconds=10):
+    deadline = time.time() + seconds
+    while time.time() < deadline and mail_stats.get_stats()["refreshing"]:
+        time.sleep(0.02)
+    return not mail_stats.get_stats()["refreshing"]
+
+def test_first_read_is_pending_then_served_from_memory(servers, account):
+    imap, _ = servers
+    assert mail_stats.get_all([account]) == {account.id: {"unread": 0, "total": 0, "error": None, "pending": True}}
+    assert _settled()
+    statuses = imap.count("STATUS")
+    assert mail_stats.get_all([account]) == {account.id: {"unread": 2, "total": 2, "error": None}}
+    assert imap.count("STATUS") == statuses
+    stats = mail_stats.get_stats()
+    assert (stats["hits"], stats["misses"], stats["refreshes"], stats["accounts"]) == (1, 1, 1, 1)
+
+def test_stale_entry_is_refreshed_in_the_background(servers, account, monkeypatch):
+    imap, _ = servers
+    mail_stats.get_all([account])
+    assert _settled()
+    monkeypatch.setattr(mail_stats, "MAIL_STATS_TTL_SECONDS", 0)
+    imap.box.add("Lunch", "Noon on Friday?")
+    # The stale counts are returned at once, the new ones after the refresh
+    assert mail_stats.get_all([account])[account.id]["total"] == 2
+    assert _settled()
+    assert mail_stats.get_all([account])[account.id]["total"] == 3
+
+def test_refresh_in_flight_is_not_queued_twice(servers, account):
+    imap, _ = servers
+    imap.delays["STATUS"] = 0.3
+    statuses = imap.count("STATUS")
+    mail_stats.refresh([account])
+    mail_stats.refresh([account])
+    assert _settled()
+    assert imap.count("STATUS") == statuses + 1
+
+def test_failed_refresh_keeps_last_good_counts(servers, account, monkeypatch):
+    mail_stats.get_all([account])
+    assert _settled()
+    monkeypatch.setattr(email_utils, "get_mail_stats", lambda *creds: dict(mail_stats.EMPTY_STATS, error="timed out"))
+    mail_stats.refresh([account])
+    assert _settled()
+    assert mail_stats.get_all([account])[account.id] == {"unread": 2, "total": 2, "error": "timed out"}
+    assert mail_stats.get_stats()["errors"] == 1
+
+def test_changed_credentials_are_not_served_old_counts(db, servers, account):
+    mail_stats.get_all([account])
+    assert _settled()
+    account.password = "wrong"
+    db.commit()
+    assert mail_stats.get_all([account])[account.id].get("pending")
+    assert _settled()
+    assert "invalid credentials" in mail_stats.get_all([account])[account.id]["error"]
@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta
+import models
+import metrics_utils
+
+def test_meeting_counts_from_one_subquery(tmp_path):
+    db = models.init_db(str(tmp_path / "app.db"))()
+    now = datetime.now()
+    db.add_all([models.Meeting(title="next week", date_time=now + timedelta(days=7)),
+                models.Meeting(title="yesterday", date_time=now - timedelta(days=1)),
+                models.Meeting(title="unscheduled")])
+    db.commit()
+    m = metrics_utils.compute_metrics(db)
+    assert (m["total_meetings"], m["upcoming_meetings"]) == (3, 1)
+
+def test_empty_database(tmp_path):
+    db = models.init_db(str(tmp_path / "app.db"))()
+    m = metrics_utils.compute_metrics(db)
+    assert m["total_meetings"] == m["upcoming_meetings"] == m["total_tasks"] == 0
+    assert m["total_amount"] == 0.0
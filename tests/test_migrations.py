@@ -0,0 +1,72 @@
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, text
+import models
+import migrations
+
+def _engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+
+def test_fresh_database_is_current(tmp_path):
+    engine = _engine(tmp_path)
+    models.Base.metadata.create_all(engine)
+    assert migrations.migrate(engine) == [v for v, _, _ in migrations.MIGRATIONS]
+    assert migrations.migrate(engine) == []
+    assert all(m["applied"] for m in migrations.status(engine))
+
+def test_old_schema_is_brought_up_to_date(tmp_path):
+    engine = _engine(tmp_path)
+    with engine.begin() as conn:
+        # email_accounts as it was before the IMAP sync columns
+        conn.execute(text("CREATE TABLE email_accounts (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL, "
+                          "password VARCHAR NOT NULL, imap_host VARCHAR, imap_port INTEGER, "
+                          "smtp_host VARCHAR, smtp_port INTEGER, provider VARCHAR)"))
+        conn.execute(text("INSERT INTO email_accounts (email, password) VALUES ('a@example.com', 'pw')"))
+    models.Base.metadata.create_all(engine)
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        for column in ("uid_validity", "uid_next", "last_synced"):
+            assert migrations.column_exists(conn, "email_accounts", column)
+        assert conn.execute(text("SELECT email FROM email_accounts")).scalar() == "a@example.com"
+
+def test_steps_rerun_without_error(tmp_path):
+    # A migration interrupted after its DDL but before its record is run again
+    engine = _engine(tmp_path)
+    models.Base.metadata.create_all(engine)
+    migrations.migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM schema_migrations"))
+    assert migrations.migrate(engine) == [v for v, _, _ in migrations.MIGRATIONS]
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar() == len(migrations.MIGRATIONS)
+
+def test_concurrent_runs_apply_each_step_once(tmp_path, monkeypatch):
+    # Two workers starting together on a database that predates every migration
+    runs = []
+    def slow_step(conn):
+        runs.append(threading.current_thread().name)
+        time.sleep(0.2)
+        migrations.add_column(conn, "tasks", "estimate", "INTEGER")
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(99, "Slow step", slow_step)])
+    models.Base.metadata.create_all(_engine(tmp_path))
+    results = {}
+    def worker():
+        results[threading.current_thread().name] = migrations.migrate(_engine(tmp_path))
+    threads = [threading.Thread(target=worker, name=f"worker-{i}") for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(runs) == 1
+    assert sorted(results.values()) == [[], [v for v, _, _ in migrations.MIGRATIONS]]
+
+def test_failed_step_leaves_nothing_recorded(tmp_path, monkeypatch):
+    def broken(conn):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(99, "Broken", broken)])
+    engine = _engine(tmp_path)
+    models.Base.metadata.create_all(engine)
+    with pytest.raises(RuntimeError):
+        migrations.migrate(engine)
+    assert migrations.applied_versions(engine) == set()
@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy import text
+import models
+
+def _pragmas(engine):
+    with engine.connect() as conn:
+        return {name: conn.execute(text(f"PRAGMA {name}")).scalar()
+                for name in ("journal_mode", "busy_timeout", "synchronous", "mmap_size", "cache_size")}
+
+def test_tuned_profile_is_applied_to_every_connection(tmp_path):
+    engine = models.create_db_engine(str(tmp_path / "app.db"), models.storage_profile("tuned"))
+    # NORMAL is 1; mmap_size may be capped by the build, but is switched on
+    assert {k: v for k, v in _pragmas(engine).items() if k != "mmap_size"} == {
+        "journal_mode": "wal", "busy_timeout": 15000, "synchronous": 1, "cache_size": -64000}
+    assert _pragmas(engine)["mmap_size"] > 0
+
+def test_legacy_profile_keeps_sqlite_defaults(tmp_path):
+    engine = models.create_db_engine(str(tmp_path / "app.db"), models.storage_profile("legacy"))
+    # FULL is 2
+    assert {k: v for k, v in _pragmas(engine).items() if k != "cache_size"} == {
+        "journal_mode": "delete", "busy_timeout": 5000, "synchronous": 2, "mmap_size": 0}
+
+def test_environment_overrides(monkeypatch):
+    monkeypatch.setenv("SQLITE_PROFILE", "tuned")
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT_MS", "2500")
+    monkeypatch.setenv("SQLITE_SYNCHRONOUS", "FULL")
+    monkeypatch.setenv("SQLITE_CACHE_SIZE", "-2000")
+    profile = models.storage_profile()
+    assert (profile["name"], profile["busy_timeout_ms"], profile["synchronous"], profile["cache_size"]) == ("tuned", 2500, "FULL", -2000)
+    with pytest.raises(KeyError):
+        models.storage_profile("fastest")
@@ -0,0 +1,60 @@
+from datetime import date
+import pytest
+import models
+import page_utils
+
+@pytest.fixture
+def db(tmp_path):
+    db = models.init_db(str(tmp_path / "app.db"))()
+    # Ties on due_date and a NULL run in the middle of the id range
+    dues = [date(2024, 1, 3), None, date(2024, 1, 1), date(2024, 1, 3), None, None,
+            date(2024, 1, 2), None, date(2024, 1, 1)]
+    db.add_all([models.Task(title=f"t{i}", due_date=d) for i, d in enumerate(dues)])
+    db.commit()
+    yield db
+    db.close()
+
+def _expected(db, desc):
+    tasks = db.query(models.Task).all()
+    dated = sorted((t for t in tasks if t.due_date), key=lambda t: (t.due_date, t.id), reverse=desc)
+    undated = sorted((t for t in tasks if not t.due_date), key=lambda t: t.id, reverse=desc)
+    # SQLite puts NULLs first ascending and last descending
+    return [t.id for t in (dated + undated if desc else undated + dated)]
+
+def _walk(db, limit, desc):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page = page_utils.keyset_page(db.query(models.Task), models.Task.due_date, models.Task.id,
+                                      cursor=cursor, limit=limit, desc=desc)
+        ids += [t.id for t in page["items"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if not cursor:
+            return ids, pages
+
+@pytest.mark.parametrize("desc", [True, False])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 9, 20])
+def test_pages_cover_every_row_once_in_order(db, desc, limit):
+    ids, pages = _walk(db, limit, desc)
+    assert ids == _expected(db, desc)
+    assert pages == max(1, -(-len(ids) // limit))
+
+def test_cursor_inside_null_run(db):
+    # Descending, the NULL run comes last: a cursor on its first row continues by id
+    expected = _expected(db, desc=True)
+    first_null = next(t for t in db.query(models.Task).order_by(models.Task.id.desc()) if t.due_date is None)
+    cursor = page_utils.encode_cursor(None, first_null.id)
+    page = page_utils.keyset_page(db.query(models.Task), models.Task.due_date, models.Task.id,
+                                  cursor=cursor, limit=20)
+    assert [t.id for t in page["items"]] == expected[expected.index(first_null.id) + 1:]
+    assert page["next_cursor"] is None
+
+def test_cursor_round_trips_dates():
+    cursor = page_utils.encode_cursor(date(2024, 1, 3), 7)
+    assert page_utils.decode_cursor(cursor, models.Task.due_date) == (date(2024, 1, 3), 7)
+    assert page_utils.decode_cursor(page_utils.encode_cursor(None, 2), models.Task.due_date) == (None, 2)
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", page_utils.encode_cursor("yesterday", 1)])
+def test_invalid_cursor(db, cursor):
+    with pytest.raises(page_utils.InvalidCursor):
+        page_utils.keyset_page(db.query(models.Task), models.Task.due_date, models.Task.id, cursor=cursor)
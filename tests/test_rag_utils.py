@@ -0,0 +1,136 @@
+import pytest
+import fake_chroma
+import rag_utils
+from cache_utils import EmbeddingCache
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+    def answer(messages, max_new_tokens=400, temperature=0.2, route="default"):
+        calls.append(messages)
+        return f"Answer {len(calls)}"
+    monkeypatch.setattr(rag_utils, "safe_call_llm", answer)
+    return calls
+
+def test_repeated_question_is_answered_from_cache(memory, llm):
+    rag_utils.index_into_memory("note", "Budget", "The budget review moved to Thursday afternoon.", source_id=1)
+    question = "When is the budget review?"
+    assert rag_utils.ask_seva_sakha(question) == "Answer 1"
+    assert rag_utils.ask_seva_sakha(question) == "Answer 1"
+    assert len(llm) == 1 and rag_utils.answer_cache.hits == 1
+    # The cached answer is scoped: another scope asks the model again
+    assert rag_utils.ask_seva_sakha(question, scope="note") == "Answer 2"
+
+def test_new_data_retires_cached_answers(memory, llm):
+    rag_utils.index_into_memory("note", "Budget", "The budget review moved to Thursday afternoon.", source_id=1)
+    question = "When is the budget review?"
+    rag_utils.ask_seva_sakha(question)
+    rag_utils.index_into_memory("note", "Budget", "The budget review moved to Friday morning.", source_id=1)
+    assert rag_utils.ask_seva_sakha(question) == "Answer 2"
+    assert "Friday morning" in llm[-1][1]["content"]
+
+def test_failed_answer_is_not_cached(memory, monkeypatch):
+    rag_utils.index_into_memory("note", "Budget", "The budget review moved to Thursday afternoon.", source_id=1)
+    monkeypatch.setattr(rag_utils, "safe_call_llm", lambda *a, **k: "❌ Mistral API Error: 503 - busy")
+    rag_utils.ask_seva_sakha("When is the budget review?")
+    assert rag_utils.answer_cache.stats()["entries"] == 0
+
+def _ids(memory, source_id):
+    return set(memory.get(where={"source_id": str(source_id)}, include=[])["ids"])
+
+def _paragraphs(*words):
+    return "\n\n".join(f"{w.title()} section. " + f"{w} " * 150 for w in words)
+
+def test_unchanged_content_is_not_embedded_again(memory):
+    text = _paragraphs("alpha", "beta", "gamma")
+    rag_utils.index_into_memory("task", "Plan", text, source_id=7)
+    embedded = len(memory.embedded)
+    assert "already up to date" in rag_utils.index_into_memory("task", "Plan (renamed)", text, source_id=7)
+    assert len(memory.embedded) == embedded
+    # The metadata is still refreshed
+    assert {m["title"] for m in memory.get(include=["metadatas"])["metadatas"]} == {"Plan (renamed)"}
+
+def test_edit_replaces_only_changed_chunks(memory):
+    rag_utils.index_into_memory("task", "Plan", _paragraphs("alpha", "beta", "gamma"), source_id=7)
+    rag_utils.index_into_memory("task", "Other", "Unrelated task.", source_id=8)
+    before, other = _ids(memory, 7), _ids(memory, 8)
+    embedded = len(memory.embedded)
+    edited = _paragraphs("alpha", "beta", "delta")
+    rag_utils.index_into_memory("task", "Plan", edited, source_id=7)
+    chunks = rag_utils.chunk_text(edited)
+    seen = {}
+    assert _ids(memory, 7) == {rag_utils.chunk_id("task", "7", c, seen) for c in chunks}
+    assert before & _ids(memory, 7) and before - _ids(memory, 7)
+    assert len(memory.embedded) - embedded == len(_ids(memory, 7) - before)
+    assert _ids(memory, 8) == other
+
+def test_remove_from_memory(memory):
+    rag_utils.index_into_memory("task", "Plan", _paragraphs("alpha", "beta"), source_id=7)
+    rag_utils.index_into_memory("contact", "Plan", "Contact seven.", source_id=7)
+    assert rag_utils.remove_from_memory("task", 7) == len(rag_utils.chunk_text(_paragraphs("alpha", "beta")))
+    assert rag_utils.lexical_search("alpha") == []
+    # Only the task's chunks go: same source id, other source type
+    assert [m["source_type"] for m in memory.get(include=["metadatas"])["metadatas"]] == ["contact"]
+    assert rag_utils.remove_from_memory("task", 7) == 0
+
+def test_rows_without_an_id_are_keyed_by_content(memory):
+    rag_utils.index_into_memory("interaction", "Conversation Memory", "Call Bob about the lease.")
+    rag_utils.index_into_memory("interaction", "Conversation Memory", "Book the flight to Jakarta.")
+    rag_utils.index_into_memory("interaction", "Conversation Memory", "Call Bob about the lease.")
+    assert memory.count() == 2
+
+def test_prechunked_input_needs_a_source_id(memory):
+    with pytest.raises(ValueError):
+        rag_utils.index_chunks_into_memory("document", "notes.txt", ["some text"])
+
+class WordCounts(rag_utils.EmbeddingProvider):
+    name = "local"
+    model = "sentence-transformers/All-MiniLM-L6-v2"
+    dim = fake_chroma.DIM
+
+    def __init__(self):
+        self.embedded = []
+        self._embed = fake_chroma.HashEmbedding()
+
+    def embed(self, texts):
+        self.embedded += list(texts)
+        return self._embed(texts)
+
+def test_provider_must_implement_embed():
+    class Incomplete(rag_utils.EmbeddingProvider):
+        name = "incomplete"
+    with pytest.raises(TypeError):
+        Incomplete()
+    with pytest.raises(ValueError):
+        rag_utils.make_embedding_provider("nope")
+
+def test_collection_name_for():
+    assert rag_utils.collection_name_for(rag_utils.MistralEmbeddingProvider()) == rag_utils.CHROMA_COLLECTION
+    assert rag_utils.collection_name_for(WordCounts()) == "executive_memory_local_all_minilm_l6_v2"
+
+def test_new_collection_is_tagged_with_the_provider():
+    collection = fake_chroma.Collection(metadata={"hnsw:space": "l2"})
+    rag_utils.check_collection_space(collection, WordCounts())
+    assert collection.metadata == {"embed_provider": "local", "embed_model": WordCounts.model, "embed_dim": fake_chroma.DIM}
+    # Tagged by the same provider: accepted as is
+    rag_utils.check_collection_space(collection, WordCounts())
+
+def test_collection_of_another_space_is_refused():
+    collection = fake_chroma.Collection(metadata=rag_utils.MistralEmbeddingProvider().describe())
+    with pytest.raises(RuntimeError, match="refusing to mix"):
+        rag_utils.check_collection_space(collection, WordCounts())
+
+def test_untagged_vectors_are_assumed_mistral():
+    collection = fake_chroma.Collection(metadata=None)
+    collection.upsert(ids=["a"], metadatas=[{}], documents=["old chunk"])
+    with pytest.raises(RuntimeError, match="untagged vectors"):
+        rag_utils.check_collection_space(collection, WordCounts())
+    rag_utils.check_collection_space(collection, rag_utils.MistralEmbeddingProvider())
+    assert collection.metadata["embed_provider"] == "mistral"
+
+def test_cached_embedding_function_embeds_each_text_once(tmp_path):
+    provider = WordCounts()
+    embed = rag_utils.CachedEmbeddingFunction(provider, cache=EmbeddingCache(str(tmp_path / "cache.db")))
+    first = embed(["alpha", "beta", "alpha"])
+    assert embed(["beta", "gamma"]) == [first[1], provider._embed(["gamma"])[0]]
+    assert provider.embedded == ["alpha", "beta", "gamma"]
@@ -0,0 +1,69 @@
+import rerank_utils
+
+def hit(id, document, score, **meta):
+    return {"id": id, "document": document, "score": score, "meta": meta}
+
+def test_merges_consecutive_windows_of_one_source():
+    hits = [hit("note:7:b", "world, hello again", 0.4, source_type="note", source_id="7", chunk_index=1),
+            hit("note:7:a", "hello world, ", 0.9, source_type="note", source_id="7", chunk_index=0)]
+    [merged] = rerank_utils.merge_adjacent(hits)
+    assert merged["document"] == "hello world, hello again"
+    assert merged["score"] == 0.9
+    assert merged["ids"] == ["note:7:a", "note:7:b"]
+
+def test_runs_are_capped():
+    hits = [hit(f"doc:1:{i}", f"part {i} ", 1.0 - i / 10, source_type="document", source_id="1", chunk_index=i)
+            for i in range(rerank_utils.MAX_MERGED_CHUNKS + 1)]
+    merged = rerank_utils.merge_adjacent(hits)
+    assert [len(m.get("ids", [m["id"]])) for m in merged] == [rerank_utils.MAX_MERGED_CHUNKS, 1]
+
+def test_legacy_chunks_of_different_documents_stay_apart():
+    # Indexed before source ids: only the id prefix tells the documents apart
+    hits = [hit("document_aaaa1111_0", "AAAA alpha", 0.9, source_type="document", title="A.pdf", chunk_index=0),
+            hit("document_bbbb2222_1", "BBBB beta", 0.8, source_type="document", title="B.pdf", chunk_index=1)]
+    merged = rerank_utils.merge_adjacent(hits)
+    assert sorted(m["document"] for m in merged) == ["AAAA alpha", "BBBB beta"]
+
+def test_legacy_chunks_of_one_document_merge():
+    hits = [hit("document_aaaa1111_0", "AAAA alpha ", 0.9, source_type="document", chunk_index=0),
+            hit("document_aaaa1111_1", "omega", 0.8, source_type="document", chunk_index=1)]
+    [merged] = rerank_utils.merge_adjacent(hits)
+    assert merged["document"] == "AAAA alpha omega"
+
+def test_hits_with_the_same_index_are_kept():
+    contacts = [hit(f"contact_{n:08x}_0", f"Contact {n}", 0.5 + n / 10, source_type="contact", chunk_index=0)
+                for n in range(4)]
+    assert len(rerank_utils.merge_adjacent(contacts)) == 4
+    # Same source and index twice (e.g. vector and lexical copies) is not merged or dropped either
+    twice = [hit("note:1:a", "same", 0.9, source_type="note", source_id="1", chunk_index=0),
+             hit("note:1:a2", "same again", 0.7, source_type="note", source_id="1", chunk_index=0)]
+    assert len(rerank_utils.merge_adjacent(twice)) == 2
+
+def test_unknown_document_is_left_alone():
+    hits = [hit("", "no id", 0.5, source_type="note", chunk_index=0),
+            hit("x", "no index", 0.4, source_type="note", source_id="1")]
+    assert [m["document"] for m in rerank_utils.merge_adjacent(hits)] == ["no id", "no index"]
+
+def test_drop_duplicates_keeps_best_copy():
+    text = "the quarterly budget review moved to thursday afternoon in room four"
+    hits = [hit("a", text, 0.9), hit("b", "  " + text.upper(), 0.8), hit("c", "lunch order for friday", 0.7)]
+    assert [h["id"] for h in rerank_utils.drop_duplicates(hits)] == ["a", "c"]
+
+def test_mmr_prefers_a_distinct_passage():
+    hits = [hit("a", "budget review figures", 1.0), hit("b", "budget review figures again", 1.0),
+            hit("c", "meeting moved to thursday", 1.0)]
+    assert rerank_utils.mmr_order(hits, [1.0, 0.95, 0.6], lam=0.5) == [0, 2, 1]
+    assert rerank_utils.mmr_order(hits, [1.0, 0.95, 0.6], lam=1.0) == [0, 1, 2]
+
+def test_rerank():
+    budget = "budget review figures for the quarter"
+    hits = [hit("n1", budget, 0.90, source_type="note", source_id="1", chunk_index=0),
+            hit("n2", budget, 0.85, source_type="note", source_id="2", chunk_index=0),
+            hit("m3", "budget meeting moved to thursday", 0.60, source_type="meeting", source_id="3", chunk_index=0),
+            hit("e4", "lunch order for friday", 0.50, source_type="email", source_id="4", chunk_index=0)]
+    kept = rerank_utils.rerank("budget review", hits, top_k=2)
+    # The copy of n1 is dropped and the passage without query terms ranks last
+    assert [h["id"] for h in kept] == ["n1", "m3"]
+    assert [h["mmr_rank"] for h in kept] == [0, 1]
+    assert kept[0]["rerank_score"] > kept[1]["rerank_score"]
+    assert rerank_utils.rerank("anything", []) == []
@@ -0,0 +1,57 @@
+from datetime import date
+import pytest
+import models
+import rollup_utils
+
+@pytest.fixture
+def db(tmp_path):
+    db = models.init_db(str(tmp_path / "app.db"))()
+    expenses = [(date(2023, 12, 31), "Travel", 100.0), (date(2024, 1, 5), "Travel", 40.0),
+                (date(2024, 1, 5), "Meals", 12.5), (date(2024, 1, 20), None, 7.5), (date(2024, 3, 1), "Meals", 20.0)]
+    db.add_all(models.Expense(title=f"e{i}", date=d, category=c, amount=a) for i, (d, c, a) in enumerate(expenses))
+    db.commit()
+    yield db
+    db.close()
+
+@pytest.mark.parametrize("today, months_back, period", [
+    (date(2024, 12, 31), 11, "2024-01"),
+    (date(2024, 3, 31), 11, "2023-04"),
+    (date(2024, 1, 1), 1, "2023-12"),
+    (date(2024, 5, 15), 0, "2024-05"),
+    (date(2024, 2, 29), 12, "2023-02"),
+])
+def test_month_period(today, months_back, period):
+    assert rollup_utils.month_period(today, months_back=months_back) == period
+
+def test_twelve_month_window_has_twelve_periods():
+    # What /reports asks for: this month and the eleven before it
+    today = date(2024, 3, 31)
+    start, end = rollup_utils.month_period(today, 11), rollup_utils.month_period(today)
+    months = {rollup_utils.month_period(date(2022 + y, m, 1)) for y in range(4) for m in range(1, 13)}
+    assert len([p for p in months if start <= p <= end]) == 12
+
+def test_expense_series(db):
+    assert rollup_utils.expense_series(db) == [
+        {"period": "2023-12", "count": 1, "amount": 100.0},
+        {"period": "2024-01", "count": 3, "amount": 60.0},
+        {"period": "2024-03", "count": 1, "amount": 20.0}]
+    assert rollup_utils.expense_series(db, start="2024-01", end="2024-02") == [{"period": "2024-01", "count": 3, "amount": 60.0}]
+    assert rollup_utils.expense_series(db, grain="day", category="Travel") == [
+        {"period": "2023-12-31", "count": 1, "amount": 100.0}, {"period": "2024-01-05", "count": 1, "amount": 40.0}]
+
+def test_expense_by_category(db):
+    assert rollup_utils.expense_by_category(db, start="2024-01") == [
+        {"category": "Travel", "count": 1, "amount": 40.0},
+        {"category": "Meals", "count": 2, "amount": 32.5},
+        {"category": "Uncategorized", "count": 1, "amount": 7.5}]
+
+def test_edits_and_deletes_move_the_rollups(db):
+    meal = db.query(models.Expense).filter(models.Expense.amount == 20.0).one()
+    meal.date, meal.category = date(2024, 1, 6), "Travel"
+    db.delete(db.query(models.Expense).filter(models.Expense.category.is_(None)).one())
+    db.commit()
+    assert rollup_utils.expense_series(db, start="2024-01") == [{"period": "2024-01", "count": 3, "amount": 72.5}]
+    assert rollup_utils.expense_by_category(db, start="2024-01")[0] == {"category": "Travel", "count": 2, "amount": 60.0}
+    assert rollup_utils.in_sync(db)
+    rollup_utils.rebuild(db)
+    assert rollup_utils.expense_series(db, start="2024-01") == [{"period": "2024-01", "count": 3, "amount": 72.5}]
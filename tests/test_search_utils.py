@@ -0,0 +1,24 @@
+import search_utils
+
+def test_fts_query():
+    assert search_utils.fts_query("what is the phone of 555-0100") == '"phone" OR "555 0100" OR "555" OR "0100"'
+    assert search_utils.fts_query("what is it") is None
+
+def test_upsert_replaces_chunk(tmp_path):
+    index = search_utils.LexicalIndex(str(tmp_path / "lexical.db"))
+    index.upsert(["c1"], [{"source_type": "note", "title": "Budget"}], ["old figures"])
+    index.upsert(["c1"], [{"source_type": "note", "title": "Budget"}], ["new figures"])
+    assert index.count() == 1
+    assert [h["document"] for h in index.search("figures")] == ["new figures"]
+
+def test_concurrent_writers_do_not_collide(tmp_path):
+    # Two workers backfilling the same file: the second one's _remove ran before
+    # the first committed, so it inserts a chunk id that is already there
+    path = str(tmp_path / "lexical.db")
+    first, second = search_utils.LexicalIndex(path), search_utils.LexicalIndex(path)
+    first.upsert(["c1", "c2"], [{"title": "A"}, {"title": "B"}], ["alpha", "beta"])
+    second._remove = lambda ids: None
+    second.upsert(["c1", "c2", "c3"], [{"title": "A"}, {"title": "B"}, {"title": "C"}], ["alpha", "beta", "gamma"])
+    assert first.count() == 3
+    assert len(first.search("alpha")) == 1
+    assert [h["id"] for h in second.search("gamma")] == ["c3"]
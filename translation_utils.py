@@ -1,5 +1,5 @@
-import requests
 import os
+import http_utils
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -28,12 +28,6 @@ def translate_text(text: str, target_language: str) -> str:
     
     target_lang_name = LANGUAGE_MAP.get(target_language, target_language)
     
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-    
     messages = [
         {
             "role": "system",
@@ -53,7 +47,7 @@ def translate_text(text: str, target_language: str) -> str:
     }
     
     try:
-        response = requests.post(MISTRAL_API_URL, headers=headers, json=payload, timeout=30)
+        response = http_utils.post_json("translate", MISTRAL_API_URL, payload)
         
         if response.status_code == 200:
             result = response.json()